@@ -0,0 +1,110 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Optional, Set, TypeVar
+from telethon import TelegramClient
+import logging
+
+from profiler import PROFILER
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class AccountWorkers(Generic[T]):
+    """
+    משימת עובד קבועה לכל חשבון, שכולן מושכות מתור משותף אחד. עובד מושך פריט רק כשיש לו
+    מקום פנוי (עד max_in_flight שליחות בו-זמנית) וכשהחשבון יכול לשלוח (ready_in - לא
+    ב-FloodWait ומגביל הקצב פנוי), כך שחשבון שהתפנה לוקח מיד את העבודה הבאה, וחשבון איטי
+    או חסום לא מעכב אף אחד. אין מחסום של אצווה: כל פריט מקבל Future משלו.
+
+    slots: {account_id: Semaphore} - אפשר לחלוק אותו בין כמה מאגרי עובדים (משימות של
+    job_scheduler.py), כדי שהמגבלה תחול על החשבון ולא על המשימה. המקום המשותף נתפס רק סביב
+    השליחה עצמה, ולא בזמן ההמתנה לתור - עובד של משימה שאין לה עבודה לא חוסם משימות אחרות.
+    """
+
+    def __init__(self, send: Callable[[TelegramClient, T], Awaitable[bool]],
+                 ready_in: Callable[[TelegramClient], float], *, max_in_flight: int = 2,
+                 slots: Optional[Dict[int, asyncio.Semaphore]] = None, max_pending: int = 100):
+        self.send = send
+        self.ready_in = ready_in
+        self.max_in_flight = max_in_flight
+        self.slots = slots if slots is not None else {}
+
+        self._queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._running: Set[asyncio.Task] = set()
+
+    def add(self, client: TelegramClient):
+        """מפעיל עובד לחשבון (גם באמצע הריצה, למשל חשבון שהתחבר מאוחר)."""
+        key = client.session.auth_key.key_id
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._work(client))
+
+    def start(self, clients):
+        for client in clients:
+            self.add(client)
+        return self
+
+    async def close(self):
+        tasks = [task for task in [*self._workers.values(), *self._running] if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def pending(self) -> int:
+        """כמה פריטים ממתינים בתור ועוד לא נלקחו."""
+        return self._queue.qsize()
+
+    async def submit(self, item: T) -> asyncio.Future:
+        """מכניס פריט לתור (ממתין אם התור מלא) ומחזיר Future עם התוצאה של send או החריגה שלו."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return future
+
+    async def _work(self, client: TelegramClient):
+        # in_flight: המגבלה של המאגר הזה בלבד (כמה פריטים העובד מחזיק); המקומות המשותפים של החשבון
+        # נתפסים רק ב-_run_one, סביב השליחה
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        slots = self.slots.setdefault(client.session.auth_key.key_id, asyncio.Semaphore(self.max_in_flight))
+        while True:
+            await in_flight.acquire()
+            try:
+                # לא לוקחים עבודה לפני שהחשבון יכול לשלוח - עד אז חשבונות אחרים לוקחים אותה
+                delay = self.ready_in(client)
+                while delay > 0:
+                    with PROFILER.stage('account_wait'):
+                        await asyncio.sleep(delay)
+                    delay = self.ready_in(client)
+                item, future = await self._queue.get()
+            except BaseException:
+                in_flight.release()
+                raise
+            task = asyncio.create_task(self._run_one(client, item, future, in_flight, slots))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_one(self, client: TelegramClient, item: T, future: asyncio.Future,
+                       in_flight: asyncio.Semaphore, slots: asyncio.Semaphore):
+        try:
+            async with slots:
+                result = await self.send(client, item)
+            if not future.done():
+                future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            in_flight.release()
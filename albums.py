@@ -0,0 +1,35 @@
+from typing import AsyncIterator, Iterable, List
+from telethon.tl.types import Message
+
+# טלגרם מאפשרת עד 10 פריטים באלבום אחד
+MAX_ALBUM_SIZE = 10
+
+
+def group_albums(messages: Iterable[Message]) -> List[List[Message]]:
+    """
+    מקבץ הודעות רצופות עם אותו grouped_id לאלבום אחד (רשימה), ושאר ההודעות לרשימות של הודעה אחת.
+    הסדר המקורי נשמר, כך שאפשר לשלוח כל קבוצה בבקשה אחת.
+    """
+    groups: List[List[Message]] = []
+    for message in messages:
+        grouped_id = getattr(message, 'grouped_id', None)
+        if grouped_id and groups and groups[-1][0].grouped_id == grouped_id and len(groups[-1]) < MAX_ALBUM_SIZE:
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return groups
+
+
+async def iter_albums(messages: AsyncIterator[Message]) -> AsyncIterator[List[Message]]:
+    """כמו group_albums, עבור איטרטור אסינכרוני (למשל iter_messages) - מחזיר כל קבוצה כשהיא נסגרת."""
+    current: List[Message] = []
+    async for message in messages:
+        grouped_id = getattr(message, 'grouped_id', None)
+        if current and grouped_id and current[0].grouped_id == grouped_id and len(current) < MAX_ALBUM_SIZE:
+            current.append(message)
+            continue
+        if current:
+            yield current
+        current = [message]
+    if current:
+        yield current
@@ -1,8 +1,14 @@
 import asyncio
 import random
 from telethon import TelegramClient, errors
+from telethon.tl.types import InputMessagesFilterDocument, InputMessagesFilterVideo
 from colorama import Fore, Style
-import re
+
+from caption_transform import CaptionTransform
+from history_prefetcher import merged_history
+from live_mirror import LiveFollower
+from rate_limiter import AIMDController, RateLimiter
+from state_store import StateStore
 
 # פרטי החשבונות
 accounts = [
@@ -19,19 +25,58 @@ source_chat_id = -10099999999
 #איידי יעד הקבצים
 target_chat_id = -1009999999
 
+progress_store = StateStore()
+
+# קצב התחלתי של 20 הודעות לדקה לכל חשבון וליעד; בקר ה-AIMD מתאים אותו לפי FloodWait
+rate_limiter = RateLimiter(target_rate=20 / 60, account_rate=20 / 60)
+rate_controller = AIMDController(rate_limiter)
+
+# עיבוד הכיתובים נבנה פעם אחת: מחיקת קישורים ואזכורים, תוך שמירה על העיצוב המקורי.
+# אפשר להוסיף replace_handles={'@old': '@new'} או signature='...'
+caption_transform = CaptionTransform(strip_links=True, strip_mentions=True)
+
+# השרת מחזיר רק סרטונים וקבצים - הודעות טקסט, תמונות וסטיקרים לא מאוחזרות בכלל
+FETCH_FILTERS = [InputMessagesFilterVideo, InputMessagesFilterDocument]
+
 def save_last_processed_message_id(message_id):
-    with open("last_id.txt", "w") as f:
-        f.write(str(message_id))
+    progress_store.save_progress(source_chat_id, target_chat_id, last_message_id=message_id)
 
 def load_last_processed_message_id():
-    try:
-        with open("last_id.txt", "r") as f:
-            return int(f.read().strip())
-    except FileNotFoundError:
-        return 0
+    return progress_store.load_progress(source_chat_id, target_chat_id)['last_message_id']
 
-async def send_media(source, target, clients):
+def is_wanted(message):
+    # סרטון או קובץ - אבל לא סטיקר או תמונה
+    return (message.video or message.document) and not (message.sticker or message.photo)
+
+async def follow_new_messages(source, target, clients, follower, current_idx):
+    """מצב מעקב: מעתיק הודעות חדשות כשהן מגיעות כעדכון, בלי לשאול את ההיסטוריה כל כמה שניות."""
+    # האחזור מסונן, ולכן ההתקדמות נעצרת בהודעה המתאימה האחרונה; ההשלמה כיסתה את הערוץ עד ההודעה האחרונה בו
+    await follower.begin(load_last_processed_message_id(), await follower.latest_id())
+    while True:
+        for message in await follower.get_batch(50):
+            while is_wanted(message):
+                client = clients[current_idx]
+                try:
+                    clean_caption, entities = caption_transform.apply(message.message, message.entities)
+                    await rate_limiter.acquire(account=current_idx, target=target)
+                    await client.send_message(target, clean_caption, formatting_entities=entities, file=message.media)
+                    rate_controller.on_success(current_idx, target)
+                    follower.mark_delivered([message])
+                    print(f"{Fore.GREEN}Account {current_idx+1} mirrored msg {message.id} - {follower.latency_report()}{Style.RESET_ALL}")
+                    break
+                except errors.FloodWaitError as e:
+                    print(f"{Fore.RED}FloodWait: {e.seconds}s. Switching account...{Style.RESET_ALL}")
+                    rate_controller.on_flood(current_idx, target, e.seconds)
+                    current_idx = (current_idx + 1) % len(clients)
+                except Exception as e:
+                    print(f"{Fore.RED}Error sending message {message.id}: {e}{Style.RESET_ALL}")
+                    break
+            save_last_processed_message_id(message.id)
+
+async def send_media(source, target, clients, follow=True):
     current_idx = 0
+    # המאזין נרשם כבר עכשיו, כדי שהודעות שמתפרסמות בזמן ההשלמה יחכו בתור עד המעבר למצב מעקב
+    follower = LiveFollower(clients[0], source).start() if follow else None
     
     while True:
         client = clients[current_idx]
@@ -41,32 +86,32 @@ async def send_media(source, target, clients):
             messages_in_batch = 0
             last_processed_in_loop = last_id
             
-            # מושכים הודעות חדשות מהמקור
-            async for message in client.iter_messages(source, offset_id=last_id, reverse=True, limit=50):
+            # מושכים הודעות חדשות מהמקור, מסוננות בצד השרת וממוזגות לפי ID
+            async for message in merged_history(client, source, FETCH_FILTERS, offset_id=last_id, limit=50):
                 
                 # עדכן תמיד את ה-ID האחרון שעברנו עליו, גם אם אין מדיה
                 if message.id > last_processed_in_loop:
                     last_processed_in_loop = message.id
                 
                 # בדיקה שיש מדיה (סרטון או קובץ) - אבל לא סטיקר או תמונה
-                if (message.video or message.document) and not (message.sticker or message.photo):
+                if is_wanted(message):
                     try:
-                        # ניקוי קישורים מהטקסט
-                        clean_caption = re.sub(r'https?://\S+|www\.\S+|t\.me/\S+|@\S+', '', message.text or "").strip()
+                        # ניקוי קישורים מהטקסט הגולמי, עם הזזת ישויות העיצוב
+                        clean_caption, entities = caption_transform.apply(message.message, message.entities)
 
+                        await rate_limiter.acquire(account=current_idx, target=target)
                         await client.send_message(
                             target, 
                             clean_caption, 
+                            formatting_entities=entities,
                             file=message.media
                         )
                         
-                        print(f"{Fore.GREEN}Account {current_idx+1} copied msg {message.id} (No Credit){Style.RESET_ALL}")
+                        rate_controller.on_success(current_idx, target)
+                        print(f"{Fore.GREEN}Account {current_idx+1} copied msg {message.id} (No Credit) - rate {rate_controller.current_rate(current_idx, target):.1f}/min{Style.RESET_ALL}")
                         
                         messages_in_batch += 1
                         
-                        # השהייה אקראית למניעת זיהוי
-                        await asyncio.sleep(random.uniform(1.4, 3.8))
-                        
                         max_batch = random.randint(2, 6)
                         if messages_in_batch >= max_batch:
                             # שמור את ה-ID האחרון שע�דנו ויצא מהלולאה
@@ -75,6 +120,7 @@ async def send_media(source, target, clients):
 
                     except errors.FloodWaitError as e:
                         print(f"{Fore.RED}FloodWait: {e.seconds}s. Switching account...{Style.RESET_ALL}")
+                        rate_controller.on_flood(current_idx, target, e.seconds)
                         # שמור את ההתקדמות לפני החלפת חשבון
                         save_last_processed_message_id(last_processed_in_loop)
                         await asyncio.sleep(2.8)
@@ -92,6 +138,10 @@ async def send_media(source, target, clients):
             if last_processed_in_loop > last_id:
                 save_last_processed_message_id(last_processed_in_loop)
                 print(f"{Fore.CYAN}Progress saved: up to message {last_processed_in_loop}{Style.RESET_ALL}")
+            elif follower:
+                # ההשלמה מההיסטוריה הסתיימה - מכאן הודעות חדשות מגיעות מהעדכונים
+                print(f"{Fore.CYAN}Caught up at message {last_id}. Switching to live follow mode.{Style.RESET_ALL}")
+                await follow_new_messages(source, target, clients, follower, current_idx)
 
             # החלפת חשבון
             current_idx = (current_idx + 1) % len(clients)
@@ -0,0 +1,89 @@
+"""
+השוואת ביצועים: ניקוי כיתובים הישן של backup.py (message.text, כלומר markdown, ואז re.sub)
+מול CaptionTransform שנבנה פעם אחת ועובד על הטקסט הגולמי עם הזזת ישויות העיצוב.
+
+הרצה:
+    python benchmarks/bench_caption_transform.py [מספר_כיתובים]
+לדוגמה, מיליון כיתובים:
+    python benchmarks/bench_caption_transform.py 1000000
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.extensions import markdown
+from telethon.tl.types import MessageEntityBold, MessageEntityItalic, MessageEntityTextUrl, MessageEntityUrl
+
+from caption_transform import CaptionTransform, _utf16_len
+
+WORDS = ['שלום', 'סרטון', 'חדש', 'פרק', 'עונה', 'HD', '1080p', 'להורדה', 'מלא', '🔥', '🎬', 'ערוץ', 'של', 'היום']
+LINKS = ['https://example.com/watch?v=abc123', 'www.site.co.il/page', 't.me/some_channel/42']
+HANDLES = ['@channel_one', '@backup_bot', '@news_daily']
+
+
+def synthetic_captions(count: int):
+    """כיתובים סינתטיים עם קישורים, אזכורים, אימוג'י וישויות עיצוב, כמו בערוצי מדיה אמיתיים."""
+    rng = random.Random(1)
+    captions = []
+    for _ in range(count):
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+        for _ in range(rng.randint(0, 3)):
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(LINKS + HANDLES))
+        text = ' '.join(parts)
+        entities = []
+        offset = 0
+        for part in parts:
+            length = _utf16_len(part)
+            if part in LINKS:
+                entities.append(MessageEntityUrl(offset, length))
+            elif rng.random() < 0.1:
+                entities.append(MessageEntityBold(offset, length))
+            elif rng.random() < 0.05:
+                entities.append(MessageEntityItalic(offset, length))
+            elif rng.random() < 0.02:
+                entities.append(MessageEntityTextUrl(offset, length, url='https://example.com'))
+            offset += length + 1
+        captions.append((text, entities))
+    return captions
+
+
+def measure(label, func, count):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<40} {elapsed * 1000:>10.1f} ms   {elapsed / count * 1e6:>8.2f} µs/caption")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    captions = synthetic_captions(count)
+    print(f"קורפוס סינתטי: {count:,} כיתובים\n")
+
+    def legacy():
+        # כמו ב-backup.py הישן: message.text (unparse ל-markdown) ותבנית שנבנית מחדש בכל הודעה
+        for text, entities in captions:
+            re.sub(r'https?://\S+|www\.\S+|t\.me/\S+|@\S+', '', markdown.unparse(text, entities) or "").strip()
+
+    transform = CaptionTransform(strip_links=True, strip_mentions=True)
+
+    def compiled():
+        for text, entities in captions:
+            transform.apply(text, entities)
+
+    signed = CaptionTransform(replace_handles={'@channel_one': '@my_channel'}, signature='📥 @my_channel')
+
+    def compiled_with_rules():
+        for text, entities in captions:
+            signed.apply(text, entities)
+
+    measure("markdown + re.sub (ישן, מאבד עיצוב)", legacy, count)
+    measure("CaptionTransform", compiled, count)
+    measure("CaptionTransform + החלפה + חתימה", compiled_with_rules, count)
+
+
+if __name__ == '__main__':
+    main()
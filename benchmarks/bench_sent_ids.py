@@ -0,0 +1,108 @@
+"""
+השוואת ביצועים: set + JSON (הנתיב הישן של tor.py) מול MessageIdSet בפורמט בינארי.
+
+הרצה:
+    python benchmarks/bench_sent_ids.py [מספר_הודעות] [אחוז_הודעות_מחוקות]
+לדוגמה, ערוץ של 10 מיליון הודעות עם 1% מחיקות:
+    python benchmarks/bench_sent_ids.py 10000000 1
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_id_set import MessageIdSet
+
+
+def channel_ids(total: int, deleted_percent: float):
+    """מזהי הודעות של ערוץ סינתטי, עם חורים במקום הודעות שנמחקו."""
+    rng = random.Random(1)
+    return [i for i in range(1, total + 1) if rng.random() * 100 >= deleted_percent]
+
+
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<28} {elapsed * 1000:>10.1f} ms   peak {peak / 1024:>12.1f} KB")
+    return result
+
+
+def bench_set_json(ids, path):
+    print("set + JSON (indent=2):")
+    sent = measure("build", lambda: set(ids))
+
+    def save():
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'sent_message_ids': list(sent), 'last_message_id': ids[-1]}, f, ensure_ascii=False, indent=2)
+
+    measure("save", save)
+
+    def load():
+        with open(path, 'r', encoding='utf-8') as f:
+            return set(json.load(f)['sent_message_ids'])
+
+    loaded = measure("load", load)
+    probes = random.Random(2).sample(range(1, ids[-1] + 1), 100000)
+    measure("100k membership checks", lambda: sum(1 for p in probes if p in loaded))
+    print(f"  {'file size':<28} {os.path.getsize(path) / 1024:>10.1f} KB")
+
+
+def bench_message_id_set(ids, path):
+    print("MessageIdSet (watermark + intervals, binary):")
+
+    def build():
+        # כמו ב-tor.py: מזהים חסרים בין הודעות רצופות מסומנים כטווח, ההודעות עצמן אחת-אחת
+        result = MessageIdSet()
+        previous = 0
+        for message_id in ids:
+            if message_id > previous + 1:
+                result.add_range(previous + 1, message_id - 1)
+            result.add(message_id)
+            previous = message_id
+        return result
+
+    sent = measure("build", build)
+
+    def save():
+        with open(path, 'wb') as f:
+            f.write(sent.to_bytes())
+
+    measure("save", save)
+
+    def load():
+        with open(path, 'rb') as f:
+            return MessageIdSet.from_bytes(f.read())
+
+    loaded = measure("load", load)
+    probes = random.Random(2).sample(range(1, ids[-1] + 1), 100000)
+    measure("100k membership checks", lambda: sum(1 for p in probes if p in loaded))
+    print(f"  {'file size':<28} {os.path.getsize(path) / 1024:>10.3f} KB   ({loaded!r})")
+
+    # מקרה גרוע: כל הודעה שנייה נכשלה ונשארה בתור הניסיונות
+    sparse = MessageIdSet(range(1, min(len(ids), 200000), 2))
+    print(f"  {'worst case 100k gaps':<28} {len(sparse.to_bytes()) / 1024:>10.1f} KB")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    deleted_percent = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    ids = channel_ids(total, deleted_percent)
+    print(f"ערוץ סינתטי: {total:,} מזהים, {len(ids):,} הודעות קיימות\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_set_json(ids, os.path.join(tmp, 'progress.json'))
+        print()
+        bench_message_id_set(ids, os.path.join(tmp, 'sent_ids.bin'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+השוואת ביצועים של מצבי ההעברה מול לקוח טלגרם מדומה (fake_telegram.py), בלי חשבונות אמיתיים:
+ערוץ מקור סינתטי (ברירת מחדל: 2 מיליון הודעות עם מדיה מעורבת ואלבומים), השהיה לכל בקשה,
+מגבלות flood לחשבון ולצ'אט יעד (FloodWaitError אמיתי) ורוחב פס להעלאה / הורדה.
+
+מצבים:
+    tor        - tor.py, send_messages_round עם כמה חשבונות (הודעה אחר הודעה)
+    tor-bulk   - tor.py, העתקה בכמות (ForwardMessages)
+    bob        - bob.py, התחל_העברה הודעה אחר הודעה
+    bob-bulk   - bob.py, העתקה בכמות
+    boby       - boby.py, הורדה והעלאה מחדש בזרימה
+
+לכל מצב מודפסים הודעות לשנייה, בקשות API להודעה (לפי סוג), FloodWait וזיכרון שיא (tracemalloc).
+מגביל הקצב של הסקריפטים מוחלף במגביל בלי הגבלה (או --rate), כדי למדוד את הנתיב עצמו.
+עם PROFILE_STAGES=1 נכתב גם דוח השלבים של profiler.py.
+
+הרצה:
+    python benchmarks/bench_transfer.py [--messages N] [--modes tor,bob,...] [--latency שניות] ...
+לדוגמה, 5000 הודעות מסוף ערוץ של 5 מיליון, 8 חשבונות, 50ms לבקשה והעלאה של 2MB/s:
+    python benchmarks/bench_transfer.py --messages 5000 --channel-size 5000000 --accounts 8 \\
+        --latency 0.05 --upload-mbps 2
+"""
+import argparse
+import asyncio
+import builtins
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telethon import utils
+
+import bob
+import boby
+import tor
+from fake_telegram import MB, FakeServer, FloodLimit
+from rate_limiter import AIMDController, RateLimiter
+
+SOURCE_ID = 1111111111
+TARGET_ID = 2222222222
+MODES = ['tor', 'tor-bulk', 'bob', 'bob-bulk', 'boby']
+
+
+def parse_flood(text: str) -> Optional[FloodLimit]:
+    """'count/seconds:wait' (למשל 300/30:3); '0' מבטל."""
+    if not text or text == '0':
+        return None
+    window, wait = text.split(':')
+    count, seconds = window.split('/')
+    return FloodLimit(int(count), float(seconds), int(wait))
+
+
+def build_server(args) -> FakeServer:
+    server = FakeServer(
+        latency=args.latency,
+        account_flood=parse_flood(args.account_flood),
+        chat_flood=parse_flood(args.chat_flood),
+        upload_bandwidth=args.upload_mbps * MB if args.upload_mbps else None,
+        download_bandwidth=args.download_mbps * MB if args.download_mbps else None,
+    )
+    server.add_channel(SOURCE_ID, 'מקור סינתטי', args.channel_size, username='bench_source', size_scale=args.size_scale)
+    server.add_channel(TARGET_ID, 'יעד', username='bench_target')
+    return server
+
+
+def build_limiter(args):
+    """מגביל הקצב לריצה: בלי הגבלה, או --rate הודעות לדקה לחשבון וליעד (כמו בסקריפטים)."""
+    rate = args.rate / 60 if args.rate else None
+    limiter = RateLimiter(target_rate=rate, account_rate=rate)
+    return limiter, AIMDController(limiter)
+
+
+@contextlib.contextmanager
+def scripted_input(answers: List[str]):
+    """מחליף את input() בתשובות קבועות מראש לתפריטים של הסקריפט."""
+    pending = iter(answers)
+    original = builtins.input
+    builtins.input = lambda prompt='': next(pending)
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+
+async def run_tor(server: FakeServer, args, start_id: int, bulk: bool):
+    sender = tor.TelegramSender()
+    sender.rate_limiter, sender.rate_controller = build_limiter(args)
+    sender.clients = [server.client(i + 1) for i in range(args.accounts)]
+    source_entity = server.channels[SOURCE_ID].entity
+    target_entity = server.channels[TARGET_ID].entity
+    try:
+        if not await sender.prepare_target(source_entity, target_entity):
+            raise RuntimeError('prepare_target נכשל')
+        sender.bulk_copy = bulk
+        sender.last_processed_message_id = start_id
+        await sender.send_messages_round(source_entity, ['all_media', 'all_text'])
+    finally:
+        sender.journal.close()
+        sender.state_store.close()
+
+
+async def run_single(module, server: FakeServer, args, start_id: int, menu: List[str]):
+    """bob / boby: הלקוח של הסקריפט מוחלף בלקוח המדומה, והתפריטים נענים מ-menu."""
+    client = server.client(1)
+    original = module.TelegramClient
+    module.TelegramClient = lambda *a, **kwargs: client
+    try:
+        async with module.מעביר_טלגרם() as מעביר:
+            מעביר.מגביל_קצב, מעביר.בקר_קצב = build_limiter(args)
+            # ההתקדמות נשמרת מראש כך שההעברה מתחילה ב-start_id (תשובה 1 = המשך מההודעה האחרונה)
+            מעביר.מאגר_התקדמות.save_progress(utils.get_peer_id(server.channels[SOURCE_ID].entity),
+                                              utils.get_peer_id(server.channels[TARGET_ID].entity),
+                                              client.phone, last_message_id=start_id, total_sent=0)
+            with scripted_input([client.phone, str(SOURCE_ID), str(TARGET_ID)] + menu), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                await מעביר.התחל_העברה()
+    finally:
+        module.TelegramClient = original
+
+
+def runner(mode: str) -> Callable:
+    return {
+        'tor': lambda server, args, start: run_tor(server, args, start, bulk=False),
+        'tor-bulk': lambda server, args, start: run_tor(server, args, start, bulk=True),
+        'bob': lambda server, args, start: run_single(bob, server, args, start, ['1', '1']),
+        'bob-bulk': lambda server, args, start: run_single(bob, server, args, start, ['1', '2']),
+        'boby': lambda server, args, start: run_single(boby, server, args, start, ['', '1']),
+    }[mode]
+
+
+def measure(mode: str, args):
+    server = build_server(args)
+    source = server.channels[SOURCE_ID]
+    start_id = max(0, source.size - args.messages)
+    messages = sum(source.exists(message_id) for message_id in range(start_id + 1, source.size + 1))
+
+    # כל מצב רץ בתיקייה ריקה משלו: state.db, יומן ההתקדמות וקובץ ההודעות שנכשלו נוצרים בתיקייה הנוכחית
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            asyncio.run(runner(mode)(server, args, start_id))
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+
+    calls = server.total_calls
+    top = ', '.join(f"{name} {count / messages:.2f}" for name, count in server.calls.most_common(4))
+    print(f"  {mode:<9} {messages:>8} {server.channels[TARGET_ID].received:>8} {elapsed:>9.1f} "
+          f"{messages / elapsed:>9.1f} {calls / messages:>9.2f} {server.flood_waits:>6} {peak / MB:>9.1f}   {top}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='השוואת ביצועים של מצבי ההעברה מול לקוח טלגרם מדומה')
+    parser.add_argument('--modes', default=','.join(MODES), help=f"מצבים מופרדים בפסיק ({', '.join(MODES)})")
+    parser.add_argument('--messages', type=int, default=1000, help='כמה מזהי הודעות להעביר (מסוף ערוץ המקור)')
+    parser.add_argument('--channel-size', type=int, default=2_000_000, help='מספר ההודעות בערוץ המקור')
+    parser.add_argument('--accounts', type=int, default=4, help='חשבונות במצבי tor')
+    parser.add_argument('--latency', type=float, default=0.02, help='שניות לבקשת API (בממוצע)')
+    parser.add_argument('--account-flood', default='300/30:3', help="מגבלת flood לחשבון: count/seconds:wait ('0' מבטל)")
+    parser.add_argument('--chat-flood', default='600/30:3', help="מגבלת flood לצ'אט יעד: count/seconds:wait ('0' מבטל)")
+    parser.add_argument('--upload-mbps', type=float, default=0, help='רוחב פס להעלאה לחשבון, MB לשנייה (0 = ללא הגבלה)')
+    parser.add_argument('--download-mbps', type=float, default=0, help='רוחב פס להורדה לחשבון, MB לשנייה (0 = ללא הגבלה)')
+    parser.add_argument('--size-scale', type=float, default=0.02, help='מכפיל לגודלי המדיה הסינתטיים (1 = גדלים אמיתיים)')
+    parser.add_argument('--rate', type=float, default=0, help='מגביל הקצב של הסקריפטים, הודעות לדקה (0 = ללא הגבלה)')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"מצבים לא מוכרים: {', '.join(unknown)}")
+
+    logging.disable(logging.WARNING) # הלוגים של הסקריפטים (מלבד שגיאות) לא נכנסים למדידה
+    print(f"ערוץ של {args.channel_size:,} הודעות, {args.messages:,} מזהים להעברה, השהיה {args.latency * 1000:.0f}ms, "
+          f"flood: חשבון {args.account_flood} / צ'אט {args.chat_flood}")
+    print(f"  {'mode':<9} {'messages':>8} {'sent':>8} {'seconds':>9} {'msg/s':>9} {'calls/msg':>9} {'flood':>6} {'peak_MB':>9}   calls/msg by type")
+    for mode in modes:
+        measure(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,79 @@
-from telethon import TelegramClient, errors, types
+from telethon import TelegramClient, errors, types, utils
 import asyncio
-import json
 import os
 import re
 from datetime import datetime, timedelta
 import logging
 
+import metrics
+from albums import iter_albums
+from media_cache import MediaCache
+from media_stream import upload_message_media
+from profiler import PROFILER
+from rate_limiter import AIMDController, RateLimiter
+from retry_queue import RetryPolicy, RetryQueue, classify, send_with_retries
+from state_store import StateStore
+from upload_pipeline import UploadPipeline
+
 # הגדרת לוגים
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class מעביר_טלגרם:
     def __init__(self):
-        self.API_ID = self._get_config('API_ID', )
+        self.API_ID = self._get_config('API_ID', '')
         self.API_HASH = self._get_config('API_HASH', '')
         self.PHONE_NUMBER = None
 
         self.לקוח = None
-        self.קובץ_התקדמות = 'התקדמות.json'
-        self.השהיה_בין_הודעות = 2
+        self.מאגר_התקדמות = StateStore()
+        self.מפתחות_התקדמות = {}
+        self.תורי_ניסיונות = {} # לכל יעד: הודעות שנכשלו סופית נרשמות בו לקובץ ההודעות שנכשלו
+        self.מטמון_מדיה = MediaCache(self.מאגר_התקדמות)
         self.מקס_הודעות_לדקה = 20
-        self.מונה_הודעות_בדקה = 0
-        self.זמן_תחילת_דקה = datetime.now()
+        self.מגביל_קצב = RateLimiter(target_rate=self.מקס_הודעות_לדקה / 60, account_rate=self.מקס_הודעות_לדקה / 60)
+        self.בקר_קצב = AIMDController(self.מגביל_קצב)
+        self.מדיניות_ניסיונות = RetryPolicy()
+        # כמה קבוצות מוכנות מראש (מועלות ברקע) בזמן שהקבוצה הנוכחית נשלחת, וכמה בתים לכל היותר בהעלאה
+        self.מקס_קבוצות_בהכנה = 3
+        self.מקס_בתים_בהכנה = 300 * 1024 * 1024
 
     def _get_config(self, key, default):
         return os.getenv(key, default)
 
-    def טען_התקדמות(self):
-        if os.path.exists(self.קובץ_התקדמות):
-            try:
-                with open(self.קובץ_התקדמות, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"שגיאה בטעינת התקדמות: {e}")
+    def טען_התקדמות(self, מקור, יעד):
+        מפתח = (utils.get_peer_id(מקור), utils.get_peer_id(יעד), self.PHONE_NUMBER)
+        self.מפתחות_התקדמות[utils.get_peer_id(יעד)] = מפתח
+        self.תורי_ניסיונות[utils.get_peer_id(יעד)] = RetryQueue(self.מאגר_התקדמות, *מפתח[:2])
+        try:
+            רשומה = self.מאגר_התקדמות.load_progress(*מפתח)
+            return {"הודעה_אחרונה": רשומה['last_message_id'], "סך_הועברו": רשומה['total_sent'], "תאריך_עדכון": רשומה['updated_at']}
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת התקדמות: {e}")
         return {"הודעה_אחרונה": 0, "סך_הועברו": 0, "תאריך_עדכון": str(datetime.now())}
 
-    def שמור_התקדמות(self, נתונים):
+    def שמור_התקדמות(self, יעד, נתונים):
         try:
             נתונים["תאריך_עדכון"] = str(datetime.now())
-            with open(self.קובץ_התקדמות, 'w', encoding='utf-8') as f:
-                json.dump(נתונים, f, ensure_ascii=False, indent=2)
+            self.מאגר_התקדמות.save_progress(
+                *self.מפתחות_התקדמות[utils.get_peer_id(יעד)],
+                last_message_id=נתונים["הודעה_אחרונה"],
+                total_sent=נתונים["סך_הועברו"]
+            )
         except Exception as e:
             logger.error(f"שגיאה בשמירת התקדמות: {e}")
 
-    async def בדוק_הגבלות(self):
-        זמן_שעבר = datetime.now() - self.זמן_תחילת_דקה
-        if זמן_שעבר.total_seconds() >= 60:
-            self.מונה_הודעות_בדקה = 0
-            self.זמן_תחילת_דקה = datetime.now()
+    async def בדוק_הגבלות(self, יעד):
+        await self.מגביל_קצב.acquire(account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד))
 
-        if self.מונה_הודעות_בדקה >= self.מקס_הודעות_לדקה:
-            המתנה = 60 - זמן_שעבר.total_seconds()
-            if המתנה > 0:
-                logger.info(f"הגעת להגבלת הקצב. ממתין {int(המתנה)} שניות...")
-                await asyncio.sleep(המתנה)
-            self.מונה_הודעות_בדקה = 0
-            self.זמן_תחילת_דקה = datetime.now()
+    async def שלח_עם_ניסיונות(self, שליחה, יעד):
+        """
+        שליחה עם ניסיונות חוזרים (send_with_retries); FloodWait מוריד את הקצב של החשבון מול היעד.
+        הפניה שמורה לקובץ שפגה לא נשלחת שוב - היא נזרקת מיד, והקורא מוחק אותה מהמטמון ומעלה מחדש.
+        """
+        return await send_with_retries(שליחה, self.מדיניות_ניסיונות,
+                                       lambda שניות: self.בקר_קצב.on_flood(self.PHONE_NUMBER, utils.get_peer_id(יעד), שניות),
+                                       permanent=(errors.FileReferenceExpiredError,))
 
     async def התחבר(self):
         try:
@@ -64,7 +82,7 @@ class מעביר_טלגרם:
                 self.PHONE_NUMBER = '+' + self.PHONE_NUMBER
 
             session_file = f"session_{self.PHONE_NUMBER.replace('+', '')}.session"
-            self.לקוח = TelegramClient(session_file, self.API_ID, self.API_HASH)
+            self.לקוח = PROFILER.instrument(TelegramClient(session_file, self.API_ID, self.API_HASH))
             logger.info("מתחבר לטלגרם...")
             await self.לקוח.connect()
 
@@ -83,13 +101,15 @@ class מעביר_טלגרם:
             logger.error(f"שגיאה בחיבור: {e}")
             return False
 
-    async def בחר_ערוץ(self, סוג):
+    async def בחר_ערוץ(self, סוג, רשות=False):
         print(f"\n--- בחירת ערוץ {סוג} ---")
         print("טיפ: כדי למצוא מזהה (ID) של ערוץ, העבר ממנו הודעה לבוט @userinfobot.")
         while True:
             try:
                 מזהה_קלט = input(f"\nהזן מזהה או שם משתמש של ערוץ {סוג}: ").strip()
                 if not מזהה_קלט:
+                    if רשות:
+                        return None
                     continue
                 try:
                     מזהה = int(מזהה_קלט)
@@ -103,50 +123,131 @@ class מעביר_טלגרם:
             except Exception as e:
                 logger.error(f"שגיאה בזיהוי ערוץ: {e}")
 
-    async def העבר_הודעה(self, הודעה, יעד):
+    async def הכן_מדיה(self, קבוצה):
         """
-        מוריד קבצים מהערוץ המקור ומעלה אותם כחדשים לערוץ היעד.
+        מעלה מחדש (בזרימה) את המדיה של כל הודעות הקבוצה ומחזיר רשימה מקבילה של InputMedia
+        (None להודעה בלי מדיה). רץ ברקע בתוך UploadPipeline בזמן שקבוצות קודמות נשלחות.
         """
-        try:
-            await self.בדוק_הגבלות()
+        return [await self.מדיה_להודעה(הודעה) if הודעה.media else None for הודעה in קבוצה]
+
+    async def מדיה_להודעה(self, הודעה):
+        """הפניה ממטמון המדיה אם הקובץ כבר הועלה ע"י החשבון (בלי הורדה והעלאה), אחרת העלאה מחדש בזרימה."""
+        return self.מטמון_מדיה.get(self.PHONE_NUMBER, הודעה) or await upload_message_media(self.לקוח, הודעה, self.PHONE_NUMBER)
+
+    def גודל_קבוצה(self, קבוצה):
+        # קבצים שנמצאים במטמון המדיה לא יורדים ולא עולים, ולכן לא נספרים בתקציב
+        return sum((הודעה.file.size or 0) for הודעה in קבוצה
+                   if הודעה.media and הודעה.file and self.מטמון_מדיה.get(self.PHONE_NUMBER, הודעה) is None)
+
+    async def קבוצות_להעברה(self, מקור, מהודעה):
+        # הודעות רצופות של אותו אלבום מגיעות כקבוצה אחת ונשלחות בבקשה אחת
+        async for קבוצה in iter_albums(self.לקוח.iter_messages(
+            מקור,
+            reverse=True,
+            offset_id=מהודעה
+        )):
+            קבוצה = [הודעה for הודעה in קבוצה if הודעה.id > מהודעה]
+            if קבוצה:
+                yield קבוצה
+
+    def מדיות_ליעד(self, קבוצה, חלק, מדיות):
+        """
+        המדיה לשליחת חלק מהקבוצה ליעד אחד: הפניה ממטמון המדיה אם הקובץ כבר נשלח (ליעד קודם
+        או בהרצה קודמת), אחרת מה שהועלה מראש. רשימה חדשה לכל יעד, כי העבר_אלבום משנה אותה.
+        """
+        if מדיות is None:
+            return None
+        מוכנות = dict(zip((הודעה.id for הודעה in קבוצה), מדיות))
+        return [self.מטמון_מדיה.get(self.PHONE_NUMBER, הודעה) or מוכנות[הודעה.id] for הודעה in חלק]
+
+    async def העבר_הודעה(self, הודעה, יעד, מדיה=None):
+        """
+        מוריד קבצים מהערוץ המקור ומעלה אותם כחדשים לערוץ היעד, תוך כדי ההורדה.
+        אם מדיה כבר הועלתה מראש (הכן_מדיה), היא נשלחת כמו שהיא.
+        הודעה שנכשלה נרשמת בקובץ ההודעות שנכשלו, כי ההתקדמות ממשיכה אחריה.
+        """
+        טקסט = הודעה.text or הודעה.message or ""
+        if not (הודעה.media or טקסט):
+            logger.warning(f"הודעה {הודעה.id} ריקה, מדלג.")
+            metrics.MESSAGES_SKIPPED.inc(account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד))
+            return True
 
-            טקסט = הודעה.text or הודעה.message or ""
-            קובץ_זמני = None
+        async def שליחה():
+            nonlocal מדיה
+            await self.בדוק_הגבלות(יעד)
+            if not הודעה.media:
+                return await self.לקוח.send_message(יעד, טקסט)
+            # ההורדה זורמת ישר להעלאה דרך חוצץ קטן בזיכרון - בלי קובץ זמני בדיסק
+            מדיה = מדיה or await self.מדיה_להודעה(הודעה)
+            if not מדיה:
+                raise ValueError(f"הורדת הקובץ נכשלה עבור הודעה {הודעה.id}")
+            return await self.לקוח.send_file(יעד, מדיה, caption=טקסט)
 
+        try:
+            try:
+                נשלחה = await self.שלח_עם_ניסיונות(שליחה, יעד)
+            except errors.BadRequestError as e:
+                if not self.מטמון_מדיה.is_cached(מדיה):
+                    raise
+                logger.info(f"המדיה השמורה של הודעה {הודעה.id} כבר לא תקפה ({e}), מעלה מחדש.")
+                self.מטמון_מדיה.forget(self.PHONE_NUMBER, הודעה)
+                מדיה = None
+                # ניסיון אחד נוסף, עם העלאה מחדש של הקובץ
+                נשלחה = await self.שלח_עם_ניסיונות(שליחה, יעד)
             if הודעה.media:
-                קובץ_זמני = f"temp_{הודעה.id}"
-                try:
-                    קובץ_מלא = await self.לקוח.download_media(הודעה, file=קובץ_זמני)
-                    if קובץ_מלא:
-                        await self.לקוח.send_file(יעד, קובץ_מלא, caption=טקסט)
-                        os.remove(קובץ_מלא)
-                        self.מונה_הודעות_בדקה += 1
-                        return True
-                    else:
-                        logger.warning(f"הורדת הקובץ נכשלה עבור הודעה {הודעה.id}.")
-                        return False
-                except Exception as e:
-                    logger.error(f"שגיאה בהורדה/שליחה של מדיה בהודעה {הודעה.id}: {e}")
-                    return False
-
-            elif טקסט:
-                await self.לקוח.send_message(יעד, טקסט)
-                self.מונה_הודעות_בדקה += 1
-                return True
-
-            else:
-                logger.warning(f"הודעה {הודעה.id} ריקה, מדלג.")
-                return True
-
-        except errors.FloodWaitError as e:
-            logger.warning(f"FloodWait: ממתין {e.seconds + 5} שניות...")
-            await asyncio.sleep(e.seconds + 5)
-            return await self.העבר_הודעה(הודעה, יעד)
+                self.מטמון_מדיה.remember(self.PHONE_NUMBER, הודעה, נשלחה)
+            self.בקר_קצב.on_success(self.PHONE_NUMBER, utils.get_peer_id(יעד))
+            return True
 
         except Exception as e:
             logger.error(f"שגיאה בהעברת הודעה {הודעה.id}: {e}")
+            metrics.MESSAGES_FAILED.inc(account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד), kind=classify(e))
+            self.תורי_ניסיונות[utils.get_peer_id(יעד)].dead_letter(הודעה.id, הודעה.id, e)
             return False
 
+    async def העבר_אלבום(self, אלבום, יעד, מדיות=None):
+        """
+        מעלה מחדש את כל פריטי האלבום (בזרימה, בלי קבצים זמניים) ושולח אותם לערוץ היעד כאלבום אחד (בקשת שליחה אחת), עם הכיתובים.
+        אם המדיה כבר הועלתה מראש (הכן_מדיה) או נמצאת במטמון המדיה, היא נשלחת בלי העלאה נוספת.
+        אם שליחת האלבום נכשלת, כל פריט נשלח בנפרד. מחזיר כמה פריטים הגיעו ליעד.
+        """
+        מדיות = מדיות or [None] * len(אלבום)
+
+        async def שליחה():
+            await self.בדוק_הגבלות(יעד)
+            for i, הודעה in enumerate(אלבום):
+                מדיות[i] = מדיות[i] or await self.מדיה_להודעה(הודעה)
+                if not מדיות[i]:
+                    raise ValueError(f"הורדת הקובץ נכשלה עבור הודעה {הודעה.id}")
+            return await self.לקוח.send_file(יעד, מדיות, caption=[הודעה.text or הודעה.message or "" for הודעה in אלבום])
+
+        try:
+            try:
+                נשלחו = await self.שלח_עם_ניסיונות(שליחה, יעד)
+            except errors.BadRequestError as e:
+                שמורות = [i for i, מדיה in enumerate(מדיות) if self.מטמון_מדיה.is_cached(מדיה)]
+                if not שמורות:
+                    raise
+                logger.info(f"מדיה שמורה באלבום {אלבום[0].grouped_id} כבר לא תקפה ({e}), מעלה מחדש.")
+                for i in שמורות:
+                    self.מטמון_מדיה.forget(self.PHONE_NUMBER, אלבום[i])
+                    מדיות[i] = None
+                # ניסיון אחד נוסף, בלי הפניות מהמטמון (כל הקבצים מועלים מחדש)
+                נשלחו = await self.שלח_עם_ניסיונות(שליחה, יעד)
+            for הודעה, נשלחה in zip(אלבום, נשלחו or []):
+                self.מטמון_מדיה.remember(self.PHONE_NUMBER, הודעה, נשלחה)
+            self.בקר_קצב.on_success(self.PHONE_NUMBER, utils.get_peer_id(יעד), len(אלבום))
+            return len(אלבום)
+
+        except Exception as e:
+            logger.warning(f"שליחת אלבום {אלבום[0].grouped_id} נכשלה ({e}), שולח כל פריט בנפרד.")
+            # כל הפריטים נשלחים גם אם אחד נכשל; פריט שנכשל נרשם בקובץ ההודעות שנכשלו
+            הועברו = 0
+            for הודעה, מדיה in zip(אלבום, מדיות):
+                if await self.העבר_הודעה(הודעה, יעד, מדיה):
+                    הועברו += 1
+            return הועברו
+
     async def התחל_העברה(self):
         print("\n=== מעביר הודעות טלגרם (הורדה והעלאה) ===\n")
 
@@ -160,8 +261,18 @@ class מעביר_טלגרם:
         יעד = await self.בחר_ערוץ("יעד")
         if not יעד:
             return
+        יעדים = [יעד]
+        # כל הודעה מהמקור נקראת ומורדת פעם אחת ונשלחת לכל היעדים
+        while True:
+            יעד = await self.בחר_ערוץ("יעד נוסף (Enter לסיום)", רשות=True)
+            if not יעד:
+                break
+            if any(utils.get_peer_id(יעד) == utils.get_peer_id(קיים) for קיים in יעדים):
+                print("⚠️ הערוץ כבר נבחר כיעד.")
+                continue
+            יעדים.append(יעד)
 
-        התקדמות = self.טען_התקדמות()
+        התקדמויות = {utils.get_peer_id(יעד): self.טען_התקדמות(מקור, יעד) for יעד in יעדים}
 
         print("\nאפשרויות:")
         print("1. המשך מההודעה האחרונה")
@@ -169,47 +280,69 @@ class מעביר_טלגרם:
         בחירה = input("בחר (1/2): ").strip()
 
         if בחירה == '2':
-            התקדמות = {"הודעה_אחרונה": 0, "סך_הועברו": 0}
+            התקדמויות = {מזהה: {"הודעה_אחרונה": 0, "סך_הועברו": 0} for מזהה in התקדמויות}
 
-        logger.info(f"מתחיל העברה מהודעה ID > {התקדמות['הודעה_אחרונה']}...")
+        מהודעה = min(התקדמות["הודעה_אחרונה"] for התקדמות in התקדמויות.values())
+        logger.info(f"מתחיל העברה מהודעה ID > {מהודעה} ל-{len(יעדים)} יעדים...")
+        PROFILER.begin()
 
-        הודעות_נכשלו_ברצף = 0
+        # לכל יעד מונה כשלונות משלו: יעד שנכשל 5 פעמים ברצף יוצא מההעברה, והשאר ממשיכים
+        נכשלו_ברצף = {מזהה: 0 for מזהה in התקדמויות}
+        פעילים = list(יעדים)
 
         try:
-            async for הודעה in self.לקוח.iter_messages(
-                מקור,
-                reverse=True,
-                offset_id=התקדמות["הודעה_אחרונה"]
-            ):
-                if הודעה.id <= התקדמות["הודעה_אחרונה"]:
-                    continue
-
-                הצלחה = await self.העבר_הודעה(הודעה, יעד)
-
-                if הצלחה:
-                    התקדמות["סך_הועברו"] += 1
-                    הודעות_נכשלו_ברצף = 0
-                else:
-                    הודעות_נכשלו_ברצף += 1
-                    if הודעות_נכשלו_ברצף >= 5:
-                        logger.error("5 הודעות נכשלו ברציפות. עצירה.")
+            # הקבוצות הבאות מורדות ומועלות ברקע בזמן שהנוכחית נשלחת; השליחה ליעד נשארת לפי סדר המקור
+            async with UploadPipeline(self.הכן_מדיה, self.גודל_קבוצה, workers=self.מקס_קבוצות_בהכנה,
+                                      max_bytes=self.מקס_בתים_בהכנה) as צינור:
+                async for קבוצה, מדיות in צינור.map(self.קבוצות_להעברה(מקור, מהודעה)):
+                    if isinstance(מדיות, Exception):
+                        logger.warning(f"העלאה מראש נכשלה עבור הודעה {קבוצה[0].id} ({מדיות}), מנסה שוב בזמן השליחה.")
+                        מדיות = None
+
+                    for יעד in list(פעילים):
+                        מזהה = utils.get_peer_id(יעד)
+                        התקדמות = התקדמויות[מזהה]
+                        חלק = [הודעה for הודעה in קבוצה if הודעה.id > התקדמות["הודעה_אחרונה"]]
+                        if not חלק:
+                            continue
+                        metrics.MESSAGES_FETCHED.inc(len(חלק), account=self.PHONE_NUMBER, target=מזהה)
+                        הודעה = חלק[-1]
+                        מדיות_ליעד = self.מדיות_ליעד(קבוצה, חלק, מדיות)
+
+                        if len(חלק) > 1:
+                            הועברו = await self.העבר_אלבום(חלק, יעד, מדיות_ליעד)
+                        else:
+                            הועברו = 1 if await self.העבר_הודעה(הודעה, יעד, מדיות_ליעד[0] if מדיות_ליעד else None) else 0
+
+                        if הועברו:
+                            התקדמות["סך_הועברו"] += הועברו
+                            נכשלו_ברצף[מזהה] = 0
+                        else:
+                            נכשלו_ברצף[מזהה] += 1
+                            if נכשלו_ברצף[מזהה] >= 5:
+                                logger.error(f"5 הודעות נכשלו ברציפות ביעד {מזהה}. מפסיק לשלוח אליו.")
+                                פעילים.remove(יעד)
+                                continue
+
+                        התקדמות["הודעה_אחרונה"] = הודעה.id
+
+                        self.שמור_התקדמות(יעד, התקדמות)
+                        if התקדמות["סך_הועברו"] % 10 == 0:
+                            logger.info(f"הועברו {התקדמות['סך_הועברו']} הודעות ליעד {מזהה}... (קצב נוכחי: {self.בקר_קצב.current_rate(self.PHONE_NUMBER, מזהה):.1f} הודעות לדקה)")
+
+                    if not פעילים:
+                        logger.error("כל היעדים נכשלו. עצירה.")
                         break
 
-                התקדמות["הודעה_אחרונה"] = הודעה.id
-
-                if התקדמות["סך_הועברו"] % 10 == 0:
-                    logger.info(f"הועברו {התקדמות['סך_הועברו']} הודעות... שומר התקדמות.")
-                    self.שמור_התקדמות(התקדמות)
-
-                await asyncio.sleep(self.השהיה_בין_הודעות)
-
         except KeyboardInterrupt:
             logger.info("העברה הופסקה על ידי המשתמש.")
         except Exception as e:
             logger.error(f"שגיאה כללית: {e}")
         finally:
-            self.שמור_התקדמות(התקדמות)
-            logger.info(f"✅ הועברו סה\"כ {התקדמות['סך_הועברו']} הודעות.")
+            for יעד in יעדים:
+                התקדמות = התקדמויות[utils.get_peer_id(יעד)]
+                self.שמור_התקדמות(יעד, התקדמות)
+                logger.info(f"✅ הועברו סה\"כ {התקדמות['סך_הועברו']} הודעות ליעד {utils.get_peer_id(יעד)}.")
 
     async def __aenter__(self):
         return self
@@ -218,10 +351,16 @@ class מעביר_טלגרם:
         if self.לקוח and self.לקוח.is_connected():
             await self.לקוח.disconnect()
             logger.info("חיבור נותק.")
+        self.מאגר_התקדמות.close()
 
 async def main():
-    async with מעביר_טלגרם() as מעביר:
-        await מעביר.התחל_העברה()
+    שרת_מדדים = await metrics.start_server() # רק אם METRICS_PORT מוגדר
+    try:
+        async with מעביר_טלגרם() as מעביר:
+            await מעביר.התחל_העברה()
+    finally:
+        if שרת_מדדים:
+            שרת_מדדים.close()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,49 @@
+from typing import AsyncIterator, Iterable, List
+from telethon import TelegramClient
+from telethon.tl.types import Message
+
+from albums import group_albums, iter_albums
+
+# טלגרם מעבירה עד 100 הודעות בבקשת ForwardMessages אחת
+MAX_FORWARD_IDS = 100
+
+
+def chunk_messages(messages: Iterable[Message], size: int = MAX_FORWARD_IDS) -> List[List[Message]]:
+    """מחלק הודעות למנות של עד size הודעות, בלי לחתוך אלבום בין שתי מנות."""
+    chunks: List[List[Message]] = []
+    for group in group_albums(messages):
+        if chunks and len(chunks[-1]) + len(group) <= size:
+            chunks[-1].extend(group)
+        else:
+            chunks.append(list(group))
+    return chunks
+
+
+async def iter_chunks(messages: AsyncIterator[Message], size: int = MAX_FORWARD_IDS) -> AsyncIterator[List[Message]]:
+    """כמו chunk_messages, עבור איטרטור אסינכרוני (למשל iter_messages)."""
+    chunk: List[Message] = []
+    async for group in iter_albums(messages):
+        if chunk and len(chunk) + len(group) > size:
+            yield chunk
+            chunk = []
+        chunk.extend(group)
+    if chunk:
+        yield chunk
+
+
+async def forward_copies(client: TelegramClient, target, source, messages: List[Message]) -> List[Message]:
+    """
+    מעתיק את ההודעות ליעד בבקשת ForwardMessages אחת עם drop_author=True (בלי קרדיט למקור),
+    ומחזיר את ההודעות שלא הועתקו - כדי שהקורא ישלח אותן אחת-אחת בנתיב הרגיל.
+    הודעות שירות (הצטרפות, הצמדה וכו') לא ניתנות להעברה ומוחזרות מיד.
+    FloodWaitError ו-ChatForwardsRestrictedError עולות לקורא.
+    """
+    forwardable = [message for message in messages if not getattr(message, 'action', None)]
+    failed = [message for message in messages if getattr(message, 'action', None)]
+    if not forwardable:
+        return failed
+    results = await client.forward_messages(
+        target, [message.id for message in forwardable], from_peer=source, drop_author=True
+    )
+    failed.extend(message for message, result in zip(forwardable, results) if result is None)
+    return sorted(failed, key=lambda message: message.id)
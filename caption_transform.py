@@ -0,0 +1,130 @@
+import copy
+import re
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+from telethon.tl.types import (
+    MessageEntityMention, MessageEntityMentionName, MessageEntityTextUrl, MessageEntityUrl, TypeMessageEntity
+)
+
+# אותם קישורים שהסקריפטים מחקו עד עכשיו ב-re.sub על message.text
+LINK_PATTERN = r'https?://\S+|www\.\S+|t\.me/\S+'
+MENTION_PATTERN = r'@[A-Za-z0-9_]{2,}'
+
+
+def _utf16_len(text: str) -> int:
+    """אורך ביחידות UTF-16 - היחידות שבהן טלגרם סופרת offset / length של ישויות עיצוב."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _remap(starts: List[int], edits: List[Tuple[int, int, int, int]], offset: int, is_end: bool) -> int:
+    """מיקום UTF-16 בטקסט המקורי -> מיקום בטקסט אחרי העריכות."""
+    i = bisect_right(starts, offset) - 1
+    if i < 0:
+        return offset
+    u16_start, u16_end, new_start, replacement = edits[i]
+    if offset >= u16_end:
+        return offset + new_start + replacement - u16_end
+    # בתוך קטע שהוחלף: סוף ישות עובר לתחילת ההחלפה, תחילת ישות לסופה
+    if offset == u16_start or is_end:
+        return new_start
+    return new_start + replacement
+
+
+class CaptionTransform:
+    """
+    עיבוד כיתובים שנבנה פעם אחת לכל משימה מתוך סט כללים: מחיקת קישורים, מחיקת אזכורים,
+    החלפת שמות משתמש וחתימה בסוף. עובד על הטקסט הגולמי (message.message) במעבר אחד של
+    ביטוי רגולרי משולב, ומזיז את ה-offsets של ישויות העיצוב (MessageEntity) לפי העריכות -
+    במקום לעבור דרך message.text (markdown) שמאבד עיצוב ומשאיר סימונים שבורים.
+    """
+
+    def __init__(self, strip_links: bool = True, strip_mentions: bool = True,
+                 replace_handles: Optional[Dict[str, str]] = None, signature: Optional[str] = None):
+        self.strip_links = strip_links
+        self.strip_mentions = strip_mentions
+        # שמות משתמש להחלפה, בלי @ ובאותיות קטנות; החלפה גוברת על מחיקת אזכורים
+        self.replace_handles = {handle.lstrip('@').lower(): new.lstrip('@')
+                                for handle, new in (replace_handles or {}).items()}
+        self.signature = signature
+
+        parts = []
+        if strip_links:
+            parts.append(f'(?P<link>{LINK_PATTERN})')
+        if strip_mentions or self.replace_handles:
+            parts.append(f'(?P<mention>{MENTION_PATTERN})')
+        self._pattern = re.compile('|'.join(parts)) if parts else None
+
+        dropped = []
+        if strip_links:
+            dropped += [MessageEntityUrl, MessageEntityTextUrl]
+        if strip_mentions:
+            dropped += [MessageEntityMention, MessageEntityMentionName]
+        self._dropped_entities = tuple(dropped)
+
+    def _replacement(self, match) -> Optional[str]:
+        """הטקסט שבא במקום ההתאמה, או None כדי להשאיר אותה כמו שהיא."""
+        if match.lastgroup == 'link':
+            return ''
+        new = self.replace_handles.get(match.group()[1:].lower())
+        if new is not None:
+            return '@' + new
+        return '' if self.strip_mentions else None
+
+    def apply(self, text: Optional[str], entities: Optional[Sequence[TypeMessageEntity]] = None
+              ) -> Tuple[str, List[TypeMessageEntity]]:
+        """מחזיר (טקסט, ישויות) אחרי העיבוד. ישות שזזה מועתקת - הישויות של ההודעה המקורית לא משתנות."""
+        text = text or ''
+        # בטקסט בלי תווים מחוץ ל-BMP (רוב העברית והאנגלית) יחידות UTF-16 הן פשוט תווים
+        u16 = len if text.isascii() or _utf16_len(text) == len(text) else _utf16_len
+        # עריכות בקואורדינטות UTF-16: (התחלה, סוף, התחלה חדשה, אורך ההחלפה)
+        starts: List[int] = []
+        edits: List[Tuple[int, int, int, int]] = []
+        pieces: List[str] = []
+        position = 0 # מיקום בטקסט המקורי (תווי פייתון)
+        u16_position = 0 # אותו מיקום ביחידות UTF-16
+        shift = 0 # הפרש מצטבר בין הטקסט החדש למקורי, ב-UTF-16
+
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                replacement = self._replacement(match)
+                if replacement is None:
+                    continue
+                start, end = match.span()
+                before = text[position:start]
+                u16_start = u16_position + u16(before)
+                u16_end = u16_start + u16(match.group())
+                u16_replacement = _utf16_len(replacement)
+                starts.append(u16_start)
+                edits.append((u16_start, u16_end, u16_start + shift, u16_replacement))
+                pieces.append(before)
+                pieces.append(replacement)
+                shift += u16_replacement - (u16_end - u16_start)
+                position, u16_position = end, u16_end
+        pieces.append(text[position:])
+        result = ''.join(pieces)
+
+        # רווחים בקצוות (כמו strip() שהיה לפני) - הישויות זזות בהתאם
+        stripped = result.strip()
+        lead = u16(result[:len(result) - len(result.lstrip())])
+        total = u16(stripped)
+
+        new_entities: List[TypeMessageEntity] = []
+        if not edits and stripped == result:
+            # שום דבר לא נמחק - הישויות נשארות במקומן
+            new_entities = [entity for entity in entities or () if not isinstance(entity, self._dropped_entities)]
+            entities = ()
+        for entity in entities or ():
+            if isinstance(entity, self._dropped_entities):
+                continue
+            new_offset = max(0, _remap(starts, edits, entity.offset, False) - lead)
+            new_end = min(total, _remap(starts, edits, entity.offset + entity.length, True) - lead)
+            if new_end <= new_offset:
+                continue # כל הטקסט של הישות נמחק
+            if new_offset != entity.offset or new_end - new_offset != entity.length:
+                entity = copy.copy(entity)
+                entity.offset, entity.length = new_offset, new_end - new_offset
+            new_entities.append(entity)
+
+        if self.signature:
+            stripped = f"{stripped}\n\n{self.signature}" if stripped else self.signature
+        return stripped, new_entities
@@ -0,0 +1,200 @@
+import asyncio
+import re
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from telethon import TelegramClient, utils
+from telethon.tl.types import Channel, Chat
+import logging
+
+from peer_cache import PeerCache, candidate_peer_ids
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# כמה דיאלוגים לשמור למאגר בכל פעם (טלגרם מחזירה עד 100 דיאלוגים לבקשה)
+FLUSH_EVERY = 100
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _kind(entity) -> str:
+    if isinstance(entity, Chat):
+        return 'chat'
+    return 'channel' if getattr(entity, 'broadcast', False) else 'megagroup'
+
+
+def _tokens(entry: Dict) -> List[str]:
+    tokens = _WORD.findall(entry['title'].lower())
+    if entry['username']:
+        tokens.append(entry['username'].lower())
+    return tokens
+
+
+class DialogIndex:
+    """
+    אינדקס מקומי של הערוצים והקבוצות של חשבון, שנשמר בטבלת dialogs של מאגר המצב.
+    במקום get_dialogs() מלא בכל פתיחה של בוחר הערוצים, האינדקס מתרענן רק מהדיאלוגים
+    שהשתנו מאז הסנכרון הקודם (טלגרם מחזירה אותם מהחדש לישן), ותומך בחיפוש
+    לפי תחילית של מילה בשם / שם משתמש ובחיפוש לפי מזהה.
+    """
+
+    def __init__(self, store: StateStore, peer_cache: PeerCache, account):
+        self.store = store
+        self.peer_cache = peer_cache
+        self.account = account
+        self.entries: Dict[int, Dict] = {}
+        self.synced_date = 0.0 # תאריך הדיאלוג החדש ביותר בסנכרון המלא האחרון
+        self._ordered: Optional[List[Dict]] = None
+        self._token_index: Optional[List[Tuple[str, int]]] = None
+        self._updated = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+        for peer_id, kind, title, username, top_message, date in store.load_dialogs(account):
+            self._set({'id': peer_id, 'kind': kind, 'title': title, 'username': username,
+                       'top_message': top_message, 'date': date})
+        self.synced_date = store.load_dialog_sync(account)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def refreshing(self) -> bool:
+        return self._running
+
+    def _set(self, entry: Dict):
+        entry['type'] = "ערוץ" if entry['kind'] == 'channel' else "קבוצה"
+        entry['display_id'] = str(entry['id'])
+        self.entries[entry['id']] = entry
+        self._ordered = None
+        self._token_index = None
+
+    def ordered(self) -> List[Dict]:
+        """כל הערוצים והקבוצות, מהפעיל ביותר לאחרונה."""
+        if self._ordered is None:
+            self._ordered = sorted(self.entries.values(), key=lambda entry: entry['date'], reverse=True)
+        return self._ordered
+
+    def page(self, number: int, size: int = 20) -> List[Dict]:
+        return self.ordered()[number * size:(number + 1) * size]
+
+    def search(self, text: str, limit: int = 20) -> List[Dict]:
+        """כל המילים בטקסט צריכות להיות תחילית של מילה בשם הערוץ או של שם המשתמש שלו."""
+        terms = _WORD.findall(text.lower().replace('@', ' '))
+        if not terms:
+            return []
+        if self._token_index is None:
+            self._token_index = sorted(
+                (token, entry['id']) for entry in self.entries.values() for token in _tokens(entry)
+            )
+        index = self._token_index
+        candidates = set()
+        i = bisect_left(index, (terms[0], ))
+        while i < len(index) and index[i][0].startswith(terms[0]):
+            candidates.add(index[i][1])
+            i += 1
+        results = []
+        for peer_id in candidates:
+            entry = self.entries[peer_id]
+            tokens = _tokens(entry)
+            if all(any(token.startswith(term) for token in tokens) for term in terms[1:]):
+                results.append(entry)
+        results.sort(key=lambda entry: entry['date'], reverse=True)
+        return results[:limit]
+
+    def by_id(self, text: str) -> Optional[Dict]:
+        """חיפוש לפי מזהה, עם או בלי הקידומת -100 / מינוס."""
+        for peer_id in candidate_peer_ids(text):
+            if peer_id in self.entries:
+                return self.entries[peer_id]
+        return None
+
+    async def entity(self, client: TelegramClient, entry: Dict):
+        """הישות המלאה של רשומה באינדקס - בקשה אחת לשרת, בעזרת ה-access_hash שבמטמון."""
+        input_peer = self.peer_cache.get(self.account, entry['id'])
+        return await client.get_entity(input_peer if input_peer is not None else entry['id'])
+
+    def _flush(self, entities: List, rows: List[Tuple], synced_date: Optional[float] = None,
+               removed: Optional[List[int]] = None):
+        # בשגיאה הטרנזקציה מבוטלת (ROLLBACK), כך שהחיבור המשותף לא נשאר בתוך טרנזקציה פתוחה
+        with self.store.transaction():
+            for entity in entities:
+                self.peer_cache.remember(self.account, entity)
+            self.store.save_dialogs(self.account, rows)
+            if removed:
+                self.store.delete_dialogs(self.account, removed)
+            if synced_date is not None:
+                self.store.save_dialog_sync(self.account, synced_date)
+
+    def _update(self, entity, dialog, date: float, entities: List, rows: List[Tuple]) -> int:
+        """מעדכן רשומה אחת ומחזיר 1 אם היא חדשה או השתנתה."""
+        entry = {'id': utils.get_peer_id(entity), 'kind': _kind(entity), 'title': dialog.title or '',
+                 'username': getattr(entity, 'username', None),
+                 'top_message': dialog.message.id if dialog.message else 0, 'date': date}
+        old = self.entries.get(entry['id'])
+        if old is not None and all(old[key] == entry[key] for key in ('kind', 'title', 'username', 'top_message', 'date')):
+            return 0
+        self._set(entry)
+        entities.append(entity)
+        rows.append((entry['id'], entry['kind'], entry['title'], entry['username'], entry['top_message'], date))
+        return 1
+
+    async def refresh(self, client: TelegramClient, full: bool = False) -> int:
+        """
+        מרענן את האינדקס ומחזיר כמה רשומות השתנו. בריענון רגיל עוצרים בדיאלוג הראשון
+        (שאינו מוצמד) שלא השתנה מאז הסנכרון הקודם; ריענון מלא גם מסיר ערוצים שעזבנו.
+        """
+        full = full or not self.synced_date
+        seen = set()
+        entities, rows = [], []
+        changed = 0
+        iterated = 0
+        newest = self.synced_date
+        async for dialog in client.iter_dialogs():
+            iterated += 1
+            date = dialog.date.timestamp() if dialog.date else 0.0
+            if not full and not dialog.pinned and date and date <= self.synced_date:
+                break
+            newest = max(newest, date)
+            if isinstance(dialog.entity, (Channel, Chat)):
+                seen.add(utils.get_peer_id(dialog.entity))
+                changed += self._update(dialog.entity, dialog, date, entities, rows)
+            if iterated % FLUSH_EVERY == 0:
+                # עמוד שלם הגיע - שומרים ומעירים את בוחר הערוצים שממתין לרשומות
+                if rows:
+                    self._flush(entities, rows)
+                    entities, rows = [], []
+                async with self._updated:
+                    self._updated.notify_all()
+
+        removed = [peer_id for peer_id in self.entries if peer_id not in seen] if full else []
+        for peer_id in removed:
+            del self.entries[peer_id]
+            self._ordered = None
+            self._token_index = None
+        self.synced_date = newest
+        self._flush(entities, rows, synced_date=newest, removed=removed)
+        logger.debug(f"אינדקס הדיאלוגים רוענן: {changed} שינויים, {len(removed)} הוסרו, {len(self.entries)} בסך הכל.")
+        return changed + len(removed)
+
+    async def _refresh_logged(self, client: TelegramClient, full: bool):
+        try:
+            await self.refresh(client, full)
+        except Exception as e:
+            logger.warning(f"⚠️ שגיאה בריענון רשימת הערוצים: {e}")
+        finally:
+            self._running = False
+            async with self._updated:
+                self._updated.notify_all()
+
+    def refresh_in_background(self, client: TelegramClient, full: bool = False) -> asyncio.Task:
+        """מתחיל ריענון ברקע (אם לא רץ כבר אחד) ומחזיר את המשימה."""
+        if not self._running:
+            self._running = True
+            self._task = asyncio.create_task(self._refresh_logged(client, full))
+        return self._task
+
+    async def wait_for_entries(self, count: int):
+        """ממתין שיהיו לפחות count רשומות באינדקס, או שהריענון יסתיים."""
+        async with self._updated:
+            await self._updated.wait_for(lambda: len(self.entries) >= count or not self.refreshing)
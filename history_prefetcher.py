@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, List, Optional, Sequence
+from telethon import TelegramClient, errors
+from telethon.tl.types import Message
+import logging
+
+from profiler import PROFILER
+
+logger = logging.getLogger(__name__)
+
+# טלגרם מחזירה לכל היותר 100 הודעות לבקשת GetHistory אחת
+MAX_PAGE_SIZE = 100
+
+
+async def _next_or_none(iterator) -> Optional[Message]:
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def merged_history(client: TelegramClient, entity, filters: Sequence, offset_id: int = 0,
+                         limit: Optional[int] = None) -> AsyncIterator[Message]:
+    """
+    היסטוריה מסוננת בצד השרת (messages.search עם InputMessagesFilter*), מהישנה לחדשה.
+    כל בקשת חיפוש מקבלת סינון אחד בלבד, אז לכל סינון יש איטרטור משלו והם מתמזגים לפי
+    ID; הודעה שמתאימה לכמה סינונים (למשל סרטון שנשלח כקובץ) יוצאת פעם אחת.
+    """
+    iterators = [client.iter_messages(entity, filter=f, offset_id=offset_id, reverse=True, limit=limit)
+                 for f in filters]
+    heap = []
+    for index, iterator in enumerate(iterators):
+        message = await _next_or_none(iterator)
+        if message is not None:
+            heap.append((message.id, index, message))
+    heapq.heapify(heap)
+
+    last_id = None
+    yielded = 0
+    while heap and (limit is None or yielded < limit):
+        message_id, index, message = heapq.heappop(heap)
+        following = await _next_or_none(iterators[index])
+        if following is not None:
+            heapq.heappush(heap, (following.id, index, following))
+        if message_id != last_id:
+            last_id = message_id
+            yielded += 1
+            yield message
+
+
+class HistoryPrefetcher:
+    """
+    קורא מראש את היסטוריית ערוץ המקור (מהישנה לחדשה) לתוך חוצץ חסום, במשימת רקע,
+    בזמן שהשולחים מרוקנים אותו. גודל העמוד ועומק הקריאה מראש מותאמים לקצב השליחה:
+    מספיק הודעות לכ-lead_seconds שניות קדימה, בין min_page ל-100 הודעות לבקשה.
+    עם filters (סינוני חיפוש של טלגרם) מאוחזרות רק ההודעות שמתאימות להם, דרך merged_history.
+    """
+
+    def __init__(self, client: TelegramClient, source_entity, offset_id: int = 0, *,
+                 min_page: int = 20, lead_seconds: float = 120.0, filters: Optional[Sequence] = None):
+        self.client = client
+        self.source_entity = source_entity
+        self.offset_id = offset_id
+        self.filters = filters
+        self.min_page = min_page
+        self.lead_seconds = lead_seconds
+
+        self.page_size = min_page
+        self.finished = False
+        self.requests = 0
+        self._buffer: Deque[Message] = deque()
+        self._condition = asyncio.Condition()
+        self._error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
+        self._merged: Optional[AsyncIterator[Message]] = None
+
+        self._drain_rate = 0.0 # EWMA של הודעות לשנייה שנלקחו מהחוצץ
+        self._last_take = time.monotonic()
+
+    @property
+    def read_ahead(self) -> int:
+        """כמה הודעות להחזיק בחוצץ לפני שמפסיקים לאחזר."""
+        return 2 * self.page_size
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _adapt(self):
+        wanted = int(self._drain_rate * self.lead_seconds)
+        self.page_size = max(self.min_page, min(MAX_PAGE_SIZE, wanted))
+
+    async def _fetch_page(self) -> List[Message]:
+        if self.filters:
+            return await self._fetch_filtered_page()
+        while True:
+            try:
+                self.requests += 1
+                return [message async for message in self.client.iter_messages(
+                    self.source_entity,
+                    offset_id=self.offset_id,
+                    reverse=True, # סדר כרונולוגי: מהישנה לחדשה
+                    limit=self.page_size
+                )]
+            except errors.FloodWaitError as e:
+                logger.warning(f"⏰ FloodWait בעת אחזור היסטוריה מערוץ המקור. ממתין {e.seconds} שניות.")
+                with PROFILER.stage('flood_wait'):
+                    await asyncio.sleep(e.seconds)
+
+    async def _fetch_filtered_page(self) -> List[Message]:
+        """עמוד מתוך המיזוג של החיפושים המסוננים; אחרי FloodWait המיזוג נפתח מחדש מההודעה האחרונה שהתקבלה."""
+        self.requests += 1
+        page: List[Message] = []
+        while len(page) < self.page_size:
+            if self._merged is None:
+                self._merged = merged_history(self.client, self.source_entity, self.filters,
+                                              offset_id=page[-1].id if page else self.offset_id)
+            try:
+                page.append(await self._merged.__anext__())
+            except StopAsyncIteration:
+                break
+            except errors.FloodWaitError as e:
+                self._merged = None
+                logger.warning(f"⏰ FloodWait בעת חיפוש מסונן בערוץ המקור. ממתין {e.seconds} שניות.")
+                with PROFILER.stage('flood_wait'):
+                    await asyncio.sleep(e.seconds)
+        return page
+
+    async def _run(self):
+        try:
+            while True:
+                async with self._condition:
+                    await self._condition.wait_for(lambda: len(self._buffer) < self.read_ahead)
+                requested = self.page_size
+                page = await self._fetch_page()
+                async with self._condition:
+                    self._buffer.extend(page)
+                    if page:
+                        self.offset_id = page[-1].id
+                    if len(page) < requested:
+                        self.finished = True
+                    self._condition.notify_all()
+                if self.finished:
+                    logger.debug(f"אחזור ההיסטוריה הסתיים אחרי {self.requests} בקשות.")
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            async with self._condition:
+                self._error = e
+                self._condition.notify_all()
+
+    async def get_batch(self, max_size: int) -> List[Message]:
+        """מחזיר עד max_size הודעות הבאות בסדר; רשימה ריקה = הגענו לסוף ההיסטוריה."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._buffer or self.finished or self._error)
+            if self._error and not self._buffer:
+                raise self._error
+            batch = [self._buffer.popleft() for _ in range(min(max_size, len(self._buffer)))]
+            # לא חותכים אלבום באמצע: שאר הפריטים מצטרפים לאותה אצווה. אם החוצץ התרוקן באמצע אלבום
+            # (האלבום חוצה גבול של עמוד), ממתינים לעמוד הבא או לסוף ההיסטוריה
+            grouped_id = getattr(batch[-1], 'grouped_id', None) if batch else None
+            while grouped_id:
+                while self._buffer and getattr(self._buffer[0], 'grouped_id', None) == grouped_id:
+                    batch.append(self._buffer.popleft())
+                if self._buffer or self.finished or self._error:
+                    break
+                self._condition.notify_all() # _run ממתין למקום בחוצץ
+                await self._condition.wait_for(lambda: self._buffer or self.finished or self._error)
+
+            now = time.monotonic()
+            elapsed = max(now - self._last_take, 1e-3)
+            self._last_take = now
+            self._drain_rate = 0.7 * self._drain_rate + 0.3 * (len(batch) / elapsed)
+            self._adapt()
+            self._condition.notify_all()
+            return batch
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import sys
+from typing import Dict, List, Optional
+from telethon import TelegramClient
+import logging
+
+import metrics
+from tor import SESSIONS_FILE, TelegramSender
+
+logger = logging.getLogger(__name__)
+
+# קבועים
+JOBS_FILE = 'jobs.json'
+DEFAULT_FILE_TYPES = ['all_media', 'all_text']
+
+
+def load_jobs(path: str = JOBS_FILE) -> List[Dict]:
+    """
+    קורא את קובץ המשימות: רשימת JSON של {"source", "target"} ובאופן אופציונלי
+    "file_types" (כמו בתפריט של tor.py, ברירת מחדל: הכל), "bulk_copy", "reset" ומגבלות
+    "min_size_mb" / "max_size_mb" / "min_duration" / "max_duration".
+    משימה בלי מקור או יעד נזרקת עם שגיאה בלוג.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            jobs = json.load(f)
+    except FileNotFoundError:
+        logger.error(f"❌ קובץ {path} לא נמצא.")
+        return []
+    except json.JSONDecodeError:
+        logger.error(f"❌ שגיאה בקריאת קובץ {path}. וודא שמבנה ה-JSON תקין.")
+        return []
+
+    valid = []
+    for i, job in enumerate(jobs):
+        if not job.get('source') or not job.get('target'):
+            logger.error(f"❌ משימה #{i+1} בקובץ {path} חסרה מקור או יעד. מדלג.")
+            continue
+        valid.append({
+            'source': str(job['source']),
+            'target': str(job['target']),
+            'file_types': job.get('file_types') or DEFAULT_FILE_TYPES,
+            'bulk_copy': bool(job.get('bulk_copy', False)),
+            'reset': bool(job.get('reset', False)),
+            'media_limits': {
+                key: float(job[name]) * unit
+                for key, name, unit in (('min_size', 'min_size_mb', 1024 * 1024), ('max_size', 'max_size_mb', 1024 * 1024),
+                                        ('min_duration', 'min_duration', 1), ('max_duration', 'max_duration', 1))
+                if job.get(name) is not None
+            },
+        })
+    return valid
+
+
+class JobScheduler:
+    """
+    מריץ הרבה צמדי מקור→יעד בתהליך אחד, על מאגר חשבונות אחד: החשבונות מתחברים פעם אחת,
+    וכל המשימות חולקות את מגביל הקצב, בקר ה-AIMD וזמני ה-FloodWait. כך חשבון שעמוס
+    (או ב-FloodWait) במשימה אחת לא נבחר ראשון גם באחרות, והתפוקה הכוללת מוגבלת ע"י
+    החשבונות ולא ע"י מספר התהליכים.
+    """
+
+    def __init__(self, jobs: List[Dict], sessions_file: str = SESSIONS_FILE, max_parallel_jobs: int = 10):
+        self.jobs = jobs
+        self.sessions_file = sessions_file
+        self.pool = TelegramSender()
+        self._job_slots = asyncio.Semaphore(max_parallel_jobs)
+
+    async def resolve_entity(self, client: TelegramClient, text: str):
+        """ישות של ערוץ לפי @username, קישור t.me או מזהה - דרך מטמון ה-peers אם אפשר."""
+        cached = self.pool.peer_cache.lookup(client._account_id, text)
+        peer = cached or (int(text) if text.lstrip('-').isdigit() else text)
+        entity = await client.get_entity(peer)
+        self.pool.peer_cache.remember(client._account_id, entity)
+        return entity
+
+    async def run_job(self, index: int, job: Dict) -> Optional[int]:
+        """מריץ משימה אחת עד הסוף ומחזיר כמה הודעות נשלחו בה (None אם לא הצליחה להתחיל)."""
+        name = f"{job['source']} → {job['target']}"
+        async with self._job_slots:
+            sender = TelegramSender(pool=self.pool)
+            # כל משימה מתחילה מחשבון אחר, כדי שאחזור ההיסטוריה ובדיקות ההתחלה לא יפלו כולן על הראשון
+            sender.account_shift = index
+            try:
+                source_entity = await self.resolve_entity(sender.clients[0], job['source'])
+                target_entity = await self.resolve_entity(sender.clients[0], job['target'])
+                if not await sender.prepare_target(source_entity, target_entity):
+                    logger.error(f"❌ משימה [{name}] לא יכולה להתחיל.")
+                    return None
+                # ForwardMessages לא שולח לנושא מסוים בפורום
+                sender.bulk_copy = job['bulk_copy'] and not sender.target_channel_is_forum
+                sender.media_limits = job['media_limits']
+                total_before = sender.total_sent
+                logger.info(f"▶️ משימה [{name}] מתחילה עם {len(sender.clients)} חשבונות.")
+                await sender.send_messages_round(source_entity, job['file_types'], job['reset'])
+                return sender.total_sent - total_before
+            except Exception as e:
+                logger.error(f"❌ משימה [{name}] נכשלה: {e}", exc_info=True)
+                return None
+            finally:
+                sender.save_progress()
+
+    async def run(self):
+        if not self.jobs:
+            logger.error("❌ אין משימות להרצה, יוצא.")
+            return
+
+        metrics_server = await metrics.start_server() # רק אם METRICS_PORT מוגדר
+        try:
+            await self.pool.load_clients(self.sessions_file)
+            if not self.pool.clients:
+                logger.error("❌ לא נטענו חשבונות, יוצא.")
+                return
+
+            logger.info(f"📋 מריץ {len(self.jobs)} משימות על {len(self.pool.clients)} חשבונות.")
+            results = await asyncio.gather(*[self.run_job(i, job) for i, job in enumerate(self.jobs)])
+            for job, sent in zip(self.jobs, results):
+                status = f"נשלחו {sent} הודעות" if sent is not None else "נכשלה"
+                logger.info(f"📊 {job['source']} → {job['target']}: {status}.")
+
+        finally:
+            for task in self.pool._login_tasks:
+                task.cancel()
+            for client in self.pool.clients:
+                try:
+                    if client.is_connected():
+                        await client.disconnect()
+                except Exception as e:
+                    logger.error(f"שגיאה בניתוק חשבון: {e}")
+            logger.info("✅ כל החשבונות נותקו.")
+            self.pool.journal.close()
+            self.pool.state_store.close()
+            if metrics_server:
+                metrics_server.close()
+
+
+async def main():
+    jobs = load_jobs(sys.argv[1] if len(sys.argv) > 1 else JOBS_FILE)
+    await JobScheduler(jobs).run()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("\n👋 התוכנית נסגרה על ידי המשתמש.")
@@ -0,0 +1,151 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Iterable, List, Optional
+from telethon import TelegramClient, errors, events
+from telethon.tl.types import Message
+import logging
+
+logger = logging.getLogger(__name__)
+
+# כמה מדידות השהיה אחרונות נשמרות לחישוב האחוזונים
+LATENCY_WINDOW = 1000
+
+
+class LiveFollower:
+    """
+    מצב מעקב: אחרי שההשלמה מההיסטוריה מסתיימת, הודעות חדשות בערוץ המקור מגיעות
+    מעדכוני NewMessage לתוך תור - בלי GetHistory תקופתי. המאזין נרשם ב-start, עוד
+    לפני סוף ההשלמה, ועדכונים שמגיעים בינתיים נשמרים עד begin. מזהה שקופץ יותר מאחד
+    (עדכונים שפוספסו, למשל בניתוק) ממולא באחזור השלמה של הטווח החסר בלבד.
+    """
+
+    def __init__(self, client: TelegramClient, source_entity, *, album_linger: float = 0.5):
+        self.client = client
+        self.source_entity = source_entity
+        self.album_linger = album_linger
+
+        self.last_seen: Optional[int] = None # None = ההשלמה מההיסטוריה עוד לא הסתיימה
+        self.gap_fetches = 0
+        self._early: List[Message] = [] # עדכונים שהגיעו לפני begin
+        self._queue: Deque[Message] = deque()
+        self._condition = asyncio.Condition()
+        self._lock = asyncio.Lock() # שומר על סדר המזהים בין העדכונים לאחזורי ההשלמה
+        self._event = events.NewMessage(chats=source_entity)
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.delivered = 0
+
+    def start(self):
+        self.client.add_event_handler(self._on_message, self._event)
+        return self
+
+    async def close(self):
+        self.client.remove_event_handler(self._on_message, self._event)
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def latest_id(self) -> int:
+        """המזהה של ההודעה האחרונה בערוץ המקור (0 בערוץ ריק)."""
+        latest = await self.client.get_messages(self.source_entity, limit=1)
+        return latest[0].id if latest else 0
+
+    async def begin(self, last_id: int, covered_id: Optional[int] = None):
+        """
+        עובר למסירה מהעדכונים: מכאן מתקבלות רק הודעות עם מזהה גדול מ-last_id.
+        covered_id: עד איזה מזהה ההשלמה כבר עברה על ההיסטוריה (למשל אחרי אחזור מסונן, שבו last_id
+        הוא ההודעה המתאימה האחרונה). פער עד covered_id לא מאוחזר מחדש; עדכונים שהגיעו בזמן ההשלמה
+        ומזהה שלהם עד covered_id נמסרים כמו שהם.
+        """
+        covered_id = max(last_id, covered_id or 0)
+        async with self._lock:
+            self.last_seen = covered_id
+            early, self._early = self._early, []
+        early.sort(key=lambda message: message.id)
+        caught_up = [message for message in early if last_id < message.id <= covered_id]
+        if caught_up:
+            async with self._condition:
+                self._queue.extend(caught_up)
+                self._condition.notify_all()
+        for message in early:
+            await self._accept(message)
+        logger.info(f"👂 מצב מעקב פעיל: ממתין להודעות חדשות אחרי ID {covered_id}.")
+
+    async def _on_message(self, event):
+        await self._accept(event.message)
+
+    async def _accept(self, message: Message):
+        async with self._lock:
+            if self.last_seen is None:
+                self._early.append(message)
+                return
+            if message.id <= self.last_seen:
+                return
+            fresh = []
+            if message.id > self.last_seen + 1:
+                fresh = await self._fetch_gap(self.last_seen, message.id)
+            fresh.append(message)
+            self.last_seen = message.id
+            async with self._condition:
+                self._queue.extend(fresh)
+                self._condition.notify_all()
+
+    async def _fetch_gap(self, after_id: int, before_id: int) -> List[Message]:
+        """ההודעות שבין after_id ל-before_id (לא כולל). טווח ריק = הודעות שנמחקו."""
+        while True:
+            try:
+                self.gap_fetches += 1
+                missing = [message async for message in self.client.iter_messages(
+                    self.source_entity, min_id=after_id, max_id=before_id, reverse=True
+                )]
+                if missing:
+                    logger.info(f"🩹 מולא פער של {len(missing)} הודעות (IDs: {missing[0].id}-{missing[-1].id}) שלא הגיעו כעדכון.")
+                return missing
+            except errors.FloodWaitError as e:
+                logger.warning(f"⏰ FloodWait במילוי פער בעדכונים. ממתין {e.seconds} שניות.")
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                logger.error(f"❌ מילוי פער {after_id}-{before_id} נכשל: {e}")
+                return []
+
+    async def get_batch(self, max_size: int) -> List[Message]:
+        """ממתין להודעה חדשה אחת לפחות ומחזיר עד max_size הודעות לפי הסדר, בלי לחתוך אלבום."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._queue)
+            # פריטי אלבום מגיעים כעדכונים נפרדים - ממתינים רגע לשאר הפריטים
+            grouped_id = getattr(self._queue[-1], 'grouped_id', None)
+            while grouped_id:
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda: getattr(self._queue[-1], 'grouped_id', None) != grouped_id),
+                        self.album_linger
+                    )
+                except asyncio.TimeoutError:
+                    break
+                grouped_id = getattr(self._queue[-1], 'grouped_id', None)
+            batch = [self._queue.popleft() for _ in range(min(max_size, len(self._queue)))]
+            grouped_id = getattr(batch[-1], 'grouped_id', None)
+            while grouped_id and self._queue and getattr(self._queue[0], 'grouped_id', None) == grouped_id:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def mark_delivered(self, messages: Iterable[Message]):
+        """רושם את השהיית המראה (מפרסום במקור עד סיום השליחה ליעד) של הודעות שנשלחו."""
+        now = datetime.now(timezone.utc)
+        for message in messages:
+            if message.date:
+                self._latencies.append(max(0.0, (now - message.date).total_seconds()))
+            self.delivered += 1
+
+    def latency_report(self) -> str:
+        if not self._latencies:
+            return "אין עדיין מדידות השהיה."
+        ordered = sorted(self._latencies)
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+        return (f"השהיית מראה ({len(ordered)} הודעות אחרונות): "
+                f"p50={percentile(0.5):.2f}s, p95={percentile(0.95):.2f}s, max={ordered[-1]:.2f}s; "
+                f"{self.gap_fetches} אחזורי פערים.")
@@ -0,0 +1,102 @@
+from typing import Dict, Hashable, Optional, Set, Tuple, Union
+from telethon.tl.types import (
+    InputDocument, InputMediaDocument, InputMediaPhoto, InputPhoto, Message, MessageMediaDocument, MessageMediaPhoto
+)
+import logging
+
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+CachedMedia = Union[InputMediaDocument, InputMediaPhoto]
+
+# (source_id, size) - זהות המסמך / התמונה בערוץ המקור
+SourceKey = Tuple[int, int]
+
+
+def source_key(message: Message) -> Optional[SourceKey]:
+    """מזהה המדיה במקור יחד עם הגודל שלה, או None להודעה בלי מסמך / תמונה."""
+    media = message.media
+    if isinstance(media, MessageMediaDocument) and media.document:
+        return media.document.id, media.document.size
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        return media.photo.id, message.file.size or 0
+    return None
+
+
+def _reference(message: Message) -> Optional[Tuple[str, int, int, bytes]]:
+    media = message.media
+    if isinstance(media, MessageMediaDocument) and media.document:
+        document = media.document
+        return 'document', document.id, document.access_hash, document.file_reference
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        photo = media.photo
+        return 'photo', photo.id, photo.access_hash, photo.file_reference
+    return None
+
+
+class MediaCache:
+    """
+    מטמון של מדיה שכבר הועלתה מחדש, לכל חשבון: ממפה מסמך / תמונה של המקור (מזהה + גודל)
+    להפניה (id, access_hash, file_reference) של העותק שנשלח ליעד, ונשמר בטבלת media של
+    מאגר המצב. קובץ שחוזר (סרטון שפורסם שוב, קובץ משותף לכמה ערוצים) נשלח לפי ההפניה
+    בלי הורדה והעלאה. הפניה שהפסיקה לעבוד נמחקת ע"י forget.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._media: Dict[Tuple[Hashable, SourceKey], Tuple[str, int, int, bytes]] = {}
+        self._loaded: Set[Hashable] = set()
+
+    def _ensure_loaded(self, account: Hashable):
+        if account in self._loaded:
+            return
+        for source_id, size, kind, media_id, access_hash, file_reference in self.store.load_media(account):
+            self._media[(account, (source_id, size))] = (kind, media_id, access_hash, file_reference)
+        self._loaded.add(account)
+
+    def get(self, account: Hashable, message: Message) -> Optional[CachedMedia]:
+        """InputMedia לשליחה לפי הפניה אם המדיה של ההודעה כבר הועלתה ע"י החשבון, או None."""
+        key = source_key(message)
+        if key is None:
+            return None
+        self._ensure_loaded(account)
+        entry = self._media.get((account, key))
+        if entry is None:
+            return None
+        kind, media_id, access_hash, file_reference = entry
+        spoiler = getattr(message.media, 'spoiler', None)
+        if kind == 'photo':
+            return InputMediaPhoto(InputPhoto(media_id, access_hash, file_reference), spoiler=spoiler)
+        return InputMediaDocument(InputDocument(media_id, access_hash, file_reference), spoiler=spoiler)
+
+    @staticmethod
+    def is_cached(media) -> bool:
+        """האם media היא הפניה מהמטמון (ולא קובץ שהועלה עכשיו)."""
+        return isinstance(media, (InputMediaDocument, InputMediaPhoto))
+
+    def remember(self, account: Hashable, source: Message, sent: Message):
+        """שומר את המדיה של ההודעה שנשלחה ליעד כהעלאה של המדיה של הודעת המקור."""
+        key = source_key(source)
+        reference = _reference(sent) if sent is not None else None
+        if key is None or reference is None:
+            return
+        self._ensure_loaded(account)
+        if self._media.get((account, key)) == reference:
+            return
+        self._media[(account, key)] = reference
+        try:
+            self.store.save_media(account, *key, *reference)
+        except Exception as e:
+            logger.warning(f"⚠️ לא ניתן לשמור את המדיה של הודעה {source.id} במטמון: {e}")
+
+    def forget(self, account: Hashable, message: Message):
+        """מסיר הפניה שכבר לא תקפה (למשל file_reference שפג תוקפו או קובץ שנמחק)."""
+        key = source_key(message)
+        if key is None:
+            return
+        self._media.pop((account, key), None)
+        try:
+            self.store.delete_media(account, *key)
+        except Exception as e:
+            logger.warning(f"⚠️ לא ניתן למחוק את המדיה של הודעה {message.id} מהמטמון: {e}")
@@ -0,0 +1,124 @@
+from typing import FrozenSet, Iterable, List, Optional
+from telethon.tl.types import (
+    DocumentAttributeAudio, DocumentAttributeFilename, DocumentAttributeVideo, InputMessagesFilterDocument,
+    InputMessagesFilterGif, InputMessagesFilterMusic, InputMessagesFilterPhotos, InputMessagesFilterRoundVideo,
+    InputMessagesFilterVideo, InputMessagesFilterVoice, Message, MessageMediaDocument, MessageMediaPhoto
+)
+
+# הסיומות שבתפריט של tor.py, לפי קטגוריה
+IMAGE_EXTS = frozenset(['jpg', 'jpeg', 'png', 'gif', 'webp'])
+VIDEO_EXTS = frozenset(['mp4', 'avi', 'mkv', 'mov', 'wmv'])
+AUDIO_EXTS = frozenset(['mp3', 'wav', 'flac', 'aac', 'ogg'])
+
+# mime מלא -> הסיומות שבחירה באחת מהן מכניסה אותו
+_MIME_EXTS = {
+    'application/pdf': frozenset(['pdf']),
+    'application/msword': frozenset(['doc', 'docx']),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': frozenset(['doc', 'docx']),
+    'text/plain': frozenset(['txt']),
+}
+# סוג ראשי של mime -> הסיומות של הקטגוריה
+_MAJOR_EXTS = {'video': VIDEO_EXTS, 'audio': AUDIO_EXTS}
+# סיומת קובץ שמכניסה קטגוריה שלמה (doc מכניס גם docx)
+_EXT_ALIASES = {'doc': frozenset(['doc', 'docx']), 'docx': frozenset(['doc', 'docx'])}
+
+TEXT_TYPES = frozenset(['text_only', 'all_media', 'all_text'])
+
+
+class MediaClassifier:
+    """
+    מסנן סוגי התוכן של tor.py, מקומפל פעם אחת מהבחירה של choose_file_types: טבלאות
+    mime -> קטגוריה וסיומת -> קטגוריה במקום סריקות רשימה לכל הודעה. רץ בשלב האחזור,
+    כך שהודעות לא רצויות לא מגיעות לשולחים בכלל. אפשר גם להגביל גודל ומשך (בשניות)
+    לפי המאפיינים של המסמך - בלי להוריד כלום.
+    """
+
+    def __init__(self, file_types: Iterable[str], *, min_size: Optional[int] = None, max_size: Optional[int] = None,
+                 min_duration: Optional[float] = None, max_duration: Optional[float] = None):
+        self.file_types: FrozenSet[str] = frozenset(file_types)
+        self.all_media = 'all_media' in self.file_types
+        self.text = bool(self.file_types & TEXT_TYPES)
+        self.photos = bool(self.file_types & IMAGE_EXTS)
+        self.mimes = frozenset(mime for mime, exts in _MIME_EXTS.items() if exts & self.file_types)
+        self.majors = frozenset(major for major, exts in _MAJOR_EXTS.items() if exts & self.file_types)
+        self.extensions = frozenset().union(self.file_types, *(_EXT_ALIASES.get(ext, ()) for ext in self.file_types))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self._limits = any(limit is not None for limit in (min_size, max_size, min_duration, max_duration))
+
+    def _document_matches(self, document) -> bool:
+        mime = document.mime_type or ''
+        if mime in self.mimes or mime.split('/', 1)[0] in self.majors:
+            return True
+        for attr in document.attributes:
+            if isinstance(attr, DocumentAttributeFilename) and attr.file_name:
+                return attr.file_name.rsplit('.', 1)[-1].lower() in self.extensions
+        return False
+
+    def _within_limits(self, message: Message) -> bool:
+        media = message.media
+        size = None
+        duration = None
+        if isinstance(media, MessageMediaDocument) and media.document:
+            size = media.document.size
+            for attr in media.document.attributes:
+                if isinstance(attr, (DocumentAttributeVideo, DocumentAttributeAudio)):
+                    duration = attr.duration
+                    break
+        elif message.file:
+            size = message.file.size
+        # מגבלה שאין לה ערך בהודעה (למשל משך של PDF) לא פוסלת אותה
+        if size is not None:
+            if self.min_size is not None and size < self.min_size:
+                return False
+            if self.max_size is not None and size > self.max_size:
+                return False
+        if duration is not None:
+            if self.min_duration is not None and duration < self.min_duration:
+                return False
+            if self.max_duration is not None and duration > self.max_duration:
+                return False
+        return True
+
+    def media_matches(self, message: Message) -> bool:
+        """האם המדיה של ההודעה מתאימה לסוגים ולמגבלות שנבחרו."""
+        media = message.media
+        if self.all_media:
+            matched = True
+        elif isinstance(media, MessageMediaPhoto):
+            matched = self.photos
+        elif isinstance(media, MessageMediaDocument) and media.document:
+            matched = self._document_matches(media.document)
+        else:
+            matched = False
+        return matched and (not self._limits or self._within_limits(message))
+
+    def search_filters(self) -> Optional[List]:
+        """
+        סינוני החיפוש של טלגרם שמכסים את הבחירה, לאחזור בצד השרת; None כשנבחר טקסט או כל
+        המדיה - לזה אין סינון שרת. הסינונים רחבים מהבחירה (למשל כל המסמכים), ו-matches
+        עדיין מכריע בכל הודעה שהגיעה.
+        """
+        if self.text or self.all_media:
+            return None
+        # קבצים עם סיומת או mime שנבחרו - כולל סרטון, תמונה או שיר שנשלחו כקובץ
+        filters = [InputMessagesFilterDocument]
+        if self.photos:
+            filters.append(InputMessagesFilterPhotos)
+        if 'video' in self.majors:
+            filters += [InputMessagesFilterVideo, InputMessagesFilterRoundVideo, InputMessagesFilterGif]
+        elif 'gif' in self.extensions:
+            filters.append(InputMessagesFilterGif)
+        if 'audio' in self.majors:
+            filters += [InputMessagesFilterMusic, InputMessagesFilterVoice]
+        return filters
+
+    def matches(self, message: Message) -> bool:
+        """האם להעתיק את ההודעה בכלל (מדיה לפי הסוג, טקסט רק אם נבחר טקסט)."""
+        if message.media:
+            return self.media_matches(message)
+        if message.text:
+            return self.text
+        return False
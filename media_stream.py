@@ -0,0 +1,135 @@
+import asyncio
+from typing import Optional, Union
+from telethon import TelegramClient
+from telethon.tl.types import (
+    InputMediaUploadedDocument, InputMediaUploadedPhoto, Message, MessageMediaDocument, MessageMediaPhoto
+)
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# גודל חלק בהורדה - המקסימום שטלגרם מאפשרת לבקשת GetFile אחת
+CHUNK_SIZE = 512 * 1024
+# כמה חלקים שהורדו יכולים להמתין בזיכרון להעלאה (4 חלקים = 2MB)
+BUFFER_CHUNKS = 4
+
+InputMedia = Union[InputMediaUploadedDocument, InputMediaUploadedPhoto]
+
+
+class MediaStream:
+    """
+    קובץ לקריאה בלבד שמוזן מ-iter_download במשימת רקע דרך תור חסום: upload_file קורא ממנו
+    חלקים ומעלה אותם בזמן שההורדה ממשיכה. ההעלאה מתחילה אחרי החלק הראשון, ובזיכרון יש
+    לכל היותר BUFFER_CHUNKS חלקים (ועוד חלק אחד שנקרא כרגע) - בלי קשר לגודל הקובץ.
+    הבתים שהורדו ושנקראו להעלאה נספרים במדדים תחת account.
+    """
+
+    def __init__(self, client: TelegramClient, media, size: int, name: Optional[str] = None,
+                 buffer_chunks: int = BUFFER_CHUNKS, account=None):
+        self.client = client
+        self.media = media
+        self.size = size
+        self.name = name
+        self.account = account
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_chunks)
+        self._pending = bytearray()
+        self._eof = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def _produce(self):
+        try:
+            async for chunk in self.client.iter_download(self.media, request_size=CHUNK_SIZE, file_size=self.size):
+                metrics.BYTES_DOWNLOADED.inc(len(chunk), account=self.account)
+                await self._queue.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(e)
+            return
+        await self._queue.put(None)
+
+    def start(self):
+        self._task = asyncio.create_task(self._produce())
+        return self
+
+    async def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def read(self, size: int = -1) -> bytes:
+        """מחזיר size בתים (פחות רק בסוף הקובץ). שגיאת הורדה עולה לקורא - כלומר ל-upload_file."""
+        while not self._eof and (size < 0 or len(self._pending) < size):
+            item = await self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                self._pending.extend(item)
+        if size < 0:
+            size = len(self._pending)
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        metrics.BYTES_UPLOADED.inc(len(data), account=self.account)
+        return data
+
+
+def _file_name(message: Message) -> str:
+    return message.file.name or f"{message.id}{message.file.ext or ''}"
+
+
+async def _upload_bytes(client: TelegramClient, data: bytes, file_name: str, account=None):
+    """מעלה קובץ קטן שכבר הורד לזיכרון, וסופר אותו בבתים שהורדו ושהועלו."""
+    metrics.BYTES_DOWNLOADED.inc(len(data), account=account)
+    uploaded = await client.upload_file(data, file_name=file_name)
+    metrics.BYTES_UPLOADED.inc(len(data), account=account)
+    return uploaded
+
+
+async def _upload_thumb(client: TelegramClient, message: Message, account=None):
+    """התמונה הממוזערת של המסמך (כמה KB), כדי שסרטונים וקבצים לא יגיעו ליעד בלי תצוגה מקדימה."""
+    try:
+        data = await client.download_media(message, file=bytes, thumb=-1)
+        return await _upload_bytes(client, data, 'thumb.jpg', account) if data else None
+    except Exception as e:
+        logger.debug(f"אין תמונה ממוזערת להודעה {message.id}: {e}")
+        return None
+
+
+async def upload_message_media(client: TelegramClient, message: Message, account=None) -> Optional[InputMedia]:
+    """
+    מעלה מחדש את המדיה של הודעה בלי לכתוב אותה לדיסק, ומחזיר InputMedia מוכן לשליחה
+    (send_file עם פריט אחד או עם רשימה לאלבום). מסמכים (סרטונים, קבצים, שמע) עוברים
+    בזרימה דרך MediaStream עם המאפיינים המקוריים; תמונות קטנות (עד 10MB) ולכן נקראות לזיכרון כמו שהן.
+    מחזיר None למדיה שאין מה להוריד ממנה (למשל תצוגה מקדימה של קישור).
+    account - התווית של החשבון במדדי הבתים.
+    """
+    media = message.media
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        data = await client.download_media(message, file=bytes)
+        if not data:
+            return None
+        return InputMediaUploadedPhoto(await _upload_bytes(client, data, 'photo.jpg', account), spoiler=media.spoiler)
+
+    if isinstance(media, MessageMediaDocument) and media.document:
+        document = media.document
+        async with MediaStream(client, document, document.size, _file_name(message), account=account) as stream:
+            uploaded = await client.upload_file(stream, file_size=document.size, file_name=stream.name)
+        thumb = await _upload_thumb(client, message, account) if document.thumbs else None
+        return InputMediaUploadedDocument(
+            uploaded, document.mime_type, document.attributes, spoiler=media.spoiler, thumb=thumb
+        )
+
+    return None
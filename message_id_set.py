@@ -0,0 +1,111 @@
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Optional
+
+# פורמט בינארי: כותרת (קסם, גרסה, watermark, מספר מקטעים) ואחריה זוגות start/end
+_MAGIC = b'MIDS'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBqI')
+
+
+class MessageIdSet:
+    """
+    קבוצת מזהי הודעות בייצוג דחוס: watermark תחתון (כל המזהים עד אליו כלולים)
+    ומעליו רשימה ממוינת של מקטעים רציפים [start, end].
+    ערוץ של מיליוני הודעות שנשלחו ברצף נשמר כמספר בודד, ובדיקת שייכות היא O(log n).
+    """
+
+    __slots__ = ('watermark', '_starts', '_ends')
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.watermark: int = 0
+        self._starts = array('q')
+        self._ends = array('q')
+        self.update(ids)
+
+    def __contains__(self, message_id: int) -> bool:
+        if message_id <= self.watermark:
+            return True
+        i = bisect_right(self._starts, message_id) - 1
+        return i >= 0 and message_id <= self._ends[i]
+
+    def __len__(self) -> int:
+        return self.watermark + sum(e - s + 1 for s, e in zip(self._starts, self._ends))
+
+    def __bool__(self) -> bool:
+        return self.watermark > 0 or len(self._starts) > 0
+
+    def __repr__(self) -> str:
+        return f"MessageIdSet(watermark={self.watermark}, intervals={len(self._starts)})"
+
+    @property
+    def interval_count(self) -> int:
+        return len(self._starts)
+
+    def add(self, message_id: int):
+        self.add_range(message_id, message_id)
+
+    def update(self, ids: Iterable[int]):
+        for message_id in ids:
+            self.add_range(message_id, message_id)
+
+    def add_range(self, start: int, end: int):
+        """מוסיף את כל המזהים בטווח [start, end] וממזג מקטעים סמוכים."""
+        if end <= self.watermark or end < start:
+            return
+        starts, ends = self._starts, self._ends
+        # המקרה הנפוץ: התקדמות רציפה של ה-watermark
+        if start <= self.watermark + 1 and (not starts or end + 1 < starts[0]):
+            self.watermark = end
+            return
+        start = max(start, self.watermark + 1)
+
+        # מקטעים שחופפים או נוגעים בטווח החדש: [i, j)
+        i = bisect_left(ends, start - 1)
+        j = bisect_right(starts, end + 1)
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+            starts[i:j] = array('q', (start,))
+            ends[i:j] = array('q', (end,))
+        else:
+            starts.insert(i, start)
+            ends.insert(i, end)
+
+        # מקטע שמתחיל מיד אחרי ה-watermark נבלע בו
+        if starts and starts[0] <= self.watermark + 1:
+            self.watermark = ends[0]
+            del starts[0]
+            del ends[0]
+
+    def clear(self):
+        self.watermark = 0
+        del self._starts[:]
+        del self._ends[:]
+
+    def to_bytes(self) -> bytes:
+        pairs = array('q', (v for pair in zip(self._starts, self._ends) for v in pair))
+        if sys.byteorder == 'big':
+            pairs.byteswap()
+        return _HEADER.pack(_MAGIC, _VERSION, self.watermark, len(self._starts)) + pairs.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> 'MessageIdSet':
+        result = cls()
+        if not data:
+            return result
+        magic, version, watermark, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"פורמט קבוצת מזהים לא מוכר (magic={magic!r}, version={version})")
+        pairs = array('q')
+        pairs.frombytes(data[_HEADER.size:_HEADER.size + count * 16])
+        if len(pairs) != count * 2:
+            raise ValueError("קבוצת מזהים קטועה")
+        if sys.byteorder == 'big':
+            pairs.byteswap()
+        result.watermark = watermark
+        result._starts = pairs[0::2]
+        result._ends = pairs[1::2]
+        return result
@@ -0,0 +1,172 @@
+import asyncio
+import bisect
+import os
+import threading
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# קבועים
+METRICS_PORT_ENV = 'METRICS_PORT' # אם מוגדר, נפתח endpoint מקומי של /metrics בפורט הזה
+METRICS_HOST = '127.0.0.1'
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# שמות קריאים לחשבונות שמזוהים בקוד לפי מפתח פנימי (למשל auth_key_id ב-tor.py)
+_account_names: Dict[Hashable, str] = {}
+
+
+def name_account(account: Hashable, name: str):
+    """רושם שם שיופיע בתווית account במקום המפתח הפנימי של החשבון."""
+    _account_names[account] = name
+
+
+def account_label(account: Hashable) -> str:
+    return _account_names.get(account) or str(account if account is not None else '')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}' for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        with self._lock:
+            samples = self._samples()
+        return '\n'.join([f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}', *samples])
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                samples.append(f'{self.name}_bucket{_format_labels(self.label_names, key, (("le", bound),))} {cumulative}')
+            samples.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {total}')
+            samples.append(f'{self.name}_count{_format_labels(self.label_names, key)} {cumulative}')
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """כל המדדים בפורמט הטקסט של Prometheus."""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+MESSAGES_FETCHED = Counter('telegram_messages_fetched_total', 'Messages fetched from the source channel', ['account', 'target'])
+MESSAGES_SENT = Counter('telegram_messages_sent_total', 'Messages delivered to the target', ['account', 'target'])
+MESSAGES_SKIPPED = Counter('telegram_messages_skipped_total', 'Messages skipped (filtered, empty or already sent)', ['account', 'target'])
+MESSAGES_FAILED = Counter('telegram_messages_failed_total', 'Failed send attempts by error class', ['account', 'target', 'kind'])
+BYTES_UPLOADED = Counter('telegram_bytes_uploaded_total', 'Bytes uploaded to Telegram', ['account'])
+BYTES_DOWNLOADED = Counter('telegram_bytes_downloaded_total', 'Bytes downloaded from Telegram', ['account'])
+FLOOD_WAITS = Counter('telegram_flood_waits_total', 'FloodWait errors received', ['account'])
+FLOOD_WAIT_SECONDS = Counter('telegram_flood_wait_seconds_total', 'Seconds of FloodWait demanded by Telegram', ['account'])
+RETRY_QUEUE_DEPTH = Gauge('telegram_retry_queue_depth', 'Messages waiting in the retry queue', ['target'])
+SEND_LATENCY = Histogram('telegram_send_latency_seconds', 'Send request latency, after the rate limiter granted the slot', ['account'])
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass # כותרות - לא צריך אותן
+        path = request.split()[1].decode() if len(request.split()) > 1 else '/'
+        if path.split('?', 1)[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"שגיאה בבקשת מדדים: {e}")
+    finally:
+        writer.close()
+
+
+async def start_server(port: Optional[int] = None, host: str = METRICS_HOST) -> Optional[asyncio.AbstractServer]:
+    """
+    פותח endpoint מקומי של /metrics (פורמט Prometheus) בלולאת האירועים הנוכחית.
+    בלי port, נלקח ממשתנה הסביבה METRICS_PORT; אם גם הוא לא מוגדר - לא נפתח כלום.
+    """
+    port = port or int(os.getenv(METRICS_PORT_ENV) or 0)
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle, host, port)
+    except OSError as e:
+        logger.error(f"❌ לא ניתן לפתוח את endpoint המדדים בפורט {port}: {e}")
+        return None
+    logger.info(f"📊 מדדים זמינים ב-http://{host}:{port}/metrics")
+    return server
@@ -1,12 +1,17 @@
-from telethon import TelegramClient, errors, types
+from telethon import TelegramClient, errors, types, utils
 import asyncio
-import json
-import os
 import re
 from datetime import datetime, timedelta
 import logging
 import shutil
 
+import metrics
+from bulk_copy import MAX_FORWARD_IDS, forward_copies, iter_chunks
+from profiler import PROFILER
+from rate_limiter import AIMDController, RateLimiter
+from retry_queue import RetryPolicy, classify, send_with_retries
+from state_store import StateStore
+
 # הגדרת לוגים
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,50 +23,46 @@ class מעביר_טלגרם:
         self.PHONE_NUMBER = None
         
         self.לקוח = None
-        self.קובץ_התקדמות = 'התקדמות.json'
+        self.מאגר_התקדמות = StateStore()
+        self.מפתח_התקדמות = None
         
         # הגדרות בטיחות והגבלת קצב
-        self.השהיה_בין_הודעות = 2  # שניות - מומלץ לשמור על ערך של 1-3 שניות
         self.מקס_הודעות_לדקה = 20  # הגבלה של טלגרם למניעת חסימות
-        self.מונה_הודעות_בדקה = 0
-        self.זמן_תחילת_דקה = datetime.now()
+        self.מגביל_קצב = RateLimiter(target_rate=self.מקס_הודעות_לדקה / 60, account_rate=self.מקס_הודעות_לדקה / 60)
+        self.בקר_קצב = AIMDController(self.מגביל_קצב)
+        self.העתקה_בכמות = False # ForwardMessages עם drop_author, עד 100 הודעות לבקשה
+        self.מדיניות_ניסיונות = RetryPolicy()
 
-    def טען_התקדמות(self):
-        """טוען נתוני התקדמות מקובץ"""
-        if os.path.exists(self.קובץ_התקדמות):
-            try:
-                with open(self.קובץ_התקדמות, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"שגיאה בטעינת התקדמות: {e}")
+    def טען_התקדמות(self, מקור, יעד):
+        """טוען נתוני התקדמות של צמד מקור/יעד ממאגר המצב"""
+        self.מפתח_התקדמות = (utils.get_peer_id(מקור), utils.get_peer_id(יעד), self.PHONE_NUMBER)
+        try:
+            רשומה = self.מאגר_התקדמות.load_progress(*self.מפתח_התקדמות)
+            return {"הודעה_אחרונה": רשומה['last_message_id'], "סך_הועברו": רשומה['total_sent'], "תאריך_עדכון": רשומה['updated_at']}
+        except Exception as e:
+            logger.error(f"שגיאה בטעינת התקדמות: {e}")
         return {"הודעה_אחרונה": 0, "סך_הועברו": 0, "תאריך_עדכון": str(datetime.now())}
 
     def שמור_התקדמות(self, נתונים):
-        """שומר נתוני התקדמות לקובץ"""
+        """שומר את שורת ההתקדמות של צמד מקור/יעד הנוכחי בלבד"""
         try:
             נתונים["תאריך_עדכון"] = str(datetime.now())
-            with open(self.קובץ_התקדמות, 'w', encoding='utf-8') as f:
-                json.dump(נתונים, f, ensure_ascii=False, indent=2)
+            self.מאגר_התקדמות.save_progress(
+                *self.מפתח_התקדמות,
+                last_message_id=נתונים["הודעה_אחרונה"],
+                total_sent=נתונים["סך_הועברו"]
+            )
         except Exception as e:
             logger.error(f"שגיאה בשמירת התקדמות: {e}")
 
-    async def בדוק_הגבלות(self):
-        """בודק ומנהל את הגבלות קצב השליחה כדי למנוע חסימה."""
-        זמן_שעבר = datetime.now() - self.זמן_תחילת_דקה
-        
-        if זמן_שעבר.total_seconds() >= 60:
-            # עברה דקה, אפס את המונה והזמן
-            self.מונה_הודעות_בדקה = 0
-            self.זמן_תחילת_דקה = datetime.now()
-        
-        if self.מונה_הודעות_בדקה >= self.מקס_הודעות_לדקה:
-            המתנה = 60 - זמן_שעבר.total_seconds()
-            if המתנה > 0:
-                logger.info(f"הגעת להגבלת הקצב. ממתין {int(המתנה)} שניות...")
-                await asyncio.sleep(המתנה)
-            # אפס מחדש לאחר ההמתנה
-            self.מונה_הודעות_בדקה = 0
-            self.זמן_תחילת_דקה = datetime.now()
+    async def בדוק_הגבלות(self, יעד):
+        """ממתין לתור שליחה במגביל הקצב - קצב חלק במקום חלון של דקה שמאפשר פרץ ואז עוצר הכל."""
+        await self.מגביל_קצב.acquire(account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד))
+
+    async def שלח_עם_ניסיונות(self, שליחה, יעד):
+        """שליחה עם ניסיונות חוזרים (send_with_retries); FloodWait מוריד את הקצב של החשבון מול היעד."""
+        return await send_with_retries(שליחה, self.מדיניות_ניסיונות,
+                                       lambda שניות: self.בקר_קצב.on_flood(self.PHONE_NUMBER, utils.get_peer_id(יעד), שניות))
 
     async def התחבר(self):
         """יוצר חיבור לטלגרם"""
@@ -72,7 +73,7 @@ class מעביר_טלגרם:
 
             session_file = f"session_{self.PHONE_NUMBER.replace('+', '')}.session"
             
-            self.לקוח = TelegramClient(session_file, self.API_ID, self.API_HASH)
+            self.לקוח = PROFILER.instrument(TelegramClient(session_file, self.API_ID, self.API_HASH))
             logger.info("מתחבר לטלגרם...")
             await self.לקוח.connect()
 
@@ -123,29 +124,55 @@ class מעביר_טלגרם:
         מעתיק הודעה אחת לערוץ יעד. 
         שיטה זו מטפלת בקבצים גדולים (עד 2GB) אוטומטית וללא קרדיט למקור.
         """
-        try:
+        if not (הודעה.text or הודעה.media):
+            logger.warning(f"הודעה {הודעה.id} ריקה, מדלג.")
+            metrics.MESSAGES_SKIPPED.inc(account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד))
+            return True
+
+        async def שליחה():
             # בדיקת הגבלות קצב לפני שליחה
-            await self.בדוק_הגבלות()
-            
-            if הודעה.text or הודעה.media:
-                # שימוש ב-send_message עם אובייקט ההודעה מעתיק אותה במלואה
-                # ללא צורך בהורדה ידנית ובדיקת גודל.
-                await self.לקוח.send_message(יעד, message=הודעה)
-                self.מונה_הודעות_בדקה += 1  # קדם את המונה רק לאחר הצלחה
-                return True
-            else:
-                logger.warning(f"הודעה {הודעה.id} ריקה, מדלג.")
-                return True
-            
-        except errors.FloodWaitError as e:
-            logger.warning(f"הגבלת flood, ממתין {e.seconds + 5} שניות...")
-            await asyncio.sleep(e.seconds + 5)
-            return await self.העבר_הודעה(הודעה, יעד)  # נסה שוב
+            await self.בדוק_הגבלות(יעד)
+            # שימוש ב-send_message עם אובייקט ההודעה מעתיק אותה במלואה
+            # ללא צורך בהורדה ידנית ובדיקת גודל.
+            await self.לקוח.send_message(יעד, message=הודעה)
 
+        try:
+            await self.שלח_עם_ניסיונות(שליחה, יעד)
+            self.בקר_קצב.on_success(self.PHONE_NUMBER, utils.get_peer_id(יעד))
+            return True
         except Exception as e:
             logger.error(f"שגיאה בהעברת הודעה {הודעה.id}: {e}")
+            metrics.MESSAGES_FAILED.inc(account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד), kind=classify(e))
             return False
 
+    async def העתק_מנה(self, מנה, מקור, יעד):
+        """
+        מעתיק מנה של עד 100 הודעות בבקשת ForwardMessages אחת, ללא קרדיט למקור (drop_author).
+        הודעות שלא הועתקו נשלחות אחת-אחת בדרך הרגילה. מחזיר כמה הודעות הועתקו בהצלחה.
+        """
+        לא_הועתקו = מנה
+        if self.העתקה_בכמות:
+            async def העתקה():
+                await self.בדוק_הגבלות(יעד) # אסימון אחד לכל המנה
+                return await forward_copies(self.לקוח, יעד, מקור, מנה)
+
+            try:
+                לא_הועתקו = await self.שלח_עם_ניסיונות(העתקה, יעד)
+                self.בקר_קצב.on_success(self.PHONE_NUMBER, utils.get_peer_id(יעד), len(מנה) - len(לא_הועתקו))
+
+            except errors.ChatForwardsRestrictedError:
+                logger.warning("ערוץ המקור חוסם העברת תוכן. ממשיך בהעתקה הודעה אחר הודעה.")
+                self.העתקה_בכמות = False
+
+            except Exception as e:
+                logger.warning(f"העתקת מנה של {len(מנה)} הודעות נכשלה ({e}), שולח אותן אחת-אחת.")
+
+        הועתקו = len(מנה) - len(לא_הועתקו)
+        for הודעה in לא_הועתקו:
+            if await self.העבר_הודעה(הודעה, יעד):
+                הועתקו += 1
+        return הועתקו
+
     async def התחל_העברה(self):
         """מתחיל את תהליך העברת ההודעות."""
         print("\n=== מעביר הודעות טלגרם (גרסה מתקדמת) ===\n")
@@ -161,7 +188,7 @@ class מעביר_טלגרם:
         if not יעד: 
             return
         
-        התקדמות = self.טען_התקדמות()
+        התקדמות = self.טען_התקדמות(מקור, יעד)
         
         print("\nאפשרויות:")
         print("1. המשך מההודעה האחרונה")
@@ -171,23 +198,35 @@ class מעביר_טלגרם:
         if בחירה == '2':
             התקדמות = {"הודעה_אחרונה": 0, "סך_הועברו": 0}
         
+        print("\nמצב העתקה:")
+        print("1. הודעה אחר הודעה")
+        print(f"2. העתקה בכמות - עד {MAX_FORWARD_IDS} הודעות בבקשה אחת, ללא קרדיט (מהיר בהרבה)")
+        self.העתקה_בכמות = input("בחר (1/2): ").strip() == '2'
+        בכמות = self.העתקה_בכמות
+
         logger.info(f"מתחיל העברה מהודעה ID > {התקדמות['הודעה_אחרונה']}...")
+        PROFILER.begin()
         
         הודעות_נכשלו_ברצף = 0
         
         try:
-            async for הודעה in self.לקוח.iter_messages(
+            הודעות = self.לקוח.iter_messages(
                 מקור, 
                 reverse=True, 
                 offset_id=התקדמות["הודעה_אחרונה"]
-            ):
-                if הודעה.id <= התקדמות["הודעה_אחרונה"]: 
+            )
+            # במצב העתקה בכמות מגיעות מנות של עד 100 הודעות (בלי לחתוך אלבומים); אחרת הודעה אחת בכל פעם
+            async for קבוצה in iter_chunks(הודעות, MAX_FORWARD_IDS if בכמות else 1):
+                קבוצה = [הודעה for הודעה in קבוצה if הודעה.id > התקדמות["הודעה_אחרונה"]]
+                if not קבוצה:
                     continue
+                metrics.MESSAGES_FETCHED.inc(len(קבוצה), account=self.PHONE_NUMBER, target=utils.get_peer_id(יעד))
+                הודעה = קבוצה[-1]
 
-                הצלחה = await self.העבר_הודעה(הודעה, יעד)
+                הועתקו = await self.העתק_מנה(קבוצה, מקור, יעד)
                 
-                if הצלחה:
-                    התקדמות["סך_הועברו"] += 1
+                if הועתקו:
+                    התקדמות["סך_הועברו"] += הועתקו
                     הודעות_נכשלו_ברצף = 0
                 else:
                     הודעות_נכשלו_ברצף += 1
@@ -197,11 +236,9 @@ class מעביר_טלגרם:
                 
                 התקדמות["הודעה_אחרונה"] = הודעה.id
                 
-                if התקדמות["סך_הועברו"] % 10 == 0:
-                    print(f"✅ הועברו {התקדמות['סך_הועברו']} הודעות... שומר התקדמות.")
-                    self.שמור_התקדמות(התקדמות)
-                
-                await asyncio.sleep(self.השהיה_בין_הודעות)
+                self.שמור_התקדמות(התקדמות)
+                if הועתקו and התקדמות["סך_הועברו"] // 10 != (התקדמות["סך_הועברו"] - הועתקו) // 10:
+                    print(f"✅ הועברו {התקדמות['סך_הועברו']} הודעות... (קצב נוכחי: {self.בקר_קצב.current_rate(self.PHONE_NUMBER, utils.get_peer_id(יעד)):.1f} הודעות לדקה)")
                 
         except KeyboardInterrupt:
             logger.info("\n⚠️ העברה הופסקה על ידי המשתמש.")
@@ -219,10 +256,16 @@ class מעביר_טלגרם:
         if self.לקוח and self.לקוח.is_connected():
             await self.לקוח.disconnect()
             logger.info("חיבור נסגר.")
+        self.מאגר_התקדמות.close()
 
 async def main():
-    async with מעביר_טלגרם() as מעביר:
-        await מעביר.התחל_העברה()
+    שרת_מדדים = await metrics.start_server() # רק אם METRICS_PORT מוגדר
+    try:
+        async with מעביר_טלגרם() as מעביר:
+            await מעביר.התחל_העברה()
+    finally:
+        if שרת_מדדים:
+            שרת_מדדים.close()
 
 if __name__ == '__main__':
     try:
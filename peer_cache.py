@@ -0,0 +1,145 @@
+import re
+from typing import Dict, Hashable, List, Optional, Set, Tuple, Union
+from telethon import TelegramClient, utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser, PeerChannel
+import logging
+
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+InputPeer = Union[InputPeerUser, InputPeerChat, InputPeerChannel]
+
+_KINDS = {InputPeerUser: 'user', InputPeerChat: 'chat', InputPeerChannel: 'channel'}
+
+_LINK = re.compile(r'^(?:https?://)?(?:t\.me|telegram\.me)/(?:s/)?([A-Za-z0-9_]+)/?$')
+
+
+def _build_peer(peer_id: int, kind: str, access_hash: int) -> InputPeer:
+    bare_id = utils.resolve_id(peer_id)[0]
+    if kind == 'user':
+        return InputPeerUser(bare_id, access_hash)
+    if kind == 'chat':
+        return InputPeerChat(bare_id)
+    return InputPeerChannel(bare_id, access_hash)
+
+
+def _normalize_username(text: str) -> Optional[str]:
+    """מחלץ שם משתמש מ-@name, name או קישור t.me (ומחזיר אותו באותיות קטנות)."""
+    text = text.strip()
+    match = _LINK.match(text)
+    if match:
+        text = match.group(1)
+    text = text.lstrip('@')
+    if re.fullmatch(r'[A-Za-z][A-Za-z0-9_]{3,}', text):
+        return text.lower()
+    return None
+
+
+def candidate_peer_ids(text: str) -> List[int]:
+    """המזהים המסומנים האפשריים לקלט מספרי: כמו שהוא, או מזהה "חשוף" של ערוץ / קבוצה."""
+    text = text.strip()
+    if not text.lstrip('-').isdigit():
+        return []
+    number = int(text)
+    if number > 0:
+        return [number, utils.get_peer_id(PeerChannel(number)), -number]
+    return [number]
+
+
+class PeerCache:
+    """
+    מטמון InputPeer (כולל access_hash) לכל חשבון, שנשמר בטבלת peers של מאגר המצב.
+    StringSession לא שומר ישויות בין הרצות, ולכן בלי המטמון כל הרצה פותרת מחדש את
+    ערוצי המקור והיעד מול השרת. בנתיב החם פתרון peer הוא חיפוש אחד במילון.
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self._peers: Dict[Tuple[Hashable, int], InputPeer] = {}
+        self._usernames: Dict[Tuple[Hashable, str], int] = {}
+        self._loaded: Set[Hashable] = set()
+
+    def _ensure_loaded(self, account: Hashable):
+        if account in self._loaded:
+            return
+        for peer_id, kind, access_hash, username in self.store.load_peers(account):
+            self._peers[(account, peer_id)] = _build_peer(peer_id, kind, access_hash)
+            if username:
+                self._usernames[(account, username.lower())] = peer_id
+        self._loaded.add(account)
+
+    def get(self, account: Hashable, peer_id: int) -> Optional[InputPeer]:
+        """InputPeer שמור לפי מזהה מסומן (כמו -100...), או None."""
+        if account not in self._loaded:
+            self._ensure_loaded(account)
+        return self._peers.get((account, peer_id))
+
+    def lookup(self, account: Hashable, text: str) -> Optional[InputPeer]:
+        """מחפש במטמון לפי קלט של משתמש: @username, קישור t.me, או מזהה עם/בלי קידומת -100."""
+        self._ensure_loaded(account)
+        username = _normalize_username(text)
+        if username:
+            peer_id = self._usernames.get((account, username))
+            return self._peers.get((account, peer_id)) if peer_id is not None else None
+        for peer_id in candidate_peer_ids(text):
+            peer = self._peers.get((account, peer_id))
+            if peer is not None:
+                return peer
+        return None
+
+    def _store(self, account: Hashable, input_peer, username: Optional[str] = None) -> InputPeer:
+        kind = _KINDS.get(type(input_peer))
+        if kind is None:
+            return input_peer # InputPeerSelf / InputPeerEmpty וכו' - אין מה לשמור
+        self._ensure_loaded(account)
+        peer_id = utils.get_peer_id(input_peer)
+        username = username.lower() if username else None
+        if self._peers.get((account, peer_id)) != input_peer or \
+                (username and self._usernames.get((account, username)) != peer_id):
+            self._peers[(account, peer_id)] = input_peer
+            if username:
+                self._usernames[(account, username)] = peer_id
+            try:
+                self.store.save_peer(account, peer_id, kind, getattr(input_peer, 'access_hash', 0) or 0, username)
+            except Exception as e:
+                logger.warning(f"⚠️ לא ניתן לשמור את peer {peer_id} במטמון: {e}")
+        return input_peer
+
+    def remember(self, account: Hashable, entity) -> Optional[InputPeer]:
+        """שומר את ה-InputPeer של ישות שכבר נפתרה (ערוץ, קבוצה או משתמש) בלי פנייה לשרת."""
+        try:
+            input_peer = utils.get_input_peer(entity)
+        except TypeError:
+            return None
+        return self._store(account, input_peer, getattr(entity, 'username', None))
+
+    def forget(self, account: Hashable, peer_id: int):
+        """מסיר peer שה-access_hash שלו כבר לא תקף (למשל אחרי ChannelInvalidError)."""
+        self._peers.pop((account, peer_id), None)
+        for key in [key for key, value in self._usernames.items() if key[0] == account and value == peer_id]:
+            del self._usernames[key]
+        try:
+            self.store.delete_peer(account, peer_id)
+        except Exception as e:
+            logger.warning(f"⚠️ לא ניתן למחוק את peer {peer_id} מהמטמון: {e}")
+
+    async def resolve(self, client: TelegramClient, account: Hashable, peer) -> InputPeer:
+        """
+        מחזיר InputPeer עבור peer (מזהה מסומן, שם משתמש או ישות). פונה לשרת רק אם
+        ה-peer לא נמצא במטמון, ושומר את התוצאה לפעמים הבאות.
+        """
+        if isinstance(peer, int):
+            cached = self.get(account, peer)
+            if cached is not None:
+                return cached
+        elif isinstance(peer, str):
+            cached = self.lookup(account, peer)
+            if cached is not None:
+                return cached
+        else:
+            remembered = self.remember(account, peer)
+            if remembered is not None:
+                return remembered
+        input_peer = await client.get_input_entity(peer)
+        return self._store(account, input_peer, _normalize_username(peer) if isinstance(peer, str) else None)
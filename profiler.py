@@ -0,0 +1,187 @@
+import atexit
+import functools
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# קבועים
+PROFILE_ENV = 'PROFILE_STAGES' # 1 - דוח ל-PROFILE_REPORT_FILE; כל ערך אחר - הנתיב של הדוח
+PROFILE_REPORT_FILE = 'profile_report.txt'
+MAX_SAMPLES = 100_000 # דגימות לשלב לחישוב האחוזונים (reservoir); הספירה והסכום תמיד מדויקים
+
+# מתודות הלקוח שנמדדות, לפי שלב. שלבים יכולים להיות מקוננים (send_message פותר את היעד
+# דרך get_input_entity), ולכן הזמן שלהם נספר בשני השלבים.
+_CLIENT_STAGES = {
+    'get_input_entity': 'resolve',
+    'upload_file': 'upload',
+    'send_message': 'send',
+    'send_file': 'send',
+    'forward_messages': 'send',
+}
+# איטרטורים: כל הודעה / חלק שמגיעים מהם הם דגימה (רובן מיידיות, אחת לעמוד היא הבקשה עצמה)
+_CLIENT_ITERATORS = {
+    'iter_messages': 'fetch',
+    'iter_download': 'download',
+}
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples: List[float] = []
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _TimedIterator:
+    """עוטף איטרטור אסינכרוני (למשל RequestIter של Telethon) ומודד כל __anext__. שאר המתודות (collect, total) עוברות כמו שהן."""
+
+    def __init__(self, profiler: 'StageProfiler', stage: str, iterator):
+        self._profiler = profiler
+        self._stage = stage
+        self._iterator = iterator
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        start = time.perf_counter()
+        try:
+            return await self._iterator.__anext__()
+        finally:
+            self._profiler.record(self._stage, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._iterator, name)
+
+
+class StageProfiler:
+    """
+    פרופיילר אופציונלי לשלבי הנתיב של כל הודעה: אחזור (iter_messages), פתרון ישויות
+    (get_input_entity), העלאה, הורדה ושליחה, וגם ההמתנות המכוונות - מגביל הקצב
+    (בדוק_הגבלות) וההמתנות אחרי FloodWait. כבוי כברירת מחדל; כשהוא כבוי כל הקריאות
+    חוזרות מיד ולקוחות לא נעטפים.
+
+    ביציאה נכתב דוח עם p50 / p95 / p99 (ומקסימום) לכל שלב וחלק השלב מזמן הריצה (wall-clock) מ-begin.
+    בריצה מקבילית (כמה חשבונות ב-tor.py) השלבים חופפים, והסכום יכול לעבור 100%.
+    """
+
+    def __init__(self, report_path: Optional[str] = None, max_samples: int = MAX_SAMPLES):
+        self.report_path = report_path
+        self.enabled = report_path is not None
+        self.max_samples = max_samples
+        self._stages: Dict[str, _Stage] = {}
+        self._started: Optional[float] = None
+        self._random = random.Random(0)
+        if self.enabled:
+            atexit.register(self.write_report)
+
+    def begin(self):
+        """תחילת מדידת זמן הריצה (אחרי ההתחברות והתפריטים). רק הקריאה הראשונה נספרת."""
+        if self.enabled and self._started is None:
+            self._started = time.perf_counter()
+
+    def record(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        if self._started is None:
+            self._started = time.perf_counter() - seconds
+        entry = self._stages.get(stage)
+        if entry is None:
+            entry = self._stages[stage] = _Stage()
+        entry.count += 1
+        entry.total += seconds
+        if len(entry.samples) < self.max_samples:
+            entry.samples.append(seconds)
+        else:
+            index = self._random.randrange(entry.count)
+            if index < self.max_samples:
+                entry.samples[index] = seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """מודד בלוק (גם בלוק שיש בו await - נמדד הזמן עד שהוא מסתיים)."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def _timed(self, stage: str, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def _timed_iterator(self, stage: str, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return _TimedIterator(self, stage, method(*args, **kwargs))
+        return wrapper
+
+    def instrument(self, client):
+        """עוטף את המתודות של לקוח Telethon שמשויכות לשלבים (רק כשהפרופיילר פעיל)."""
+        if not self.enabled or getattr(client, '_profiled', False):
+            return client
+        for name, stage in _CLIENT_STAGES.items():
+            setattr(client, name, self._timed(stage, getattr(client, name)))
+        for name, stage in _CLIENT_ITERATORS.items():
+            setattr(client, name, self._timed_iterator(stage, getattr(client, name)))
+        client._profiled = True
+        return client
+
+    def report(self) -> str:
+        wall = time.perf_counter() - self._started if self._started is not None else 0.0
+        lines = [
+            f"דוח שלבים - זמן ריצה {wall:.1f} שניות (שלבים מקבילים או מקוננים חופפים, והסכום יכול לעבור 100%)",
+            f"{'stage':<12} {'count':>9} {'total_s':>10} {'wall%':>7} {'p50_ms':>10} {'p95_ms':>10} {'p99_ms':>10} {'max_ms':>10}",
+        ]
+        for name, entry in sorted(self._stages.items(), key=lambda item: -item[1].total):
+            ordered = sorted(entry.samples)
+            share = entry.total / wall * 100 if wall else 0.0
+            lines.append(
+                f"{name:<12} {entry.count:>9} {entry.total:>10.2f} {share:>6.1f}% "
+                f"{_percentile(ordered, 0.50) * 1000:>10.1f} {_percentile(ordered, 0.95) * 1000:>10.1f} "
+                f"{_percentile(ordered, 0.99) * 1000:>10.1f} {ordered[-1] * 1000:>10.1f}"
+            )
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self):
+        if not self._stages:
+            return
+        text = self.report()
+        try:
+            with open(self.report_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            logger.info(f"⏱️ דוח הפרופיילר נכתב ל-{self.report_path}:\n{text}")
+        except OSError as e:
+            logger.error(f"❌ לא ניתן לכתוב את דוח הפרופיילר ל-{self.report_path}: {e}\n{text}")
+
+
+def _report_path_from_env() -> Optional[str]:
+    value = os.getenv(PROFILE_ENV, '').strip()
+    if not value or value.lower() in ('0', 'false', 'no'):
+        return None
+    return PROFILE_REPORT_FILE if value.lower() in ('1', 'true', 'yes') else value
+
+
+PROFILER = StageProfiler(_report_path_from_env())
@@ -0,0 +1,172 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Tuple
+import logging
+
+from message_id_set import MessageIdSet
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# קבועים
+JOURNAL_FILE = 'progress.journal'
+
+# רשומה: סוג, מקור, יעד, טווח מזהים [start, end] ואחריה CRC32 של כל השדות
+_RECORD = struct.Struct('<Bqqqq')
+_CRC = struct.Struct('<I')
+_RECORD_SIZE = _RECORD.size + _CRC.size
+
+_COMMIT = 1
+_RESET = 2
+
+PairKey = Tuple[int, int]
+
+
+class ProgressJournal:
+    """
+    יומן התקדמות שרק מוסיפים לו: כל רשומה היא "הודעות start..end נשלחו מהמקור ליעד".
+    סימון הודעה עולה כתיבה רציפה אחת של 41 בתים, fsync מתבצע בקבוצות,
+    ודחיסה (כתיבת snapshot למאגר המצב וקיצוץ היומן) רצה ברקע.
+    אחרי קריסה, ה-snapshot נטען וזנב היומן מוחל עליו מחדש; רשומה קטועה בסוף היומן נזרקת.
+    """
+
+    def __init__(self, store: StateStore, path: str = JOURNAL_FILE, *,
+                 sync_every: int = 64, sync_interval: float = 1.0, compact_after: int = 50000):
+        self.store = store
+        self.path = path
+        self.old_path = path + '.old'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_after = compact_after
+
+        self.sets: Dict[PairKey, MessageIdSet] = {}
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._records_since_compact = 0
+        self._compaction: Optional[threading.Thread] = None
+
+        started = time.perf_counter()
+        replayed = self._replay(self.old_path) + self._replay(self.path)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._records_since_compact = replayed
+        if replayed:
+            logger.info(f"✅ שוחזרו {replayed} רשומות מיומן ההתקדמות ב-{(time.perf_counter() - started) * 1000:.1f} ms.")
+        if os.path.exists(self.old_path):
+            # דחיסה קודמת לא הסתיימה - משלימים אותה עכשיו
+            self._write_snapshot(self._snapshot(), self.old_path)
+
+    def _load_set(self, key: PairKey) -> MessageIdSet:
+        if key not in self.sets:
+            self.sets[key] = MessageIdSet.from_bytes(self.store.load_sent_set(*key))
+        return self.sets[key]
+
+    def _replay(self, path: str) -> int:
+        """מחיל את רשומות היומן על הקבוצות בזיכרון ומחזיר את מספר הרשומות התקינות."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb') as f:
+            data = f.read()
+        count = 0
+        offset = 0
+        while offset + _RECORD_SIZE <= len(data):
+            body = data[offset:offset + _RECORD.size]
+            (crc,) = _CRC.unpack_from(data, offset + _RECORD.size)
+            if zlib.crc32(body) != crc:
+                break
+            kind, source, target, start, end = _RECORD.unpack(body)
+            sent = self._load_set((source, target))
+            if kind == _COMMIT:
+                sent.add_range(start, end)
+            elif kind == _RESET:
+                sent.clear()
+            offset += _RECORD_SIZE
+            count += 1
+        if offset != len(data):
+            logger.warning(f"⚠️ נמצאה רשומה קטועה או פגומה ביומן {path} (בית {offset}). הזנב נחתך.")
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return count
+
+    def _append(self, kind: int, key: PairKey, start: int = 0, end: int = 0):
+        body = _RECORD.pack(kind, key[0], key[1], start, end)
+        os.write(self._fd, body + _CRC.pack(zlib.crc32(body)))
+        self._unsynced += 1
+        self._records_since_compact += 1
+        if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+        if self._records_since_compact >= self.compact_after:
+            self.compact()
+
+    def sent_set(self, source: int, target: int) -> MessageIdSet:
+        """מחזיר את קבוצת ההודעות שנשלחו מהמקור ליעד (snapshot + זנב היומן)."""
+        return self._load_set((source, target))
+
+    def commit(self, source: int, target: int, start: int, end: Optional[int] = None):
+        """רושם שהודעות start..end (או הודעה בודדת) נשלחו מהמקור ליעד."""
+        end = start if end is None else end
+        self._load_set((source, target)).add_range(start, end)
+        self._append(_COMMIT, (source, target), start, end)
+
+    def reset(self, source: int, target: int):
+        """מאפס את קבוצת ההודעות שנשלחו עבור צמד מקור/יעד."""
+        self._load_set((source, target)).clear()
+        self._append(_RESET, (source, target))
+        self.sync()
+
+    def sync(self):
+        if self._unsynced:
+            os.fsync(self._fd)
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _snapshot(self) -> Dict[PairKey, bytes]:
+        return {key: sent.to_bytes() for key, sent in self.sets.items()}
+
+    def _write_snapshot(self, snapshots: Dict[PairKey, bytes], journal_path: str):
+        """
+        כותב את ה-snapshot למאגר ורק אחר כך מוחק את היומן שהוא מכסה. בשגיאה הטרנזקציה מבוטלת
+        והיומן נשאר, ו-compact הבא מנסה שוב.
+        """
+        try:
+            with self.store.transaction():
+                for key, data in snapshots.items():
+                    self.store.save_sent_set(*key, data)
+            os.remove(journal_path)
+        except Exception as e:
+            logger.error(f"❌ שגיאה בדחיסת יומן ההתקדמות: {e}")
+
+    def compact(self):
+        """מסובב את היומן ודוחס את הקודם ל-snapshot ברקע."""
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        if os.path.exists(self.old_path):
+            # ה-snapshot של היומן הקודם נכשל - מנסים אותו שוב (עם המצב הנוכחי, שמכסה גם אותו);
+            # היומן הנוכחי יסובב בדחיסה הבאה, אחרי שהקודם נמחק
+            self._compaction = threading.Thread(
+                target=self._write_snapshot, args=(self._snapshot(), self.old_path), name='journal-compaction'
+            )
+            self._compaction.start()
+            return
+        self.sync()
+        os.close(self._fd)
+        os.replace(self.path, self.old_path)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._records_since_compact = 0
+        self._compaction = threading.Thread(
+            target=self._write_snapshot, args=(self._snapshot(), self.old_path), name='journal-compaction'
+        )
+        self._compaction.start()
+
+    def close(self):
+        """ממתין לדחיסה שברקע, דוחס את כל היומן וסוגר אותו."""
+        if self._compaction is not None:
+            self._compaction.join()
+        self.sync()
+        if self._records_since_compact:
+            self.compact()
+            if self._compaction is not None:
+                self._compaction.join()
+        os.close(self._fd)
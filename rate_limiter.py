@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import time
+from typing import Dict, Hashable, List, Optional
+import logging
+
+import metrics
+from profiler import PROFILER
+
+logger = logging.getLogger(__name__)
+
+# מתי המשימה הנוכחית קיבלה את האסימון האחרון - ממנו נמדד זמן השליחה עצמה, בלי ההמתנה בתור
+_granted_at: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('granted_at', default=None)
+
+
+class TokenBucket:
+    """
+    דלי אסימונים בגרסת GCRA: במקום מונה שמתאפס כל דקה, כל שליחה "שומרת" לעצמה
+    את הזמן הפנוי הבא. הקצב יוצא חלק (אין פרץ של 20 הודעות בקצה החלון),
+    והשמירה מתבצעת לפני ה-await הראשון ולכן אין מרוץ בין משימות מקבילות.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.capacity = max(1.0, capacity)
+        self._tat = 0.0 # theoretical arrival time - הזמן שבו הדלי יהיה מלא שוב
+        self.rate = rate
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float):
+        if rate <= 0:
+            raise ValueError("הקצב חייב להיות חיובי")
+        self._rate = rate
+        self._interval = 1.0 / rate
+        self._tolerance = (self.capacity - 1) * self._interval
+
+    def earliest(self, now: float) -> float:
+        """הזמן המוקדם ביותר שבו אפשר לקחת אסימון."""
+        return max(now, self._tat - self._tolerance)
+
+    def reserve(self, at: float):
+        """לוקח אסימון בזמן at (שחושב קודם ע"י earliest)."""
+        self._tat = max(self._tat, at) + self._interval
+
+    def block_until(self, until: float):
+        """חוסם את הדלי עד זמן מסוים (למשל אחרי FloodWait או slow mode)."""
+        self._tat = max(self._tat, until + self._tolerance)
+
+    async def acquire(self) -> float:
+        now = time.monotonic()
+        at = self.earliest(now)
+        self.reserve(at)
+        if at > now:
+            await asyncio.sleep(at - now)
+        return at - now
+
+
+class RateLimiter:
+    """
+    מגביל קצב היררכי: דלי גלובלי, דלי לכל צ'אט יעד ודלי לכל חשבון, ובנוסף
+    slow mode לכל צמד (חשבון, יעד). שליחה ממתינה עד שכל הדליים הרלוונטיים מאפשרים אותה,
+    והמתנות מוגשות לפי סדר הבקשה (FIFO).
+    """
+
+    def __init__(self, global_rate: Optional[float] = None, target_rate: Optional[float] = None,
+                 account_rate: Optional[float] = None, burst: float = 1.0):
+        self.burst = burst
+        self.target_rate = target_rate
+        self.account_rate = account_rate
+        self.global_bucket = TokenBucket(global_rate, burst) if global_rate else None
+        self.target_buckets: Dict[Hashable, TokenBucket] = {}
+        self.account_buckets: Dict[Hashable, TokenBucket] = {}
+        self.slow_mode_seconds: Dict[Hashable, float] = {}
+        self.slow_mode_buckets: Dict[tuple, TokenBucket] = {}
+
+    def set_slow_mode(self, target: Hashable, seconds: float):
+        """מגדיר slow mode ליעד: כל חשבון ישלח אליו לכל היותר הודעה אחת כל seconds שניות."""
+        if seconds and seconds > 0:
+            self.slow_mode_seconds[target] = seconds
+        else:
+            self.slow_mode_seconds.pop(target, None)
+        for key in [key for key in self.slow_mode_buckets if key[1] == target]:
+            del self.slow_mode_buckets[key]
+
+    def target_bucket(self, target: Hashable) -> Optional[TokenBucket]:
+        if target is None or not self.target_rate:
+            return None
+        if target not in self.target_buckets:
+            self.target_buckets[target] = TokenBucket(self.target_rate, self.burst)
+        return self.target_buckets[target]
+
+    def account_bucket(self, account: Hashable) -> Optional[TokenBucket]:
+        if account is None or not self.account_rate:
+            return None
+        if account not in self.account_buckets:
+            self.account_buckets[account] = TokenBucket(self.account_rate, self.burst)
+        return self.account_buckets[account]
+
+    def _slow_mode_bucket(self, account: Hashable, target: Hashable) -> Optional[TokenBucket]:
+        seconds = self.slow_mode_seconds.get(target)
+        if not seconds:
+            return None
+        key = (account, target)
+        if key not in self.slow_mode_buckets:
+            self.slow_mode_buckets[key] = TokenBucket(1.0 / seconds, 1)
+        return self.slow_mode_buckets[key]
+
+    def _buckets(self, account: Hashable, target: Hashable) -> List[TokenBucket]:
+        buckets = [
+            self.global_bucket,
+            self.target_bucket(target),
+            self.account_bucket(account),
+            self._slow_mode_bucket(account, target),
+        ]
+        return [bucket for bucket in buckets if bucket is not None]
+
+    def delay_for(self, account: Hashable = None, target: Hashable = None) -> float:
+        """כמה זמן שליחה חדשה תמתין כרגע (בלי לשמור מקום)."""
+        now = time.monotonic()
+        return max([bucket.earliest(now) for bucket in self._buckets(account, target)] + [now]) - now
+
+    async def acquire(self, account: Hashable = None, target: Hashable = None) -> float:
+        """ממתין לתור השליחה של (חשבון, יעד) ומחזיר כמה שניות הומתנו."""
+        buckets = self._buckets(account, target)
+        now = time.monotonic()
+        at = max([bucket.earliest(now) for bucket in buckets] + [now])
+        for bucket in buckets:
+            bucket.reserve(at)
+        wait = at - now
+        if wait > 0:
+            logger.debug(f"מגביל קצב: ממתין {wait:.2f} שניות (חשבון={account}, יעד={target})")
+            await asyncio.sleep(wait)
+        _granted_at.set(time.monotonic())
+        PROFILER.record('rate_limit', time.monotonic() - now) # ההמתנה המכוונת של בדוק_הגבלות, גם כשהיא 0
+        return wait
+
+
+class AIMDController:
+    """
+    בקר קצב AIMD: כל שליחה מוצלחת מעלה את קצב הדלי של החשבון ושל היעד בתוספת קבועה,
+    וכל FloodWait מוריד אותו בחצי (וברבע אם ההמתנה שטלגרם דרשה ארוכה מדקה).
+    כך כל חשבון מתכנס לקצב המקסימלי שהוא יכול להחזיק, בלי השהיות אקראיות קבועות.
+    כל הסקריפטים מדווחים לו על כל שליחה, ולכן הוא גם מעדכן את מדדי השליחה וה-FloodWait (metrics.py).
+    """
+
+    def __init__(self, limiter: RateLimiter, min_rate: float = 1 / 60, max_rate: float = 1.0,
+                 increase: float = 0.5 / 60, decrease: float = 0.5, long_flood_seconds: float = 60):
+        self.limiter = limiter
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.long_flood_seconds = long_flood_seconds
+
+    def on_success(self, account: Hashable = None, target: Hashable = None, messages: int = 1):
+        """שליחה הצליחה; messages - כמה הודעות היא כללה (למשל מנה של ForwardMessages)."""
+        metrics.MESSAGES_SENT.inc(messages, account=metrics.account_label(account), target=target)
+        granted_at = _granted_at.get()
+        if granted_at is not None:
+            metrics.SEND_LATENCY.observe(time.monotonic() - granted_at, account=metrics.account_label(account))
+            _granted_at.set(None)
+        for bucket in (self.limiter.account_bucket(account), self.limiter.target_bucket(target)):
+            if bucket:
+                bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+
+    def on_flood(self, account: Hashable = None, target: Hashable = None, seconds: float = 0):
+        """מוריד את הקצב וחוסם את החשבון (בלבד) למשך ההמתנה שטלגרם דרשה."""
+        metrics.FLOOD_WAITS.inc(account=metrics.account_label(account))
+        metrics.FLOOD_WAIT_SECONDS.inc(seconds, account=metrics.account_label(account))
+        factor = self.decrease if seconds <= self.long_flood_seconds else self.decrease ** 2
+        for bucket in (self.limiter.account_bucket(account), self.limiter.target_bucket(target)):
+            if bucket:
+                bucket.rate = max(self.min_rate, bucket.rate * factor)
+        account_bucket = self.limiter.account_bucket(account)
+        if account_bucket and seconds:
+            account_bucket.block_until(time.monotonic() + seconds)
+        logger.info(f"📉 FloodWait של {seconds} שניות: קצב החשבון {account} ירד ל-{self.current_rate(account, target):.1f} הודעות לדקה.")
+
+    def current_rate(self, account: Hashable = None, target: Hashable = None) -> float:
+        """הקצב האפקטיבי הנוכחי של (חשבון, יעד) בהודעות לדקה."""
+        rates = [bucket.rate for bucket in self.limiter._buckets(account, target)]
+        return min(rates) * 60 if rates else float('inf')
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from telethon import errors
+import logging
+
+import metrics
+from profiler import PROFILER
+from state_store import PeerKey, StateStore
+
+logger = logging.getLogger(__name__)
+
+# קבועים
+DEAD_LETTER_FILE = 'dead_letters.jsonl'
+
+# סוגי כישלון
+FLOOD = 'flood' # FloodWait / slow mode / חשבון לא זמין - מנסים מיד מחשבון אחר, או אחרי ההמתנה
+TRANSIENT = 'transient' # רשת, שרת, הפניה לקובץ שפגה - ניסיון חוזר עם המתנה גדלה
+PERMANENT = 'permanent' # אין הרשאה, מדיה לא נתמכת, טקסט ארוך מדי - ניסיון חוזר לא יעזור
+
+# שגיאות 400 / 403 שבכל זאת עוברות בניסיון חוזר (הפניה לקובץ מתחדשת, peer נפתר מחדש)
+_TRANSIENT_ERRORS = (
+    errors.ServerError, errors.TimedOutError, errors.FileReferenceExpiredError, errors.ChannelInvalidError,
+    errors.ChannelPrivateError, errors.PeerIdInvalidError, ConnectionError, asyncio.TimeoutError,
+)
+_PERMANENT_ERRORS = (
+    errors.BadRequestError, errors.ForbiddenError, errors.NotFoundError, ValueError, TypeError,
+)
+# בשליחה ישירה (send_with_retries) אין מי שיפתור את היעד מחדש בין הניסיונות: יעד שגוי או שנמחק
+# ייכשל בכל ניסיון, ולכן נכשלים מיד במקום לחכות את כל סדרת ההמתנות
+_PERMANENT_SEND_ERRORS = (
+    errors.ChannelInvalidError, errors.ChannelPrivateError, errors.PeerIdInvalidError,
+)
+
+
+def classify(error: Optional[BaseException]) -> str:
+    """מסווג כישלון שליחה. None (החשבון לא היה זמין ולא נשלחה בקשה) נחשב כמו FloodWait."""
+    if error is None or isinstance(error, errors.FloodError):
+        return FLOOD
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return TRANSIENT
+    if isinstance(error, _PERMANENT_ERRORS):
+        return PERMANENT
+    # שגיאה לא מוכרת: מנסים שוב, ואחרי max_attempts היא עוברת לקובץ ההודעות שנכשלו
+    return TRANSIENT
+
+
+def describe(error: Optional[BaseException]) -> str:
+    return f"{type(error).__name__}: {error}" if error is not None else 'account unavailable'
+
+
+class RetryPolicy:
+    """המתנה מעריכית עם אקראיות (equal jitter): חצי קבוע וחצי אקראי, עד cap שניות."""
+
+    def __init__(self, base: float = 5.0, cap: float = 900.0, max_attempts: int = 6, max_flood_waits: int = 20):
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+        self.max_flood_waits = max_flood_waits
+
+    def delay(self, attempt: int) -> float:
+        """כמה לחכות לפני הניסיון החוזר ה-attempt (מתחיל מ-1)."""
+        ceiling = min(self.cap, self.base * 2 ** (attempt - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+async def send_with_retries(send: Callable[[], Awaitable], policy: RetryPolicy,
+                            on_flood: Optional[Callable[[float], None]] = None, permanent: Tuple[type, ...] = ()):
+    """
+    מריץ שליחה (פונקציה שמחזירה coroutine) בלולאה לפי סוג השגיאה: FloodWait - קורא ל-on_flood,
+    ממתין ומנסה שוב (עד max_flood_waits); שגיאה זמנית - המתנה מעריכית עם אקראיות (עד max_attempts).
+    שגיאה קבועה, או שמיצתה את הניסיונות, נזרקת. permanent: סוגי שגיאות נוספים שנזרקים מיד,
+    כי הקורא מטפל בהם בעצמו (למשל הפניה שמורה לקובץ שפגה - מעלים מחדש במקום לחכות).
+    """
+    attempt = 0
+    flood_waits = 0
+    while True:
+        try:
+            return await send()
+        except Exception as e:
+            kind = PERMANENT if isinstance(e, (*_PERMANENT_SEND_ERRORS, *permanent)) else classify(e)
+            if kind == FLOOD and flood_waits < policy.max_flood_waits:
+                flood_waits += 1
+                seconds = getattr(e, 'seconds', 0)
+                if on_flood:
+                    on_flood(seconds)
+                logger.warning(f"⏰ FloodWait: ממתין {seconds + 5} שניות...")
+                with PROFILER.stage('flood_wait'):
+                    await asyncio.sleep(seconds + 5)
+            elif kind == TRANSIENT and attempt < policy.max_attempts:
+                attempt += 1
+                delay = policy.delay(attempt)
+                logger.warning(f"🔁 שגיאה זמנית ({describe(e)}), ניסיון {attempt}/{policy.max_attempts} בעוד {delay:.0f} שניות...")
+                with PROFILER.stage('retry_backoff'):
+                    await asyncio.sleep(delay)
+            else:
+                raise
+
+
+def append_dead_letter(path: str, record: Dict):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class RetryQueue:
+    """
+    תור ניסיונות חוזרים של צמד מקור/יעד, שנשמר בטבלת retries ב-state.db ושורד הפעלה מחדש.
+    כישלון זמני מתוזמן מחדש עם RetryPolicy; כישלון קבוע (או זמני שמיצה את הניסיונות) נכתב
+    לקובץ ההודעות שנכשלו (dead_letters.jsonl), שאפשר להחזיר ממנו לתור:
+        python retry_queue.py replay [source target]
+    """
+
+    def __init__(self, store: StateStore, source: PeerKey, target: PeerKey, *,
+                 policy: Optional[RetryPolicy] = None, dead_letter_path: str = DEAD_LETTER_FILE):
+        self.store = store
+        self.source = source
+        self.target = target
+        self.policy = policy or RetryPolicy()
+        self.dead_letter_path = dead_letter_path
+        # first_id -> [last_id, attempts, next_at, error]; next_at = inf בזמן שהניסיון רץ
+        self._entries: Dict[int, list] = {
+            first_id: [last_id, attempts, next_at, error]
+            for first_id, last_id, attempts, next_at, error in store.load_retries(source, target)
+        }
+        # message_id -> first_id לכל הודעה בטווח של כל רשומה, כדי ש-in לא יסרוק את כל התור
+        self._ids: Dict[int, int] = {}
+        for first_id, entry in self._entries.items():
+            self._index(first_id, entry[0])
+        if self._entries:
+            logger.info(f"🔁 נטענו {len(self._entries)} ניסיונות חוזרים ממתינים מהרצה קודמת.")
+        self._update_depth()
+
+    def _index(self, first_id: int, last_id: int):
+        for message_id in range(first_id, last_id + 1):
+            self._ids[message_id] = first_id
+
+    def _unindex(self, first_id: int, last_id: int):
+        for message_id in range(first_id, last_id + 1):
+            if self._ids.get(message_id) == first_id:
+                del self._ids[message_id]
+
+    def _update_depth(self):
+        metrics.RETRY_QUEUE_DEPTH.set(len(self._entries), target=self.target)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, message_id: int) -> bool:
+        """האם ההודעה (או אלבום שהיא חלק ממנו) ממתינה לניסיון חוזר."""
+        return message_id in self._ids
+
+    def clear(self):
+        self._entries.clear()
+        self._ids.clear()
+        self.store.delete_retry(self.source, self.target)
+        self._update_depth()
+
+    def failed(self, first_id: int, last_id: int, error: Optional[BaseException]) -> str:
+        """
+        רושם כישלון ומחזיר את הסיווג שלו. FLOOD לא נשמר (הקורא מנסה שוב מיד, מחשבון אחר);
+        TRANSIENT מתוזמן עם המתנה; PERMANENT (כולל זמני שמיצה את הניסיונות) עובר לקובץ ההודעות שנכשלו.
+        """
+        kind = classify(error)
+        entry = self._entries.get(first_id)
+        if kind == FLOOD:
+            if entry is not None:
+                entry[2] = time.time() # ניסיון חוזר שנתקע ב-FloodWait יילקח שוב מיד, מחשבון פנוי
+            return FLOOD
+
+        attempts = (entry[1] if entry else 0) + 1
+        if kind == TRANSIENT and attempts <= self.policy.max_attempts:
+            delay = self.policy.delay(attempts)
+            if entry is not None:
+                self._unindex(first_id, entry[0])
+            self._index(first_id, last_id)
+            self._entries[first_id] = [last_id, attempts, time.time() + delay, describe(error)]
+            self.store.save_retry(self.source, self.target, first_id, last_id, attempts, time.time() + delay, describe(error))
+            self._update_depth()
+            logger.warning(f"🔁 הודעה {first_id} תנסה שוב בעוד {delay:.0f} שניות (ניסיון {attempts}/{self.policy.max_attempts}): {describe(error)}")
+            return TRANSIENT
+
+        self.dead_letter(first_id, last_id, error, attempts)
+        return PERMANENT
+
+    def dead_letter(self, first_id: int, last_id: int, error: Optional[BaseException], attempts: int = 1):
+        """כותב את ההודעה לקובץ ההודעות שנכשלו ומוציא אותה מהתור."""
+        append_dead_letter(self.dead_letter_path, {
+            'source': str(self.source), 'target': str(self.target), 'first_id': first_id, 'last_id': last_id,
+            'attempts': attempts, 'kind': classify(error), 'error': describe(error), 'at': str(datetime.now()),
+        })
+        self.succeeded(first_id)
+        logger.error(f"🪦 הודעה {first_id} נכשלה סופית ({describe(error)}). נרשמה ב-{self.dead_letter_path}.")
+
+    def succeeded(self, first_id: int):
+        entry = self._entries.pop(first_id, None)
+        if entry is not None:
+            self._unindex(first_id, entry[0])
+            self.store.delete_retry(self.source, self.target, first_id)
+            self._update_depth()
+
+    def next_due(self) -> Optional[float]:
+        """בעוד כמה שניות מגיע הניסיון החוזר הבא (None אם אין ניסיון שמחכה לזמנו)."""
+        pending = [entry[2] for entry in self._entries.values() if entry[2] != math.inf]
+        return max(0.0, min(pending) - time.time()) if pending else None
+
+    def due(self) -> List[Tuple[int, int]]:
+        """הניסיונות שהגיע זמנם, לפי הסדר; הם מסומנים כרצים עד failed / succeeded."""
+        now = time.time()
+        ready = sorted(first_id for first_id, entry in self._entries.items() if entry[2] <= now)
+        for first_id in ready:
+            self._entries[first_id][2] = math.inf
+        return [(first_id, self._entries[first_id][0]) for first_id in ready]
+
+
+def replay_dead_letters(store: StateStore, path: str = DEAD_LETTER_FILE, source: Optional[str] = None,
+                        target: Optional[str] = None) -> int:
+    """מחזיר הודעות מקובץ ההודעות שנכשלו לתור הניסיונות החוזרים (אפשר לסנן לפי צמד) ומחזיר כמה."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return 0
+
+    kept = []
+    replayed = 0
+    for record in records:
+        if (source is None or record['source'] == str(source)) and (target is None or record['target'] == str(target)):
+            store.save_retry(record['source'], record['target'], record['first_id'], record['last_id'], 0, time.time(), record['error'])
+            replayed += 1
+        else:
+            kept.append(record)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in kept)
+    return replayed
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'replay':
+        print("שימוש: python retry_queue.py replay [source target]")
+        return
+    store = StateStore()
+    try:
+        source, target = (sys.argv[2], sys.argv[3]) if len(sys.argv) > 3 else (None, None)
+        count = replay_dead_letters(store, DEAD_LETTER_FILE, source, target)
+        print(f"✅ {count} הודעות הוחזרו לתור הניסיונות החוזרים. הן יישלחו בהרצה הבאה של הצמד.")
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    main()
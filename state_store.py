@@ -0,0 +1,290 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+# קבועים
+STATE_DB_FILE = 'state.db'
+
+PeerKey = Union[int, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    source          TEXT    NOT NULL,
+    target          TEXT    NOT NULL,
+    account         TEXT    NOT NULL DEFAULT '',
+    last_message_id INTEGER NOT NULL DEFAULT 0,
+    total_sent      INTEGER NOT NULL DEFAULT 0,
+    updated_at      TEXT,
+    PRIMARY KEY (source, target, account)
+);
+CREATE TABLE IF NOT EXISTS sent_sets (
+    source     TEXT NOT NULL,
+    target     TEXT NOT NULL,
+    data       BLOB NOT NULL,
+    PRIMARY KEY (source, target)
+);
+CREATE TABLE IF NOT EXISTS peers (
+    account     TEXT    NOT NULL,
+    peer_id     INTEGER NOT NULL,
+    kind        TEXT    NOT NULL,
+    access_hash INTEGER NOT NULL DEFAULT 0,
+    username    TEXT,
+    PRIMARY KEY (account, peer_id)
+);
+CREATE TABLE IF NOT EXISTS dialogs (
+    account     TEXT    NOT NULL,
+    peer_id     INTEGER NOT NULL,
+    kind        TEXT    NOT NULL,
+    title       TEXT    NOT NULL,
+    username    TEXT,
+    top_message INTEGER NOT NULL DEFAULT 0,
+    date        REAL    NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, peer_id)
+);
+CREATE TABLE IF NOT EXISTS dialog_sync (
+    account     TEXT PRIMARY KEY,
+    synced_date REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS media (
+    account        TEXT    NOT NULL,
+    source_id      INTEGER NOT NULL,
+    size           INTEGER NOT NULL,
+    kind           TEXT    NOT NULL,
+    media_id       INTEGER NOT NULL,
+    access_hash    INTEGER NOT NULL,
+    file_reference BLOB    NOT NULL,
+    PRIMARY KEY (account, source_id, size)
+);
+CREATE TABLE IF NOT EXISTS retries (
+    source     TEXT    NOT NULL,
+    target     TEXT    NOT NULL,
+    first_id   INTEGER NOT NULL,
+    last_id    INTEGER NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    next_at    REAL    NOT NULL,
+    error      TEXT,
+    PRIMARY KEY (source, target, first_id)
+);
+"""
+
+
+class StateStore:
+    """
+    מאגר מצב משותף לכל סקריפטי ההעברה, מבוסס SQLite במצב WAL.
+    כל צמד (מקור, יעד, חשבון) נשמר בשורה משלו ומתעדכן בנפרד, כך שאפשר
+    לשמור התקדמות אחרי כל הודעה בלי לכתוב מחדש קובץ שלם.
+    """
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # במצב WAL, synchronous=NORMAL לא מסכן את שלמות הקובץ ונמנע מ-fsync בכל commit
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """
+        BEGIN ... COMMIT תחת המנעול. בשגיאה (גם ב-COMMIT עצמו) מתבצע ROLLBACK, כדי שהחיבור
+        המשותף לא יישאר בתוך טרנזקציה פתוחה וה-BEGIN הבא לא ייכשל.
+        """
+        with self.lock:
+            self.conn.execute('BEGIN')
+            try:
+                yield self.conn
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def _key(source: PeerKey, target: PeerKey, account: PeerKey = '') -> tuple:
+        return str(source), str(target), str(account or '')
+
+    def load_progress(self, source: PeerKey, target: PeerKey, account: PeerKey = '') -> Dict:
+        """טוען את רשומת ההתקדמות של צמד מקור/יעד (או ערכי אפס אם אין רשומה)."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT last_message_id, total_sent, updated_at FROM progress '
+                'WHERE source = ? AND target = ? AND account = ?',
+                self._key(source, target, account)
+            ).fetchone()
+        if row is None:
+            return {'last_message_id': 0, 'total_sent': 0, 'updated_at': None}
+        return {'last_message_id': row[0], 'total_sent': row[1], 'updated_at': row[2]}
+
+    def save_progress(self, source: PeerKey, target: PeerKey, account: PeerKey = '', *,
+                      last_message_id: int, total_sent: int = 0):
+        """מעדכן (upsert) שורת התקדמות אחת בלבד."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO progress (source, target, account, last_message_id, total_sent, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (source, target, account) DO UPDATE SET '
+                'last_message_id = excluded.last_message_id, '
+                'total_sent = excluded.total_sent, '
+                'updated_at = excluded.updated_at',
+                (*self._key(source, target, account), last_message_id, total_sent, str(datetime.now()))
+            )
+
+    def reset_progress(self, source: PeerKey, target: PeerKey, account: PeerKey = ''):
+        """מוחק את ההתקדמות (כולל הודעות שסומנו כנשלחו) של צמד מקור/יעד."""
+        key = self._key(source, target, account)
+        with self.transaction():
+            self.conn.execute('DELETE FROM progress WHERE source = ? AND target = ? AND account = ?', key)
+            self.conn.execute('DELETE FROM sent_sets WHERE source = ? AND target = ?', key[:2])
+
+    def load_sent_set(self, source: PeerKey, target: PeerKey) -> Optional[bytes]:
+        """מחזיר את קבוצת ההודעות שנשלחו מהמקור ליעד בפורמט הבינארי של MessageIdSet."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data FROM sent_sets WHERE source = ? AND target = ?',
+                (str(source), str(target))
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_sent_set(self, source: PeerKey, target: PeerKey, data: bytes):
+        """שומר את קבוצת ההודעות שנשלחו (כמה קילובייטים לכל היותר, גם לערוצי ענק)."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO sent_sets (source, target, data) VALUES (?, ?, ?) '
+                'ON CONFLICT (source, target) DO UPDATE SET data = excluded.data',
+                (str(source), str(target), data)
+            )
+
+    def load_peers(self, account: PeerKey) -> List[Tuple[int, str, int, Optional[str]]]:
+        """מחזיר את כל ה-peers שנשמרו לחשבון: (peer_id, kind, access_hash, username)."""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT peer_id, kind, access_hash, username FROM peers WHERE account = ?',
+                (str(account),)
+            ).fetchall()
+
+    def save_peer(self, account: PeerKey, peer_id: int, kind: str, access_hash: int = 0,
+                  username: Optional[str] = None):
+        """שומר (upsert) peer אחד של חשבון, כולל ה-access_hash שלו."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO peers (account, peer_id, kind, access_hash, username) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (account, peer_id) DO UPDATE SET '
+                'kind = excluded.kind, access_hash = excluded.access_hash, '
+                'username = COALESCE(excluded.username, peers.username)',
+                (str(account), peer_id, kind, access_hash, username)
+            )
+
+    def delete_peer(self, account: PeerKey, peer_id: int):
+        with self.lock:
+            self.conn.execute('DELETE FROM peers WHERE account = ? AND peer_id = ?', (str(account), peer_id))
+
+    def load_dialogs(self, account: PeerKey) -> List[Tuple[int, str, str, Optional[str], int, float]]:
+        """מחזיר את אינדקס הדיאלוגים של חשבון: (peer_id, kind, title, username, top_message, date)."""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT peer_id, kind, title, username, top_message, date FROM dialogs WHERE account = ?',
+                (str(account),)
+            ).fetchall()
+
+    def save_dialogs(self, account: PeerKey, rows: List[Tuple[int, str, str, Optional[str], int, float]]):
+        """שומר (upsert) שורות של אינדקס הדיאלוגים. יש לקרוא בתוך טרנזקציה כשיש הרבה שורות."""
+        with self.lock:
+            self.conn.executemany(
+                'INSERT INTO dialogs (account, peer_id, kind, title, username, top_message, date) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (account, peer_id) DO UPDATE SET '
+                'kind = excluded.kind, title = excluded.title, username = excluded.username, '
+                'top_message = excluded.top_message, date = excluded.date',
+                [(str(account), *row) for row in rows]
+            )
+
+    def delete_dialogs(self, account: PeerKey, peer_ids: List[int]):
+        with self.lock:
+            self.conn.executemany(
+                'DELETE FROM dialogs WHERE account = ? AND peer_id = ?',
+                [(str(account), peer_id) for peer_id in peer_ids]
+            )
+
+    def load_dialog_sync(self, account: PeerKey) -> float:
+        """תאריך הדיאלוג החדש ביותר בסנכרון המלא האחרון של אינדקס הדיאלוגים (0 = לא סונכרן)."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT synced_date FROM dialog_sync WHERE account = ?', (str(account),)
+            ).fetchone()
+        return row[0] if row else 0.0
+
+    def save_dialog_sync(self, account: PeerKey, synced_date: float):
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO dialog_sync (account, synced_date) VALUES (?, ?) '
+                'ON CONFLICT (account) DO UPDATE SET synced_date = excluded.synced_date',
+                (str(account), synced_date)
+            )
+
+    def load_media(self, account: PeerKey) -> List[Tuple[int, int, str, int, int, bytes]]:
+        """מחזיר את המדיה שהועלתה מחדש ע"י החשבון: (source_id, size, kind, media_id, access_hash, file_reference)."""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT source_id, size, kind, media_id, access_hash, file_reference FROM media WHERE account = ?',
+                (str(account),)
+            ).fetchall()
+
+    def save_media(self, account: PeerKey, source_id: int, size: int, kind: str, media_id: int,
+                   access_hash: int, file_reference: bytes):
+        """שומר (upsert) את ההפניה למדיה שהועלתה עבור מסמך / תמונה של המקור."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO media (account, source_id, size, kind, media_id, access_hash, file_reference) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (account, source_id, size) DO UPDATE SET '
+                'kind = excluded.kind, media_id = excluded.media_id, '
+                'access_hash = excluded.access_hash, file_reference = excluded.file_reference',
+                (str(account), source_id, size, kind, media_id, access_hash, file_reference)
+            )
+
+    def delete_media(self, account: PeerKey, source_id: int, size: int):
+        with self.lock:
+            self.conn.execute(
+                'DELETE FROM media WHERE account = ? AND source_id = ? AND size = ?', (str(account), source_id, size)
+            )
+
+    def load_retries(self, source: PeerKey, target: PeerKey) -> List[Tuple[int, int, int, float, Optional[str]]]:
+        """מחזיר את הניסיונות החוזרים של צמד מקור/יעד: (first_id, last_id, attempts, next_at, error)."""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT first_id, last_id, attempts, next_at, error FROM retries WHERE source = ? AND target = ?',
+                self._key(source, target)[:2]
+            ).fetchall()
+
+    def save_retry(self, source: PeerKey, target: PeerKey, first_id: int, last_id: int, attempts: int,
+                   next_at: float, error: Optional[str] = None):
+        """שומר (upsert) ניסיון חוזר מתוזמן להודעה (או לאלבום first_id..last_id)."""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO retries (source, target, first_id, last_id, attempts, next_at, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (source, target, first_id) DO UPDATE SET '
+                'last_id = excluded.last_id, attempts = excluded.attempts, '
+                'next_at = excluded.next_at, error = excluded.error',
+                (*self._key(source, target)[:2], first_id, last_id, attempts, next_at, error)
+            )
+
+    def delete_retry(self, source: PeerKey, target: PeerKey, first_id: Optional[int] = None):
+        """מוחק ניסיון חוזר אחד, או את כולם של הצמד אם first_id הוא None."""
+        with self.lock:
+            if first_id is None:
+                self.conn.execute('DELETE FROM retries WHERE source = ? AND target = ?', self._key(source, target)[:2])
+            else:
+                self.conn.execute(
+                    'DELETE FROM retries WHERE source = ? AND target = ? AND first_id = ?',
+                    (*self._key(source, target)[:2], first_id)
+                )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -2,96 +2,183 @@ import asyncio
 import json
 import random
 import time
-import os
-from typing import List, Dict, Optional, Set
-from telethon import TelegramClient, errors
+from typing import List, Dict, Optional, Tuple
+from telethon import TelegramClient, errors, utils
 from telethon.sessions import StringSession
-from telethon.tl.types import InputPeerChannel, InputPeerChat, MessageMediaPhoto, MessageMediaDocument, Channel, Chat, Message
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.types import InputPeerChannel, InputPeerChat, MessageMediaPhoto, Channel, Chat, ChannelForbidden, ChatForbidden, Message
 import socks
+import weakref
 from datetime import datetime, timedelta
 import logging
 
+from account_workers import AccountWorkers
+from message_id_set import MessageIdSet
+import metrics
+from albums import group_albums
+from bulk_copy import MAX_FORWARD_IDS, chunk_messages, forward_copies
+from dialog_index import DialogIndex
+from history_prefetcher import HistoryPrefetcher
+from live_mirror import LiveFollower
+from media_filter import MediaClassifier
+from peer_cache import PeerCache
+from profiler import PROFILER
+from progress_journal import ProgressJournal
+from rate_limiter import AIMDController, RateLimiter
+from retry_queue import FLOOD, PERMANENT, RetryQueue, classify, describe
+from state_store import StateStore
+
 # הגדרת לוגים
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # קבועים
 SESSIONS_FILE = 'sessions.json'
-PROGRESS_FILE = 'progress.json'
+CHATS_PAGE_SIZE = 20
+
+async def ainput(prompt: str) -> str:
+    """input() שלא חוסם את לולאת האירועים (כדי שמשימות רקע ימשיכו לרוץ בזמן ההמתנה למשתמש)."""
+    return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+
+def can_send_messages(entity) -> bool:
+    """האם מותר לשלוח הודעות לישות, לפי הזכויות שלה כפי שהחשבון רואה אותה (בלי לשלוח הודעה)."""
+    if isinstance(entity, (ChannelForbidden, ChatForbidden)) or getattr(entity, 'left', False) or getattr(entity, 'deactivated', False):
+        return False
+    if getattr(entity, 'creator', False):
+        return True
+    admin_rights = getattr(entity, 'admin_rights', None)
+    if getattr(entity, 'broadcast', False):
+        # בערוץ שידור רק מנהל עם הרשאת פרסום יכול לשלוח
+        return bool(admin_rights and admin_rights.post_messages)
+    if admin_rights:
+        return True
+    # בקבוצה: חסימה אישית של החשבון או חסימת ברירת המחדל של כל החברים
+    return not any(rights and rights.send_messages
+                   for rights in (getattr(entity, 'banned_rights', None), getattr(entity, 'default_banned_rights', None)))
 
 class TelegramSender:
-    def __init__(self):
-        self.clients: List[TelegramClient] = []
-        self.sent_message_ids: Set[int] = set()
+    def __init__(self, pool: Optional['TelegramSender'] = None):
+        """
+        pool: שולח קיים שהחשבונות שלו כבר מחוברים. השולח החדש (משימה נוספת של job_scheduler.py)
+        חולק איתו את החשבונות, מאגר המצב, היומן, מטמון ה-peers, זמני ה-FloodWait ומגביל הקצב,
+        ושומר לעצמו רק את המצב של צמד המקור/יעד שלו.
+        """
+        self.pool = pool
+        self._clients: List[TelegramClient] = [] # בלי pool: החשבונות של השולח הזה
+        self.account_shift: int = 0 # מאיזה חשבון מתחילה רשימת החשבונות (כל משימה מחשבון אחר)
+        # {(account_id, target_peer_id): bool} - תוצאת בדיקת השליחה, משותפת לכל המשימות
+        self.send_permissions: Dict[Tuple[int, int], bool] = pool.send_permissions if pool else {}
+        # שולחים של משימות שחולקים את המאגר; חשבון שהתחבר מאוחר מצטרף גם לעובדים שלהם
+        self._pooled: weakref.WeakSet = weakref.WeakSet()
+        if pool:
+            pool._pooled.add(self)
+        self._login_tasks: List[asyncio.Task] = [] # התחברויות שעדיין רצות ברקע (חשבונות ב-FloodWait)
+        self.sent_message_ids: MessageIdSet = MessageIdSet()
         self.last_processed_message_id: int = 0
-        self.consecutive_successes: int = 0
-        self.client_flood_wait_until: Dict[int, datetime] = {} # {auth_key_id: datetime_until}
+        self.total_sent: int = 0
+        self.state_store = pool.state_store if pool else StateStore()
+        self.journal = pool.journal if pool else ProgressJournal(self.state_store)
+        self.peer_cache = pool.peer_cache if pool else PeerCache(self.state_store)
+        self.dialog_indexes: Dict[int, DialogIndex] = pool.dialog_indexes if pool else {} # {account_id: DialogIndex}
+        self.progress_key: Optional[tuple] = None # (source_id, target_id) של הצמד הנוכחי
+        self.client_flood_wait_until: Dict[int, datetime] = pool.client_flood_wait_until if pool else {} # {auth_key_id: datetime_until}
         self.target_channel_id: Optional[int] = None # יאחסן את ה-ID של ערוץ היעד
+        self.target_peer_id: Optional[int] = None # ה-ID המסומן (-100...) של היעד, מפתח מטמון ה-peers
+        self.source_peer_id: Optional[int] = None # ה-ID המסומן של ערוץ המקור (להעתקה בכמות)
+        self.bulk_copy: bool = False # העתקה ב-ForwardMessages עם drop_author, עד 100 הודעות לבקשה
+        self.follow: bool = False # אחרי סוף ההיסטוריה, ממשיך להעביר הודעות חדשות מעדכונים
+        self.media_limits: Dict = {} # min_size / max_size (בתים), min_duration / max_duration (שניות)
+        self.media_filter: Optional[MediaClassifier] = None
+        self._bulk_account_index = 0
+        self.max_sends_per_account = 2 # שליחות בו-זמנית לכל חשבון
+        # {auth_key_id: Semaphore} - משותף בין המשימות, כך שהמגבלה חלה על החשבון
+        self.account_slots: Dict[int, asyncio.Semaphore] = pool.account_slots if pool else {}
+        self.workers: Optional[AccountWorkers] = None # עובד קבוע לכל חשבון, בזמן send_messages_round
+        self.retry_queue: Optional[RetryQueue] = None # ניסיונות חוזרים של הצמד הנוכחי (נשמרים ב-state.db)
         self.target_channel_is_forum: bool = False # יאחסן אם ערוץ היעד הוא פורום
 
-        self.השהיה_בין_הודעות = 2
         self.מקס_הודעות_לדקה = 20
-        self.מונה_הודעות_בדקה = 0
-        self.זמן_תחילת_דקה = datetime.now()
+        if pool:
+            self.rate_limiter = pool.rate_limiter
+            self.rate_controller = pool.rate_controller
+        else:
+            self.rate_limiter = RateLimiter(target_rate=self.מקס_הודעות_לדקה / 60, account_rate=self.מקס_הודעות_לדקה / 60)
+            self.rate_controller = AIMDController(self.rate_limiter)
+
+    def _pool_clients(self) -> List[TelegramClient]:
+        """כל החשבונות המחוברים (במשימה - של המאגר, כפי שהם עכשיו), מסובבים לפי account_shift."""
+        clients = self.pool.clients if self.pool else self._clients
+        if clients and self.account_shift:
+            shift = self.account_shift % len(clients)
+            clients = clients[shift:] + clients[:shift]
+        return clients
 
-    def load_progress(self) -> Dict:
-        """טעינת נתוני התקדמות מקובץ"""
-        if os.path.exists(PROGRESS_FILE):
-            try:
-                with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                    progress = json.load(f)
-                self.sent_message_ids = set(progress.get('sent_message_ids', []))
-                self.last_processed_message_id = progress.get('last_message_id', 0)
-                logger.info(f"✅ נטענה התקדמות קודמת: {len(self.sent_message_ids)} הודעות סומנו כנשלחו, מזהה ההודעה האחרונה שעיבדנו הוא {self.last_processed_message_id}")
-                return progress
-            except Exception as e:
-                logger.error(f"שגיאה בטעינת התקדמות: {e}. מאפס התקדמות.")
-        self.sent_message_ids = set()
-        self.last_processed_message_id = 0
-        return {'sent_message_ids': [], 'last_message_id': 0}
+    @property
+    def clients(self) -> List[TelegramClient]:
+        """
+        החשבונות הפעילים. במשימה הרשימה נקראת מהמאגר בכל פעם, כך שחשבון שהתחבר מאוחר נראה מיד.
+        אחרי שנבחר יעד - רק חשבונות שעברו את בדיקת השליחה אליו.
+        """
+        clients = self._pool_clients()
+        if self.target_peer_id is None:
+            return clients
+        return [client for client in clients if self.send_permissions.get((client._account_id, self.target_peer_id))]
+
+    @clients.setter
+    def clients(self, clients: List[TelegramClient]):
+        self._clients = clients
+
+    def load_progress(self, source_id: int, target_id: int) -> Optional[Dict]:
+        """טעינת נתוני התקדמות של צמד מקור/יעד ממאגר המצב ומיומן ההתקדמות"""
+        self.progress_key = (source_id, target_id)
+        try:
+            progress = self.state_store.load_progress(source_id, target_id)
+            self.sent_message_ids = self.journal.sent_set(source_id, target_id)
+            self.last_processed_message_id = progress['last_message_id']
+            self.total_sent = progress['total_sent']
+            logger.info(f"✅ נטענה התקדמות קודמת: {len(self.sent_message_ids)} הודעות סומנו כנשלחו, מזהה ההודעה האחרונה שעיבדנו הוא {self.last_processed_message_id}")
+            return progress
+        except Exception as e:
+            # לא מאפסים בשקט - איפוס היה שולח מחדש את כל הערוץ
+            logger.critical(f"❌ שגיאה בטעינת התקדמות: {e}. עוצר כדי לא לשלוח מחדש הודעות שכבר נשלחו.", exc_info=True)
+            return None
 
     def save_progress(self):
-        """שמירת נתוני התקדמות לקובץ"""
+        """שמירת שורת ההתקדמות של צמד מקור/יעד הנוכחי בלבד"""
+        if self.progress_key is None:
+            return
         try:
-            # גיזום sent_message_ids אם גדול מדי, ללא מיון לא יעיל
-            if len(self.sent_message_ids) > 100000: # שומר רק 100,000 הודעות אחרונות ב-set
-                temp_list = list(self.sent_message_ids)
-                random.shuffle(temp_list) # ערבוב כדי לקבל דגימה אקראית
-                self.sent_message_ids = set(temp_list[:100000])
-            
-            progress_data = {
-                'sent_message_ids': list(self.sent_message_ids),
-                'last_message_id': self.last_processed_message_id
-            }
-            with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(progress_data, f, ensure_ascii=False, indent=2)
+            self.state_store.save_progress(
+                *self.progress_key,
+                last_message_id=self.last_processed_message_id,
+                total_sent=self.total_sent
+            )
         except Exception as e:
             logger.error(f"❌ שגיאה בשמירת התקדמות: {e}")
 
-    async def בדוק_הגבלות(self):
-        """בודק ומנהל את הגבלות קצב השליחה כדי למנוע חסימה."""
-        זמן_שעבר = datetime.now() - self.זמן_תחילת_דקה
-
-        if זמן_שעבר.total_seconds() >= 60:
-            self.מונה_הודעות_בדקה = 0
-            self.זמן_תחילת_דקה = datetime.now()
-
-        if self.מונה_הודעות_בדקה >= self.מקס_הודעות_לדקה:
-            המתנה = 60 - זמן_שעבר.total_seconds()
-            if המתנה > 0:
-                logger.warning(f"הגעת להגבלת הקצב. ממתין {int(המתנה)} שניות...")
-                await asyncio.sleep(המתנה)
-            self.מונה_הודעות_בדקה = 0
-            self.זמן_תחילת_דקה = datetime.now()
-
-    def smart_delay(self) -> float:
-        """השהיה דינמית בהתאם להצלחות רצופות."""
-        # מנגנון השהיה אגרסיבי יותר אם יש הצלחות רצופות רבות
-        if self.consecutive_successes > 20: # 20 הצלחות רצופות
-            return random.uniform(0.5, 3) # קיצור השהיה
-        elif self.consecutive_successes < 5: # פחות מ-5 הצלחות רצופות (או כישלונות)
-            return random.uniform(5, 15) # הארכת השהיה
-        return random.uniform(2, 8) # השהיה רגילה
+    def mark_message_sent(self, message_id: int, last_message_id: Optional[int] = None):
+        """מסמן הודעה (או טווח הודעות) כנשלחה - רשומה קטנה אחת שנוספת ליומן ההתקדמות."""
+        try:
+            self.journal.commit(*self.progress_key, message_id, last_message_id)
+        except Exception as e:
+            logger.error(f"❌ שגיאה בסימון הודעה {message_id} כנשלחה: {e}")
+
+    def mark_group_sent(self, group: List[Message]):
+        """
+        מסמן הודעה או אלבום כנשלחו: רשומה אחת לכל רצף של מזהים, כך שמזהים שבין פריטי האלבום
+        (הודעות שלא התאימו לסינון) לא נרשמים כנשלחו. אלבום רציף הוא רשומה אחת ביומן.
+        """
+        start = previous = group[0].id
+        for message in group[1:]:
+            if message.id != previous + 1:
+                self.mark_message_sent(start, previous)
+                start = message.id
+            previous = message.id
+        self.mark_message_sent(start, previous)
+
+    async def בדוק_הגבלות(self, client: TelegramClient, target_entity_id: int):
+        """ממתין לתור שליחה במגביל הקצב ההיררכי (יעד / חשבון). המקום בתור נשמר מיד, ולכן אין מרוץ תחת asyncio.gather."""
+        await self.rate_limiter.acquire(account=client.session.auth_key.key_id, target=target_entity_id)
 
     async def handle_flood_wait_for_client(self, client: TelegramClient, e: errors.FloodWaitError):
         """מעדכן את זמני ההמתנה עבור חשבון ספציפי במקרה של FloodWait."""
@@ -99,11 +186,153 @@ class TelegramSender:
         wait_time = e.seconds + random.uniform(2, 7) # מוסיף אקראיות להמתנה
         # שומר את זמן ההמתנה הספציפי עבור ה-auth_key של הלקוח
         self.client_flood_wait_until[client.session.auth_key.key_id] = datetime.now() + timedelta(seconds=wait_time)
+        self.rate_controller.on_flood(client.session.auth_key.key_id, self.target_channel_id, wait_time)
         logger.warning(f"⏰ FloodWait עבור חשבון [{client_name}]. ימתין {wait_time:.1f} שניות. חשבון זה לא ישלח הודעות עד אז.")
 
 
-    async def load_clients(self, sessions_file: str) -> List[TelegramClient]:
-        """טעינת חשבונות מקובץ sessions.json וחיבור לטלגרם."""
+    async def resolve_peer(self, client: TelegramClient, peer):
+        """InputPeer של peer עבור חשבון מסוים, מתוך מטמון ה-peers (פנייה לשרת רק בפעם הראשונה)."""
+        return await self.peer_cache.resolve(client, client._account_id, peer)
+
+    def dialog_index(self, client: TelegramClient) -> DialogIndex:
+        """אינדקס הדיאלוגים של החשבון (נטען מ-state.db בפעם הראשונה)."""
+        if client._account_id not in self.dialog_indexes:
+            self.dialog_indexes[client._account_id] = DialogIndex(self.state_store, self.peer_cache, client._account_id)
+        return self.dialog_indexes[client._account_id]
+
+    async def detect_slow_mode(self, client: TelegramClient, target_entity):
+        """בודק אם לקבוצת היעד מוגדר slow mode ומעדכן את מגביל הקצב בהתאם."""
+        if not getattr(target_entity, 'megagroup', False):
+            return
+        try:
+            full = await client(GetFullChannelRequest(target_entity))
+            slow_mode_seconds = getattr(full.full_chat, 'slowmode_seconds', None)
+            if slow_mode_seconds:
+                self.rate_limiter.set_slow_mode(self.target_channel_id, slow_mode_seconds)
+                logger.info(f"🐢 בקבוצת היעד מוגדר slow mode של {slow_mode_seconds} שניות. כל חשבון ישלח לכל היותר הודעה אחת בפרק זמן זה.")
+        except Exception as e:
+            logger.warning(f"⚠️ לא ניתן לבדוק slow mode בקבוצת היעד: {e}")
+
+    async def _login_account(self, i: int, sess: Dict) -> Optional[TelegramClient]:
+        """התחברות לחשבון בודד. FloodWait מועבר הלאה כדי שההמתנה לא תחסום חשבונות אחרים."""
+        phone = sess.get('phone', f'חשבון #{i+1} (טלפון לא ידוע)')
+        api_id = sess.get('api_id')
+        api_hash = sess.get('api_hash')
+        session_string = sess.get('session_string')
+        use_tor = sess.get('use_tor', False)
+
+        if not all([api_id, api_hash, session_string]):
+            logger.error(f"❌ חסרים נתונים (api_id, api_hash, או session_string) בחשבון {phone}. מדלג.")
+            return None
+
+        proxy = (socks.SOCKS5, '127.0.0.1', 9050) if use_tor else None
+
+        session = StringSession(session_string)
+
+        client = PROFILER.instrument(TelegramClient(
+            session,
+            api_id,
+            api_hash,
+            proxy=proxy,
+            connection_retries=5,
+            retry_delay=5,
+            timeout=30
+        ))
+
+        try:
+            logger.info(f"🔄 מתחבר לחשבון {phone}...")
+            await client.connect()
+
+            if not await client.is_user_authorized():
+                logger.warning(f"❌ חשבון {phone} לא מאושר. ייתכן שפג תוקף הסשן או שיש צורך באימות נוסף.")
+                await client.disconnect()
+                return None
+
+            me = await client.get_me()
+            logger.info(f"✅ חשבון {me.first_name} ({phone}) נטען בהצלחה.")
+            client._account_info = f"{me.first_name} ({phone})" # שמירת מידע לוגים על הלקוח
+            client._account_id = me.id # מפתח מטמון ה-peers (access_hash שונה לכל חשבון)
+            metrics.name_account(client.session.auth_key.key_id, phone) # תווית account במדדים
+            return client
+        except BaseException:
+            # כולל ביטול ע"י timeout - לא משאירים חיבור פתוח מאחור
+            await client.disconnect()
+            raise
+
+    async def _login_with_retry(self, i: int, sess: Dict, semaphore: asyncio.Semaphore,
+                                login_timeout: float, on_deferred) -> Optional[TelegramClient]:
+        """
+        מתחבר לחשבון תחת מגבלת המקביליות וה-timeout. חשבון שקיבל FloodWait משחרר את מקומו,
+        מודיע שהוא נדחה (on_deferred) וממשיך לנסות ברקע אחרי ההמתנה.
+        """
+        phone = sess.get('phone', f'חשבון #{i+1} (טלפון לא ידוע)')
+        while True:
+            try:
+                async with semaphore:
+                    return await asyncio.wait_for(self._login_account(i, sess), login_timeout)
+            except errors.FloodWaitError as e:
+                logger.warning(f"⏰ חשבון {phone}: FloodWait בזמן התחברות. ממשיכים בלעדיו, ינסה שוב בעוד {e.seconds} שניות ברקע.")
+                on_deferred()
+                await asyncio.sleep(e.seconds)
+            except asyncio.TimeoutError:
+                logger.error(f"❌ חשבון {phone}: ההתחברות לא הסתיימה תוך {login_timeout} שניות. מדלג.")
+                return None
+            except errors.AuthKeyUnregisteredError:
+                logger.error(f"❌ חשבון {phone}: שגיאת מפתח אימות לא רשום. יש ליצור session_string חדש.")
+                return None
+            except Exception as e:
+                logger.error(f"❌ שגיאה בטעינת חשבון {phone}: {e}")
+                return None
+
+    async def _add_late_client(self, client: TelegramClient):
+        """מצרף למאגר חשבון שהתחבר אחרי ש-load_clients חזר (למשל אחרי FloodWait)."""
+        client_name = getattr(client, '_account_info', 'לא ידוע')
+        # אם היעד כבר נבחר, החשבון עובר את בדיקת השליחה לפני שהוא מצטרף; אחרת run יבדוק אותו
+        if self.target_channel_id is not None and not await self.check_send_permission(client):
+            await client.disconnect()
+            return
+        self._clients.append(client)
+        if self.workers:
+            self.workers.add(client)
+        logger.info(f"➕ חשבון [{client_name}] הצטרף למאגר החשבונות ({len(self.clients)} פעילים).")
+        # משימות שכבר רצות על המאגר: החשבון נבדק מול היעד של כל אחת ומצטרף לעובדים שלה
+        for sender in list(self._pooled):
+            if sender.target_peer_id is not None and await sender.check_send_permission(client) and sender.workers:
+                sender.workers.add(client)
+
+    async def check_send_permission(self, client: TelegramClient) -> bool:
+        """
+        בודק לפי הזכויות של החשבון ביעד (בלי לשלוח הודעת בדיקה) האם הוא יכול לשלוח אליו.
+        התוצאה נשמרת לכל צמד חשבון/יעד ומשותפת לכל המשימות, כך שכל חשבון נבדק מול יעד פעם אחת.
+        """
+        key = (client._account_id, self.target_peer_id)
+        if key in self.send_permissions:
+            return self.send_permissions[key]
+        client_name = getattr(client, '_account_info', 'לא ידוע')
+        try:
+            input_target = await self.resolve_peer(client, self.target_peer_id)
+            allowed = can_send_messages(await client.get_entity(input_target))
+        except (errors.ChannelInvalidError, errors.ChannelPrivateError, errors.ChatAdminRequiredError) as e:
+            logger.critical(f"❌ חשבון [{client_name}] נכשל בבדיקת השליחה לערוץ היעד (ID: {self.target_channel_id}). שגיאה: {e}. יש לבדוק הרשאות או סוג ערוץ/קבוצה.")
+            allowed = False
+        except Exception as e:
+            # שגיאה זמנית לא נשמרת - החשבון ייבדק שוב במשימה הבאה
+            logger.critical(f"❌ חשבון [{client_name}] נכשל בבדיקת השליחה לערוץ היעד (ID: {self.target_channel_id}) עם שגיאה לא צפויה: {e}", exc_info=True)
+            return False
+        self.send_permissions[key] = allowed
+        if allowed:
+            logger.info(f"✅ חשבון [{client_name}] עבר את בדיקת השליחה לערוץ היעד.")
+        else:
+            logger.critical(f"❌ לחשבון [{client_name}] אין הרשאה לשלוח לערוץ היעד (ID: {self.target_channel_id}).")
+        return allowed
+
+    async def load_clients(self, sessions_file: str, max_concurrent: int = 5,
+                           login_timeout: float = 60) -> List[TelegramClient]:
+        """
+        טעינת חשבונות מקובץ sessions.json וחיבור לטלגרם במקביל (עד max_concurrent בבת אחת).
+        חוזר ברגע שכל חשבון התחבר, נכשל או נדחה ב-FloodWait; חשבונות שנדחו ממשיכים
+        להתחבר ברקע ומצטרפים ל-self.clients כשהם מוכנים.
+        """
         try:
             with open(sessions_file, 'r', encoding='utf-8') as f:
                 sessions = json.load(f)
@@ -114,55 +343,54 @@ class TelegramSender:
             logger.error(f"❌ שגיאה בקריאת קובץ {sessions_file}. וודא שמבנה ה-JSON תקין.")
             return []
 
-        clients = []
-        for i, sess in enumerate(sessions):
-            phone = sess.get('phone', f'חשבון #{i+1} (טלפון לא ידוע)')
-            try:
-                api_id = sess.get('api_id')
-                api_hash = sess.get('api_hash')
-                session_string = sess.get('session_string')
-                use_tor = sess.get('use_tor', False)
-
-                if not all([api_id, api_hash, session_string]):
-                    logger.error(f"❌ חסרים נתונים (api_id, api_hash, או session_string) בחשבון {phone}. מדלג.")
-                    continue
-
-                proxy = (socks.SOCKS5, '127.0.0.1', 9050) if use_tor else None
-
-                session = StringSession(session_string)
-
-                client = TelegramClient(
-                    session,
-                    api_id,
-                    api_hash,
-                    proxy=proxy,
-                    connection_retries=5,
-                    retry_delay=5,
-                    timeout=30
-                )
-
-                logger.info(f"🔄 מתחבר לחשבון {phone}...")
-                await client.connect()
-
-                if not await client.is_user_authorized():
-                    logger.warning(f"❌ חשבון {phone} לא מאושר. ייתכן שפג תוקף הסשן או שיש צורך באימות נוסף.")
-                    await client.disconnect()
-                    continue
-
-                me = await client.get_me()
-                logger.info(f"✅ חשבון {me.first_name} ({phone}) נטען בהצלחה.")
-                client._account_info = f"{me.first_name} ({phone})" # שמירת מידע לוגים על הלקוח
-                clients.append(client)
-
-            except errors.AuthKeyUnregisteredError:
-                logger.error(f"❌ חשבון {phone}: שגיאת מפתח אימות לא רשום. יש ליצור session_string חדש.")
-            except errors.FloodWaitError as e:
-                logger.warning(f"⏰ חשבון {phone}: FloodWait בזמן התחברות. ממתין {e.seconds} שניות.")
-                await asyncio.sleep(e.seconds)
-            except Exception as e:
-                logger.error(f"❌ שגיאה בטעינת חשבון {phone}: {e}")
-
-        return clients
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(max_concurrent)
+        self.clients = [] # חשבונות שמתחברים מאוחר יותר מצטרפים לאותה רשימה
+        pending = len(sessions) # חשבונות שעוד לא התחברו, נכשלו או נדחו
+        deferred = 0
+        settled = asyncio.Event()
+        client_ready = asyncio.Event()
+
+        async def login(i: int, sess: Dict):
+            nonlocal pending, deferred
+            is_deferred = False
+
+            def on_deferred():
+                nonlocal pending, deferred, is_deferred
+                if not is_deferred:
+                    is_deferred = True
+                    deferred += 1
+                    pending -= 1
+                    if pending == 0:
+                        settled.set()
+
+            client = await self._login_with_retry(i, sess, semaphore, login_timeout, on_deferred)
+            if is_deferred:
+                deferred -= 1
+                if client is not None:
+                    await self._add_late_client(client)
+            else:
+                if client is not None:
+                    self._clients.append(client)
+                pending -= 1
+                if pending == 0:
+                    settled.set()
+            if client is not None:
+                client_ready.set()
+            elif deferred == 0 and pending == 0:
+                client_ready.set() # אין יותר למי לחכות
+
+        self._login_tasks = [asyncio.create_task(login(i, sess)) for i, sess in enumerate(sessions)]
+        if sessions:
+            await settled.wait()
+
+        if not self.clients and deferred:
+            # כל החשבונות הזמינים ב-FloodWait - ממתינים לראשון שיתפנה
+            logger.info(f"⏳ אין חשבון מוכן. ממתין ש-{deferred} חשבונות יסיימו FloodWait...")
+            await client_ready.wait()
+
+        logger.info(f"✅ {len(self.clients)} חשבונות מוכנים תוך {time.monotonic() - started:.1f} שניות" + (f", {deferred} נוספים יצטרפו ברקע." if deferred else "."))
+        return self.clients
 
     async def _choose_chat_entity(self, client: TelegramClient, prompt_type: str):
         """פונקציית עזר לבחירת ערוץ/קבוצה (מקור או יעד)."""
@@ -173,23 +401,14 @@ class TelegramSender:
         while True:
             print(f"\nאפשרויות לבחירת ערוץ {prompt_type}:")
             print("1. הזן מזהה/שם ערוץ ידנית")
-            print("2. הצג רשימת ערוצים זמינים (עד 20 ראשונים)")
+            print("2. הצג רשימת ערוצים זמינים (עם דפדוף וחיפוש)")
 
             choice = input("בחר אפשרות (1/2): ").strip()
 
             if choice == "2":
-                available_chats = await self.list_available_chats(client)
-                if available_chats:
-                    try:
-                        selection = int(input(f"\nבחר מספר ערוץ מהרשימה (1-{len(available_chats)}): ")) - 1
-                        if 0 <= selection < len(available_chats):
-                            selected_chat = available_chats[selection]
-                            logger.info(f"✅ נבחר: {selected_chat['title']}")
-                            return selected_chat['entity']
-                        else:
-                            logger.error("❌ מספר לא תקין")
-                    except ValueError:
-                        logger.error("❌ נא הזן מספר תקין")
+                entity = await self.list_available_chats(client)
+                if entity:
+                    return entity
                 continue
 
             elif choice == "1" or choice == "":
@@ -198,7 +417,9 @@ class TelegramSender:
                     continue
 
                 try:
-                    entity = await client.get_entity(entity_input)
+                    # אם הערוץ כבר נפתר בהרצה קודמת, ה-access_hash במטמון חוסך את כל הניסיונות
+                    cached_peer = self.peer_cache.lookup(client._account_id, entity_input)
+                    entity = await client.get_entity(cached_peer or entity_input)
                     logger.info(f"DEBUG: Chosen entity for {prompt_type}: Title='{entity.title}', ID={entity.id}, Type={type(entity).__name__}, IsChannel={getattr(entity, 'broadcast', False)}, IsMegaGroup={getattr(entity, 'megagroup', False)}, IsForum={getattr(entity, 'forum', False)}, LinkedChatID={getattr(entity, 'linked_chat_id', None)}")
                     logger.info(f"✅ ערוץ {prompt_type} נמצא: {entity.title}")
                     return entity
@@ -244,18 +465,14 @@ class TelegramSender:
                             logger.warning(f"   ❌ לא עבד: {e}")
                             continue
 
-                    logger.info(f"🔍 מחפש בדיאלוגים הקיימים עבור ערוץ {prompt_type}...")
+                    logger.info(f"🔍 מחפש ברשימת הערוצים של החשבון עבור ערוץ {prompt_type}...")
                     try:
-                        dialogs = await client.get_dialogs()
-                        for dialog in dialogs:
-                            if entity_input.lower() in dialog.title.lower() or \
-                               (hasattr(dialog.entity, 'username') and dialog.entity.username and entity_input.replace('@', '').lower() == dialog.entity.username.lower()):
-                                logger.info(f"✅ נמצא ערוץ לפי שם/שם משתמש: {dialog.title}")
-                                return dialog.entity
-                            dialog_id_str = str(dialog.entity.id)
-                            if entity_input in [dialog_id_str, f"-{dialog_id_str}", f"-100{dialog_id_str}"]:
-                                logger.info(f"✅ נמצא ערוץ לפי מזהה: {dialog.title}")
-                                return dialog.entity
+                        index = self.dialog_index(client)
+                        await index.refresh(client) # ריענון מצטבר - רק דיאלוגים שהשתנו מאז הפעם הקודמת
+                        match = index.by_id(entity_input) or next(iter(index.search(entity_input, limit=1)), None)
+                        if match:
+                            logger.info(f"✅ נמצא ערוץ לפי שם/שם משתמש/מזהה: {match['title']}")
+                            return await index.entity(client, match)
                         logger.error(f"❌ לא נמצא ערוץ {prompt_type} מתאים בדיאלוגים")
                     except Exception as e:
                         logger.error(f"❌ שגיאה בחיפוש בדיאלוגים עבור ערוץ {prompt_type}: {e}")
@@ -271,48 +488,67 @@ class TelegramSender:
 
     async def choose_source_channel(self, client: TelegramClient):
         """בחירת ערוץ מקור ממנו ההודעות יועברו (משתמש בפונקציית עזר)."""
-        return await self._choose_chat_entity(client, "מקור")
+        entity = await self._choose_chat_entity(client, "מקור")
+        if entity:
+            self.peer_cache.remember(client._account_id, entity)
+        return entity
 
     async def choose_target_channel(self, client: TelegramClient):
         """בחירת ערוץ יעד אליו ההודעות יועברו (משתמש בפונקציית עזר)."""
-        return await self._choose_chat_entity(client, "יעד")
+        entity = await self._choose_chat_entity(client, "יעד")
+        if entity:
+            self.peer_cache.remember(client._account_id, entity)
+        return entity
 
     async def list_available_chats(self, client: TelegramClient):
-        """הצגת רשימת ערוצים וקבוצות זמינים לחשבון הנוכחי."""
-        logger.info("\n📋 ערוצים וקבוצות זמינים (עד 20 ראשונים):")
-        try:
-            dialogs = await client.get_dialogs()
-            channels_and_groups = []
-
-            for dialog in dialogs:
-                if hasattr(dialog.entity, 'broadcast') or hasattr(dialog.entity, 'megagroup'):
-                    entity_type = "ערוץ" if getattr(dialog.entity, 'broadcast', False) else "קבוצה"
-                    username = getattr(dialog.entity, 'username', None)
-                    username_str = f"@{username}" if username else "אין שם משתמש"
-
-                    entity_id = dialog.entity.id
-                    display_id = f"-100{entity_id}" if entity_type == "ערוץ" or getattr(dialog.entity, 'megagroup', False) else str(entity_id)
-
-                    channels_and_groups.append({
-                        'title': dialog.title,
-                        'id': entity_id,
-                        'display_id': display_id,
-                        'username': username_str,
-                        'type': entity_type,
-                        'entity': dialog.entity
-                    })
-
-            if channels_and_groups:
-                for i, chat in enumerate(channels_and_groups[:20], 1):
-                    print(f"{i}. {chat['title']} ({chat['type']}) - {chat['username']} - ID: {chat['display_id']}")
-                return channels_and_groups
+        """
+        הצגת ערוצים וקבוצות זמינים לחשבון, 20 בכל עמוד, מתוך אינדקס הדיאלוגים המקומי.
+        הרשימה מוצגת מיד, והאינדקס מתרענן ברקע. מחזיר את הישות שנבחרה או None.
+        """
+        index = self.dialog_index(client)
+        index.refresh_in_background(client)
+        if len(index) < CHATS_PAGE_SIZE:
+            await index.wait_for_entries(CHATS_PAGE_SIZE) # הרצה ראשונה: ממתינים לעמוד הראשון בלבד
+
+        page = 0
+        query = ''
+        while True:
+            chats = index.search(query, limit=CHATS_PAGE_SIZE) if query else index.page(page, CHATS_PAGE_SIZE)
+            if not chats:
+                logger.warning("❌ לא נמצאו ערוצים או קבוצות" + (f" עבור '{query}'" if query else ""))
             else:
-                logger.warning("❌ לא נמצאו ערוצים או קבוצות")
-                return []
-
-        except Exception as e:
-            logger.error(f"❌ שגיאה בקבלת רשימת ערוצים: {e}")
-            return []
+                title = f"תוצאות חיפוש עבור '{query}'" if query else f"עמוד {page + 1}"
+                logger.info(f"\n📋 ערוצים וקבוצות זמינים ({title}{', הרשימה מתעדכנת ברקע' if index.refreshing else ''}):")
+                for i, chat in enumerate(chats, 1):
+                    username_str = f"@{chat['username']}" if chat['username'] else "אין שם משתמש"
+                    print(f"{i}. {chat['title']} ({chat['type']}) - {username_str} - ID: {chat['display_id']}")
+
+            answer = (await ainput("\nמספר לבחירה, n=עמוד הבא, p=עמוד קודם, טקסט=חיפוש, r=ריענון מלא, Enter=חזרה: ")).strip()
+            if not answer:
+                return None
+            if answer.isdigit():
+                selection = int(answer) - 1
+                if 0 <= selection < len(chats):
+                    logger.info(f"✅ נבחר: {chats[selection]['title']}")
+                    try:
+                        return await index.entity(client, chats[selection])
+                    except Exception as e:
+                        logger.error(f"❌ שגיאה בטעינת הערוץ שנבחר: {e}")
+                else:
+                    logger.error("❌ מספר לא תקין")
+            elif answer.lower() == 'n':
+                query = ''
+                if (page + 1) * CHATS_PAGE_SIZE < len(index) or index.refreshing:
+                    page += 1
+                    await index.wait_for_entries((page + 1) * CHATS_PAGE_SIZE)
+            elif answer.lower() == 'p':
+                query = ''
+                page = max(0, page - 1)
+            elif answer.lower() == 'r':
+                logger.info("🔄 מרענן את רשימת הערוצים במלואה...")
+                await index.refresh_in_background(client, full=True)
+            else:
+                query = answer
 
     def choose_file_types(self) -> List[str]:
         """בחירת סוגי קבצים/תוכן לשליחה."""
@@ -356,6 +592,28 @@ class TelegramSender:
                 logger.error("❌ אפשרות לא תקינה, נסה שוב.")
                 continue
 
+    def choose_media_limits(self) -> Dict:
+        """מגבלות גודל (MB) ומשך (שניות) אופציונליות, לפי המאפיינים של הקבצים - בלי להוריד אותם."""
+        print("\nמגבלות גודל ומשך (Enter לדילוג על כל שאלה):")
+        limits = {}
+        questions = [
+            ('min_size', "גודל מינימלי ב-MB: ", 1024 * 1024),
+            ('max_size', "גודל מקסימלי ב-MB: ", 1024 * 1024),
+            ('min_duration', "משך מינימלי בשניות (וידאו / אודיו): ", 1),
+            ('max_duration', "משך מקסימלי בשניות (וידאו / אודיו): ", 1),
+        ]
+        for key, prompt, unit in questions:
+            while True:
+                answer = input(prompt).strip()
+                if not answer:
+                    break
+                try:
+                    limits[key] = float(answer) * unit
+                    break
+                except ValueError:
+                    logger.error("❌ יש להזין מספר, נסה שוב.")
+        return limits
+
     def choose_reset_progress(self) -> bool:
         """בחירה האם לאפס התקדמות או להמשיך."""
         print("\nאפשרויות העברת הודעות:")
@@ -374,10 +632,60 @@ class TelegramSender:
             else:
                 logger.error("❌ אפשרות לא תקינה, נסה שוב.")
 
+    def choose_bulk_copy(self) -> bool:
+        """בחירה האם להעתיק בכמות (עד 100 הודעות בבקשה אחת) או הודעה אחר הודעה."""
+        print("\nמצב העתקה:")
+        print("1. הודעה אחר הודעה")
+        print(f"2. העתקה בכמות - עד {MAX_FORWARD_IDS} הודעות בבקשה אחת, ללא קרדיט (מהיר בהרבה; כל החשבונות צריכים גישה לערוץ המקור)")
+
+        while True:
+            choice = input("בחר אפשרות (1/2): ").strip()
+
+            if choice == "1" or choice == "":
+                return False
+            elif choice == "2":
+                logger.info("✅ נבחרה העתקה בכמות.")
+                return True
+            else:
+                logger.error("❌ אפשרות לא תקינה, נסה שוב.")
+
+    def choose_follow_mode(self) -> bool:
+        """בחירה האם לעצור בסוף ההיסטוריה או להמשיך לשקף הודעות חדשות בזמן אמת."""
+        print("\nבסיום ההיסטוריה:")
+        print("1. עצור")
+        print("2. המשך במצב מעקב - הודעות חדשות במקור יועברו מיד כשהן מתפרסמות")
+
+        while True:
+            choice = input("בחר אפשרות (1/2): ").strip()
+
+            if choice == "1" or choice == "":
+                return False
+            elif choice == "2":
+                logger.info("✅ נבחר מצב מעקב.")
+                return True
+            else:
+                logger.error("❌ אפשרות לא תקינה, נסה שוב.")
+
     def random_batch_size(self) -> int:
-        """מחזיר גודל סבב אקראי בין 5 ל-15 הודעות."""
+        """מחזיר גודל סבב אקראי בין 5 ל-15 הודעות (או מנה מלאה במצב העתקה בכמות)."""
+        if self.bulk_copy:
+            return MAX_FORWARD_IDS
         return random.randint(5, 15)
 
+    def classifier(self, file_types: List[str]) -> MediaClassifier:
+        """המסנן המקומפל של סוגי התוכן (נבנה מחדש רק אם הבחירה השתנתה)."""
+        if self.media_filter is None or self.media_filter.file_types != frozenset(file_types):
+            self.media_filter = MediaClassifier(file_types, **self.media_limits)
+        return self.media_filter
+
+    def should_copy(self, source_message: Message, file_types: List[str]) -> bool:
+        """האם ההודעה מתאימה לסוגי התוכן שנבחרו (אותם כללים כמו ב-send_single_message)."""
+        return self.classifier(file_types).matches(source_message)
+
+    def media_matches(self, source_message: Message, file_types: List[str]) -> bool:
+        """בדיקת סוג המדיה של הודעה והתאמה לסוגי הקבצים ולמגבלות הגודל / המשך שנבחרו."""
+        return self.classifier(file_types).media_matches(source_message)
+
     async def send_single_message(self, client: TelegramClient, target_entity_id: int, target_entity_is_forum: bool, source_message: Message, file_types: List[str]) -> bool:
         """שליחת הודעה (טקסט או מדיה) מערוץ מקור לערוץ יעד."""
         client_name = getattr(client, '_account_info', 'לא ידוע')
@@ -390,7 +698,7 @@ class TelegramSender:
             return False # מציין שחשבון זה לא יכול לשלוח כרגע
 
         try:
-            await self.בדוק_הגבלות() # בדיקת קצב שליחה לפני כל ניסיון שליחה
+            await self.בדוק_הגבלות(client, target_entity_id) # בדיקת קצב שליחה לפני כל ניסיון שליחה
 
             message_thread_id = None
 
@@ -399,8 +707,9 @@ class TelegramSender:
                  message_thread_id = 1 # ID של הנושא הכללי (בדרך כלל 1)
                  logger.info(f"💡 ערוץ יעד הוא פורום. שולח לנושא הכללי (ID: {message_thread_id}).")
 
-            # קבל InputPeer עבור היעד האפקטיבי באמצעות ה-ID
-            input_effective_target_entity = await client.get_input_entity(target_entity_id)
+            # InputPeer של היעד מתוך מטמון ה-peers - חיפוש במילון, בלי פנייה לשרת
+            input_effective_target_entity = self.peer_cache.get(client._account_id, self.target_peer_id) or \
+                await self.resolve_peer(client, self.target_peer_id)
 
             send_kwargs = {}
             if message_thread_id is not None:
@@ -410,35 +719,7 @@ class TelegramSender:
 
             # --- לוגיקה חדשה לשליחת הודעות ללא קרדיט ---
             if source_message.media:
-                should_send_media = False
-                # בדיקת סוג המדיה והתאמה לסוגי הקבצים שנבחרו
-                if 'all_media' in file_types:
-                    should_send_media = True
-                elif isinstance(source_message.media, MessageMediaPhoto) and any(ext in ['jpg', 'jpeg', 'png', 'gif', 'webp'] for ext in file_types):
-                    should_send_media = True
-                elif isinstance(source_message.media, MessageMediaDocument):
-                    mime_type = source_message.media.document.mime_type if source_message.media.document else ''
-                    file_ext = None
-                    if source_message.media.document and source_message.media.document.attributes:
-                        for attr in source_message.media.document.attributes:
-                            if hasattr(attr, 'file_name') and attr.file_name:
-                                file_ext = attr.file_name.lower().split('.')[-1]
-                                break
-
-                    if ('video' in mime_type and any(ext in ['mp4', 'avi', 'mkv', 'mov', 'wmv'] for ext in file_types)):
-                        should_send_media = True
-                    elif ('audio' in mime_type and any(ext in ['mp3', 'wav', 'flac', 'aac', 'ogg'] for ext in file_types)):
-                        should_send_media = True
-                    elif (('application/pdf' in mime_type) or (file_ext == 'pdf')) and ('pdf' in file_types):
-                        should_send_media = True
-                    elif (('application/msword' in mime_type) or ('application/vnd.openxmlformats-officedocument.wordprocessingml.document' in mime_type) or (file_ext in ['doc', 'docx'])) and any(ext in ['doc', 'docx'] for ext in file_types):
-                        should_send_media = True
-                    elif (('text/plain' in mime_type) or (file_ext == 'txt')) and ('txt' in file_types):
-                        should_send_media = True
-                    elif file_ext and file_ext in file_types: # עבור סיומות קבצים מותאמות אישית
-                        should_send_media = True
-
-                if should_send_media:
+                if self.media_matches(source_message, file_types):
                     file_to_send = source_message.photo if isinstance(source_message.media, MessageMediaPhoto) else source_message.document
                     
                     if file_to_send: # וודא שיש קובץ לשלוח
@@ -449,7 +730,7 @@ class TelegramSender:
                             **send_kwargs
                         )
                         logger.info(f"✅ [{client_name}] הועברה מדיה (ID: {message_info}) ללא קרדיט. כיתוב: {source_message.text[:50]}...")
-                        self.מונה_הודעות_בדקה += 1
+                        self.rate_controller.on_success(client.session.auth_key.key_id, target_entity_id)
                     else:
                         logger.warning(f"⚠️ [{client_name}] מדלג על הודעת מדיה (ID: {message_info}) ללא קובץ ניתן לשליחה.")
                         return True # דלג בהצלחה על הודעה לא ניתנת לשליחה
@@ -461,7 +742,7 @@ class TelegramSender:
                 if 'text_only' in file_types or 'all_media' in file_types or 'all_text' in file_types:
                     await client.send_message(input_effective_target_entity, message=source_message.text, **send_kwargs)
                     logger.info(f"✅ [{client_name}] נשלחה הודעת טקסט (ID: {message_info}) ללא קרדיט: {source_message.text[:50]}...")
-                    self.מונה_הודעות_בדקה += 1
+                    self.rate_controller.on_success(client.session.auth_key.key_id, target_entity_id)
                 else:
                     logger.info(f"⏩ [{client_name}] מדלג על הודעת טקסט (ID: {message_info}) - נבחרו סוגי מדיה ספציפיים בלבד.")
                     return True
@@ -473,81 +754,234 @@ class TelegramSender:
 
         except errors.FloodWaitError as e:
             await self.handle_flood_wait_for_client(client, e)
-            raise # העלה מחדש את השגיאה כדי ש-send_messages_batch יטפל בה
+            raise # העלה מחדש את השגיאה כדי שההודעה תחזור לתור ותישלח מחשבון אחר
 
         except errors.ChatWriteForbiddenError:
             logger.error(f"❌ אין הרשאה לכתיבה בערוץ יעד זה. [{client_name}]")
-            self.consecutive_successes = 0 # איפוס מונה הצלחות
-            return False
+            raise
+        except (errors.ChannelInvalidError, errors.ChannelPrivateError, errors.PeerIdInvalidError) as e:
+            # ייתכן שה-access_hash במטמון כבר לא תקף - הניסיון הבא יפתור את היעד מחדש
+            self.peer_cache.forget(client._account_id, self.target_peer_id)
+            logger.error(f"❌ ערוץ היעד לא נגיש לחשבון [{client_name}]: {e}. ה-peer הוסר מהמטמון.")
+            raise
         except Exception as e:
             logger.error(f"❌ שגיאה בהעברת הודעה {message_info}: {e}. [{client_name}]", exc_info=True)
-            self.consecutive_successes = 0 # איפוס מונה הצלחות
-            return False
+            raise # הסיווג (זמני / קבוע) נעשה בתור הניסיונות החוזרים
 
-    async def send_messages_batch(self, messages: List[Message], file_types: List[str]) -> List[Message]:
-        """שליחת אצווה של הודעות באמצעות מספר לקוחות באופן מבוקר."""
-        tasks_with_messages = []
-        messages_for_next_retry = [] # הודעות שצריכות ניסיון חוזר (לדוגמה, עקב FloodWait)
-        
-        # מחלק את ההודעות בין הלקוחות הזמינים (שאינם תחת FloodWait)
-        available_clients_for_batch = []
-        for client in self.clients:
-            # וודא שהלקוח תקין ויכול להיבדק עבור session ו-auth_key
-            if hasattr(client, 'session') and hasattr(client.session, 'auth_key') and hasattr(client.session.auth_key, 'key_id'):
-                if client.session.auth_key.key_id not in self.client_flood_wait_until or \
-                   datetime.now() >= self.client_flood_wait_until[client.session.auth_key.key_id]:
-                    available_clients_for_batch.append(client)
-                else:
-                    client_name = getattr(client, '_account_info', 'לא ידוע')
-                    logger.info(f"⏳ חשבון [{client_name}] עדיין נמצא בהמתנת FloodWait. לא ישתתף באצווה זו.")
-            else:
-                client_name = getattr(client, '_account_info', 'לא ידוע')
-                logger.warning(f"⚠️ חשבון [{client_name}] לא תקין או חסר מידע session/auth_key. לא ישתתף באצווה זו.")
+    async def send_album(self, client: TelegramClient, target_entity_id: int, target_entity_is_forum: bool, album: List[Message], file_types: List[str]) -> bool:
+        """שליחת אלבום (הודעות עם אותו grouped_id) כבקשה אחת, עם הכיתוב של כל פריט."""
+        client_name = getattr(client, '_account_info', 'לא ידוע')
+        album_info = f"IDs: {album[0].id}-{album[-1].id}"
 
+        wanted = [message for message in album if message.media and self.media_matches(message, file_types)]
+        if len(wanted) <= 1:
+            if not wanted:
+                logger.info(f"⏩ [{client_name}] מדלג על אלבום ({album_info}) - סוג קובץ לא תואם את ההגדרות הנבחרות.")
+                return True
+            return await self.send_single_message(client, target_entity_id, target_entity_is_forum, wanted[0], file_types)
 
-        if not available_clients_for_batch and messages: # אם אין לקוחות זמינים ויש הודעות לשלוח
-            logger.warning("⚠️ כל החשבונות נמצאים כרגע תחת הגבלת FloodWait או אינם זמינים. ממתין 30 שניות ומנסה שוב.")
-            await asyncio.sleep(30) # המתנה כללית
-            return messages # החזר את כל ההודעות לניסיון חוזר
+        if client.session.auth_key.key_id in self.client_flood_wait_until and \
+           datetime.now() < self.client_flood_wait_until[client.session.auth_key.key_id]:
+            logger.warning(f"⏳ חשבון [{client_name}] עדיין נמצא בהמתנת FloodWait. מדלג על אלבום זה כרגע.")
+            return False
 
-        client_cycle = asyncio.Queue()
-        for client in available_clients_for_batch:
-            await client_cycle.put(client)
+        try:
+            await self.בדוק_הגבלות(client, target_entity_id) # אסימון אחד לכל האלבום
 
-        for message in messages:
-            if client_cycle.empty():
-                messages_for_next_retry.append(message)
-                continue # אין לקוחות זמינים כרגע להודעה זו
+            send_kwargs = {}
+            if target_entity_is_forum:
+                send_kwargs['message_thread_id'] = 1 # ID של הנושא הכללי (בדרך כלל 1)
+
+            input_effective_target_entity = self.peer_cache.get(client._account_id, self.target_peer_id) or \
+                await self.resolve_peer(client, self.target_peer_id)
+            await client.send_file(
+                input_effective_target_entity,
+                file=[message.photo if isinstance(message.media, MessageMediaPhoto) else message.document for message in wanted],
+                caption=[message.text or '' for message in wanted],
+                **send_kwargs
+            )
+            logger.info(f"✅ [{client_name}] הועבר אלבום של {len(wanted)} פריטים ({album_info}) ללא קרדיט, בבקשה אחת.")
+            self.rate_controller.on_success(client.session.auth_key.key_id, target_entity_id, len(wanted))
+            return True
 
-            client_for_task = await client_cycle.get()
-            # קורא ל-send_single_message עם ה-ID של ערוץ היעד והאם הוא פורום
-            tasks_with_messages.append((self.send_single_message(client_for_task, self.target_channel_id, self.target_channel_is_forum, message, file_types), message, client_for_task))
-            await client_cycle.put(client_for_task) # החזר את הלקוח לתור לסיבוב הבא
+        except errors.FloodWaitError as e:
+            await self.handle_flood_wait_for_client(client, e)
+            raise # העלה מחדש את השגיאה כדי שההודעה תחזור לתור ותישלח מחשבון אחר
 
-        # הפעל את המשימות במקביל
-        results = await asyncio.gather(*[task for task, _, _ in tasks_with_messages], return_exceptions=True)
+        except errors.ChatWriteForbiddenError:
+            logger.error(f"❌ אין הרשאה לכתיבה בערוץ יעד זה. [{client_name}]")
+            raise
+        except (errors.ChannelInvalidError, errors.ChannelPrivateError, errors.PeerIdInvalidError) as e:
+            self.peer_cache.forget(client._account_id, self.target_peer_id)
+            logger.error(f"❌ ערוץ היעד לא נגיש לחשבון [{client_name}]: {e}. ה-peer הוסר מהמטמון.")
+            raise
+        except Exception as e:
+            logger.error(f"❌ שגיאה בהעברת אלבום {album_info}: {e}. [{client_name}]", exc_info=True)
+            raise # הסיווג (זמני / קבוע) נעשה בתור הניסיונות החוזרים
 
-        for i, result in enumerate(results):
-            original_task, original_message, client_used = tasks_with_messages[i] # קבל את ההודעה המקורית והלקוח
-            
-            if isinstance(result, errors.FloodWaitError):
-                logger.warning(f"❌ הודעה (ID: {original_message.id}) נכשלה עקב FloodWait עבור חשבון [{getattr(client_used, '_account_info', 'לא ידוע')}]. תנסה שוב באצווה הבאה.")
-                messages_for_next_retry.append(original_message)
-                self.consecutive_successes = 0 # איפוס מונה ההצלחות
-            elif not result: # False מציין כישלון (כמו ChatWriteForbiddenError או Exception כללי)
-                logger.warning(f"❌ הודעה (ID: {original_message.id}) לא נשלחה עקב שגיאה כללית עבור חשבון [{getattr(client_used, '_account_info', 'לא ידוע')}]. תנסה שוב באצווה הבאה.")
-                messages_for_next_retry.append(original_message)
-                self.consecutive_successes = 0 # איפוס מונה ההצלחות
-            elif result: # True (הצלחה)
-                # אם הכל עבר בהצלחה, זה כבר נשמר ב-send_single_message (self.sent_message_ids, self.last_processed_message_id)
-                self.consecutive_successes += 1
-            else: # לא אמור לקרות, אבל למקרה בטיחות
-                logger.error(f"❌ תוצאה לא צפויה עבור הודעה (ID: {original_message.id}): {result}. תנסה שוב.")
-                messages_for_next_retry.append(original_message)
-                self.consecutive_successes = 0 # איפוס מונה ההצלחות
-        
-        return messages_for_next_retry # החזר הודעות שצריכות ניסיון חוזר
+    async def forward_chunk(self, client: TelegramClient, chunk: List[Message]) -> List[Message]:
+        """מעתיק מנה בבקשת ForwardMessages אחת ומחזיר את ההודעות שצריכות את הנתיב הרגיל."""
+        client_name = getattr(client, '_account_info', 'לא ידוע')
+        try:
+            await self.בדוק_הגבלות(client, self.target_channel_id) # אסימון אחד לכל המנה
+            target = self.peer_cache.get(client._account_id, self.target_peer_id) or \
+                await self.resolve_peer(client, self.target_peer_id)
+            source = await self.resolve_peer(client, self.source_peer_id)
+            leftovers = await forward_copies(client, target, source, chunk)
+            self.rate_controller.on_success(client.session.auth_key.key_id, self.target_channel_id, len(chunk) - len(leftovers))
+            logger.info(f"✅ [{client_name}] הועתקו {len(chunk) - len(leftovers)} הודעות (IDs: {chunk[0].id}-{chunk[-1].id}) בבקשה אחת.")
+            return leftovers
+        except errors.FloodWaitError as e:
+            await self.handle_flood_wait_for_client(client, e)
+        except errors.ChatForwardsRestrictedError:
+            logger.warning("⚠️ ערוץ המקור חוסם העברת תוכן. ממשיך בהעתקה הודעה אחר הודעה.")
+            self.bulk_copy = False
+        except Exception as e:
+            logger.warning(f"⚠️ [{client_name}] העתקת מנה נכשלה ({e}). ההודעות יישלחו אחת-אחת.")
+        return chunk
+
+    async def forward_messages_bulk(self, messages: List[Message], file_types: List[str]) -> List[Message]:
+        """
+        העתקה בכמות: מנות של עד 100 הודעות, כל מנה בבקשה אחת של חשבון אחר (לפי הסדר).
+        הודעות שלא מתאימות לסוגי התוכן מדולגות (בלי להירשם כנשלחו); מחזיר את ההודעות שצריכות את הנתיב הרגיל.
+        """
+        wanted = [message for message in messages if self.should_copy(message, file_types)]
+
+        leftovers = []
+        for chunk in chunk_messages(wanted):
+            available = [client for client in self.clients
+                         if datetime.now() >= self.client_flood_wait_until.get(client.session.auth_key.key_id, datetime.min)]
+            if not self.bulk_copy or not available:
+                leftovers.extend(chunk)
+                continue
+            client = available[self._bulk_account_index % len(available)]
+            self._bulk_account_index += 1
+            failed = await self.forward_chunk(client, chunk)
+            failed_ids = {message.id for message in failed}
+            for group in group_albums(chunk):
+                if not any(message.id in failed_ids for message in group):
+                    self.mark_group_sent(group)
+            leftovers.extend(failed)
+        return leftovers
+
+    def account_ready_in(self, client: TelegramClient) -> float:
+        """בעוד כמה שניות החשבון יכול לשלוח ליעד (FloodWait או מגביל הקצב); 0 = עכשיו."""
+        key = client.session.auth_key.key_id
+        flood_wait = (self.client_flood_wait_until.get(key, datetime.min) - datetime.now()).total_seconds()
+        return max(0.0, flood_wait, self.rate_limiter.delay_for(key, self.target_channel_id))
+
+    async def send_group(self, client: TelegramClient, group: List[Message], file_types: List[str]) -> bool:
+        """שליחת הודעה בודדת או אלבום (הודעות עם אותו grouped_id) בבקשה אחת."""
+        try:
+            if len(group) > 1:
+                sent = await self.send_album(client, self.target_channel_id, self.target_channel_is_forum, group, file_types)
+            else:
+                sent = await self.send_single_message(client, self.target_channel_id, self.target_channel_is_forum, group[0], file_types)
+        except Exception as e:
+            metrics.MESSAGES_FAILED.inc(len(group), account=metrics.account_label(client.session.auth_key.key_id),
+                                        target=self.target_channel_id, kind=classify(e))
+            raise
+        if not sent:
+            metrics.MESSAGES_FAILED.inc(len(group), account=metrics.account_label(client.session.auth_key.key_id),
+                                        target=self.target_channel_id, kind=FLOOD)
+        return sent
+
+    def start_workers(self, file_types: List[str]) -> AccountWorkers:
+        """מפעיל עובד קבוע לכל חשבון, שמושך הודעות מתור משותף."""
+        self.workers = AccountWorkers(
+            lambda client, group: self.send_group(client, group, file_types),
+            self.account_ready_in,
+            max_in_flight=self.max_sends_per_account,
+            slots=self.account_slots
+        ).start(self.clients)
+        return self.workers
+
+    def record_failure(self, first_id: int, last_id: int, result) -> str:
+        """
+        רושם כישלון של הודעה / אלבום בתור הניסיונות החוזרים ומחזיר את הסיווג שלו. FLOOD חוזר
+        מיד לתור העובדים (חשבון אחר ייקח אותו); PERMANENT נרשם בקובץ ההודעות שנכשלו ומסומן כמטופל.
+        """
+        error = result if isinstance(result, BaseException) else None
+        kind = self.retry_queue.failed(first_id, last_id, error)
+        if kind == FLOOD:
+            logger.warning(f"❌ הודעה (ID: {first_id}) לא נשלחה ({describe(error)}). חוזרת לתור ותישלח מחשבון פנוי.")
+        elif kind == PERMANENT:
+            self.mark_message_sent(first_id, last_id)
+        return kind
+
+    async def send_messages_batch(self, messages: List[Message], file_types: List[str]) -> Tuple[List[Message], List[Message]]:
+        """
+        שליחת אצווה דרך עובדי החשבונות. מחזיר (נשלחו, לניסיון מיידי); הודעות שנכשלו בשגיאה
+        זמנית או קבועה עוברות לתור הניסיונות החוזרים ולא חוזרות לקורא.
+        """
+        sent = []
+        if self.bulk_copy and messages:
+            # העתקה בכמות; רק מה שלא הועתק ממשיך לנתיב של הודעה אחר הודעה
+            leftovers = await self.forward_messages_bulk(messages, file_types)
+            leftover_ids = {message.id for message in leftovers}
+            sent = [message for message in messages if message.id not in leftover_ids]
+            messages = leftovers
+            if not messages:
+                return sent, []
+
+        # הודעות של אותו אלבום (grouped_id) נשלחות יחד, בבקשה אחת ובאותו חשבון
+        groups = group_albums(messages)
+        futures = [await self.workers.submit(group) for group in groups]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        messages_for_next_retry = []
+        for group, result in zip(groups, results):
+            if result is True:
+                self.mark_group_sent(group)
+                sent.extend(group)
+            elif self.record_failure(group[0].id, group[-1].id, result) == FLOOD:
+                messages_for_next_retry.extend(group)
+        return sent, messages_for_next_retry
+
+    async def run_retries(self, source_entity):
+        """משימת רקע: שולחת שוב את ההודעות שבתור הניסיונות החוזרים כשמגיע זמנן (הודעות טריות מהמקור)."""
+        while True:
+            wait = self.retry_queue.next_due()
+            if wait is None or wait > 0:
+                await asyncio.sleep(min(5.0, wait if wait is not None else 5.0))
+                continue
+            due = self.retry_queue.due()
+            try:
+                # אחזור מחדש: הפניות לקבצים (file_reference) מתחדשות, והודעות שנמחקו מתגלות
+                fetched = await self.clients[0].get_messages(
+                    source_entity, ids=[message_id for first_id, last_id in due for message_id in range(first_id, last_id + 1)]
+                )
+            except Exception as e:
+                for first_id, last_id in due:
+                    self.retry_queue.failed(first_id, last_id, e)
+                await asyncio.sleep(getattr(e, 'seconds', 5))
+                continue
+            by_id = {message.id: message for message in fetched if message}
+            retries = []
+            for first_id, last_id in due:
+                group = [by_id[message_id] for message_id in range(first_id, last_id + 1) if message_id in by_id]
+                if group:
+                    retries.append(self._retry_group(first_id, last_id, group))
+                else:
+                    logger.info(f"⏩ הודעה {first_id} נמחקה מערוץ המקור - יוצאת מתור הניסיונות החוזרים.")
+                    self.retry_queue.succeeded(first_id)
+                    self.mark_message_sent(first_id, last_id)
+            await asyncio.gather(*retries)
 
+    async def _retry_group(self, first_id: int, last_id: int, group: List[Message]):
+        future = await self.workers.submit(group)
+        try:
+            result = await future
+        except Exception as e:
+            result = e
+        if result is True:
+            logger.info(f"✅ הודעה {first_id} נשלחה בניסיון חוזר.")
+            self.retry_queue.succeeded(first_id)
+            self.mark_group_sent(group)
+            self.total_sent += len(group)
+            self.save_progress()
+        else:
+            self.record_failure(first_id, last_id, result)
 
     async def send_messages_round(self, source_entity, file_types: List[str], reset_progress: bool = False):
         """שליחת הודעות בסבבים עם חלוקה הוגנת בין החשבונות מערוץ מקור לערוץ יעד."""
@@ -555,183 +989,297 @@ class TelegramSender:
             logger.error("❌ אין חשבונות זמינים.")
             return
 
+        self.retry_queue = RetryQueue(self.state_store, *self.progress_key)
         if reset_progress:
-            self.sent_message_ids.clear()
+            self.retry_queue.clear()
+            self.journal.reset(*self.progress_key)
             self.last_processed_message_id = 0
+            self.total_sent = 0
             current_fetch_offset_id = 0
-            self.save_progress() # שמירת איפוס ההתקדמות
+            self.state_store.reset_progress(*self.progress_key) # שמירת איפוס ההתקדמות
             logger.info("🔄 מאפס התקדמות - יתחיל להעביר הודעות מתחילת ערוץ המקור (ID > 0).")
         else:
             current_fetch_offset_id = self.last_processed_message_id
             logger.info(f"✅ ימשיך העברת הודעות מ-ID: {current_fetch_offset_id} בערוץ המקור (יביא הודעות עם ID גבוה יותר).")
 
         logger.info(f"📤 מתחיל העברת הודעות מ'{source_entity.title}' ל'{self.target_channel_id}' עם {len(self.clients)} חשבונות.")
-
-        messages_retrying_this_round = [] # הודעות שניסינו לשלוח באצווה הנוכחית ונצטרך לנסות שוב
-        
-        batch_count = 0
-        total_sent_in_run = 0
-
+        PROFILER.begin()
+
+        # המאזין לעדכונים נרשם לפני ההשלמה, כדי שהודעה שמתפרסמת בזמן ההשלמה לא תיפול בין הכיסאות
+        follower = LiveFollower(self.clients[0], source_entity).start() if self.follow else None
+        # קורא מראש את ההיסטוריה ברקע (עד 100 הודעות לבקשה) בזמן שהאצוות נשלחות.
+        # בבחירה של מדיה בלבד השרת מסנן: הודעות טקסט ומדיה מסוג אחר לא מאוחזרות בכלל
+        search_filters = self.classifier(file_types).search_filters()
+        if search_filters:
+            logger.info(f"🔎 אחזור מסונן בצד השרת: {', '.join(f.__name__ for f in search_filters)}")
+        prefetcher = HistoryPrefetcher(self.clients[0], source_entity, current_fetch_offset_id,
+                                       filters=search_filters).start()
+        workers = self.start_workers(file_types)
+        retries = asyncio.create_task(self.run_retries(source_entity))
+        try:
+            await self._send_rounds(prefetcher, file_types, current_fetch_offset_id)
+            if self.retry_queue:
+                logger.info(f"⏳ ממתין ל-{len(self.retry_queue)} הודעות בתור הניסיונות החוזרים...")
+                while self.retry_queue and not retries.done():
+                    await asyncio.sleep(1)
+            if follower:
+                await prefetcher.close()
+                # באחזור מסונן ההתקדמות נעצרת בהודעה המתאימה האחרונה, אבל ההשלמה כיסתה את כל הערוץ -
+                # בלי זה העדכון הראשון היה מאחזר מחדש (בלי סינון) את כל ההודעות שלא התאימו מאז
+                covered_id = await follower.latest_id() if search_filters else None
+                await self._follow(follower, file_types, covered_id)
+        finally:
+            retries.cancel()
+            await asyncio.gather(retries, return_exceptions=True)
+            await prefetcher.close()
+            await workers.close()
+            self.workers = None
+            if follower:
+                await follower.close()
+
+    async def _follow(self, follower: LiveFollower, file_types: List[str], covered_id: Optional[int] = None):
+        """
+        מצב מעקב: שולח הודעות חדשות כשהן מגיעות מהעדכונים, עד שהמשתמש עוצר.
+        covered_id: עד איזה מזהה ההשלמה עברה על המקור (אחרי אחזור מסונן), ראו LiveFollower.begin.
+        """
+        await follower.begin(self.last_processed_message_id, covered_id)
+        current_id = max(self.last_processed_message_id, covered_id or 0)
+        classifier = self.classifier(file_types)
         while True:
-            batch_count += 1
-            messages_in_current_fetch = []
-
-            # קודם כל נסה הודעות מתור הניסיונות החוזרים
-            if messages_retrying_this_round:
-                messages_to_process = messages_retrying_this_round
-                messages_retrying_this_round = [] # נקה את התור
-                logger.info(f"🔁 מעבד {len(messages_to_process)} הודעות מתור הניסיונות החוזרים.")
-            else:
-                # אם אין הודעות לניסיון חוזר, נסה לאחזר חדשות
-                try:
-                    messages_generator = self.clients[0].iter_messages(
-                        source_entity,
-                        offset_id=current_fetch_offset_id,
-                        reverse=True, # סדר כרונולוגי: מהישנה לחדשה
-                        limit=self.random_batch_size() # אחזור אצווה בגודל אקראי
-                    )
-                    
-                    async for message in messages_generator:
-                        # דלג על הודעות שסומנו בעבר כנשלחו
-                        if message.id not in self.sent_message_ids:
-                            messages_in_current_fetch.append(message)
-                        # עדכן את ה-last_processed_message_id רק עבור הודעות חדשות שטרם נשלחו
-                        if message.id > current_fetch_offset_id:
-                            current_fetch_offset_id = message.id 
-
-                    if not messages_in_current_fetch and not messages_retrying_this_round: # אם אין חדשות וגם אין לנסות שוב
-                        logger.info("✅ אין הודעות חדשות לשליחה כרגע בערוץ המקור או שהגענו לסוף ההיסטוריה הזמינה.")
-                        break # יציאה מהלולאה אם אין יותר מה לעשות
-
-                    logger.info(f"✅ נמצאו {len(messages_in_current_fetch)} הודעות באצווה {batch_count} לשליחה (כולל דלוגים פוטנציאליים).")
-                    messages_to_process = messages_in_current_fetch
+            batch = await follower.get_batch(self.random_batch_size())
+            fetch_account = metrics.account_label(self.clients[0].session.auth_key.key_id)
+            metrics.MESSAGES_FETCHED.inc(len(batch), account=fetch_account, target=self.target_channel_id)
+            pending = []
+            for message in batch:
+                if message.id > current_id + 1:
+                    self.mark_message_sent(current_id + 1, message.id - 1) # מזהים שנמחקו
+                current_id = max(current_id, message.id)
+                if message.id in self.sent_message_ids:
+                    continue
+                if classifier.matches(message):
+                    pending.append(message)
+                else:
+                    # לא מתאים לסינון - לא נרשם כנשלח, כדי שהרצה עם סוגי תוכן אחרים תשלח אותו
+                    metrics.MESSAGES_SKIPPED.inc(account=fetch_account, target=self.target_channel_id)
 
-                except errors.FloodWaitError as e:
-                    logger.warning(f"⏰ FloodWait בעת אחזור אצווה מערוץ המקור. ממתין {e.seconds} שניות.")
-                    await asyncio.sleep(e.seconds)
-                    continue # נסה לאחזר את אותה אצווה שוב לאחר ההמתנה
-                except Exception as e:
-                    logger.error(f"❌ שגיאה קריטית באחזור אצווה מערוץ המקור: {e}", exc_info=True)
-                    break # יציאה אם יש שגיאה קריטית באחזור
+            while pending:
+                sent, pending = await self.send_messages_batch(pending, file_types)
+                follower.mark_delivered(sent)
+                self.total_sent += len(sent)
 
-            if messages_to_process:
-                # שליחת האצווה וקבלת הודעות שניסיונן נכשל
-                messages_that_failed_in_batch = await self.send_messages_batch(messages_to_process, file_types)
-                messages_retrying_this_round.extend(messages_that_failed_in_batch)
-                # כמה נשלחו בפועל באצווה זו (הודעות שהיו בתור לעיבוד פחות אלה שנכשלו)
-                total_sent_in_run += (len(messages_to_process) - len(messages_that_failed_in_batch)) 
+            self.last_processed_message_id = current_id
+            self.save_progress()
+            logger.info(f"📡 {follower.latency_report()}")
+
+    async def _send_rounds(self, prefetcher: HistoryPrefetcher, file_types: List[str], current_fetch_offset_id: int):
+        """
+        לולאת השליחה: הודעות מהחוצץ של ה-prefetcher נכנסות לתור של עובדי החשבונות, והתוצאות
+        מטופלות ברגע שהן מגיעות - אין מחסום של אצווה, כך שהשליחה האיטית ביותר לא מעכבת אחרות.
+        """
+        classifier = self.classifier(file_types)
+        outstanding: Dict[int, List[Message]] = {} # ID ראשון -> קבוצה שעוד לא נשלחה בהצלחה
+        completed: asyncio.Queue = asyncio.Queue() # (קבוצה, Future) שהסתיימו; None = האחזור הסתיים
+        fetched_up_to = current_fetch_offset_id # עד לכאן כל ההודעות כבר בתור או מטופלות
+        total_sent_in_run = 0
 
-            else: # אם הגענו לכאן ואין הודעות לעיבוד (גם לא ניסיונות חוזרים)
-                logger.info("✅ כל ההודעות הזמינות עובדו או נכשלו באופן סופי.")
-                break
+        def advance():
+            # נקודת ההמשך: ממש לפני הקבוצה הוותיקה ביותר שעוד לא נשלחה
+            self.last_processed_message_id = min(outstanding) - 1 if outstanding else fetched_up_to
+            self.save_progress()
 
+        async def submit(group: List[Message]):
+            future = await self.workers.submit(group)
+            future.add_done_callback(lambda f: completed.put_nowait((group, f)))
 
-            # השהייה דינמית בין אצוות או ניסיונות חוזרים
-            delay = self.smart_delay()
-            logger.info(f"⏳ ממתין {delay:.1f} שניות (השהיה דינמית)...")
-            await asyncio.sleep(delay)
+        async def feed():
+            nonlocal fetched_up_to, total_sent_in_run
+            batch_count = 0
+            offset_id = current_fetch_offset_id
+            try:
+                while True:
+                    try:
+                        fetched = await prefetcher.get_batch(self.random_batch_size())
+                    except Exception as e:
+                        logger.error(f"❌ שגיאה קריטית באחזור אצווה מערוץ המקור: {e}", exc_info=True)
+                        return # יציאה אם יש שגיאה קריטית באחזור
+                    if not fetched:
+                        logger.info("✅ אין הודעות חדשות לשליחה כרגע בערוץ המקור או שהגענו לסוף ההיסטוריה הזמינה.")
+                        return
+
+                    batch_count += 1
+                    messages_in_current_fetch = []
+                    fetch_account = metrics.account_label(self.clients[0].session.auth_key.key_id)
+                    metrics.MESSAGES_FETCHED.inc(len(fetched), account=fetch_account, target=self.target_channel_id)
+                    for message in fetched:
+                        # באחזור לא מסונן, מזהים שדולגו בין שתי הודעות רצופות לא קיימים בערוץ (נמחקו) -
+                        # מסמנים אותם כמטופלים כדי שה-watermark יתקדם והייצוג יישאר דחוס. באחזור מסונן
+                        # בצד השרת אלה הודעות קיימות שלא התאימו לסינון, ולכן הן לא נרשמות כנשלחו
+                        if message.id > offset_id + 1 and not prefetcher.filters:
+                            self.mark_message_sent(offset_id + 1, message.id - 1)
+                        # דלג על הודעות שסומנו בעבר כנשלחו; הודעות שלא מתאימות לסינון לא מגיעות לשולחים
+                        # בכלל ולא נרשמות כנשלחו (נקודת ההמשך עדיין מתקדמת אחריהן)
+                        if message.id not in self.sent_message_ids and message.id not in self.retry_queue:
+                            if classifier.matches(message):
+                                messages_in_current_fetch.append(message)
+                            else:
+                                metrics.MESSAGES_SKIPPED.inc(account=fetch_account, target=self.target_channel_id)
+                        offset_id = max(offset_id, message.id)
+
+                    if messages_in_current_fetch and self.bulk_copy:
+                        # העתקה בכמות; רק מה שלא הועתק ממשיך לעובדי החשבונות
+                        leftovers = await self.forward_messages_bulk(messages_in_current_fetch, file_types)
+                        copied = len(messages_in_current_fetch) - len(leftovers)
+                        total_sent_in_run += copied
+                        self.total_sent += copied
+                        messages_in_current_fetch = leftovers
+                    if messages_in_current_fetch:
+                        logger.info(f"✅ נמצאו {len(messages_in_current_fetch)} הודעות באצווה {batch_count} לשליחה.")
+                    # הודעות של אותו אלבום (grouped_id) נשלחות יחד, בבקשה אחת ובאותו חשבון
+                    for group in group_albums(messages_in_current_fetch):
+                        outstanding[group[0].id] = group
+                        await submit(group) # ממתין כשהתור מלא - האחזור לא רץ רחוק מדי לפני השליחה
+                    fetched_up_to = offset_id
+                    advance()
+
+                    # אין השהיה קבועה בין אצוות - הקצב נקבע ע"י מגביל הקצב ובקר ה-AIMD
+                    rates = ', '.join(f"{getattr(client, '_account_info', 'לא ידוע')}: {self.rate_controller.current_rate(client.session.auth_key.key_id, self.target_channel_id):.1f}" for client in self.clients)
+                    logger.info(f"📈 קצב שליחה נוכחי (הודעות לדקה): {rates} | בתור: {self.workers.pending}")
+            finally:
+                completed.put_nowait(None)
+
+        feeder = asyncio.create_task(feed())
+        try:
+            feeding = True
+            while feeding or outstanding:
+                entry = await completed.get()
+                if entry is None:
+                    feeding = False
+                    continue
+                group, future = entry
+                if future.cancelled():
+                    continue
+                result = future.exception() or future.result()
+                if result is True:
+                    self.mark_group_sent(group)
+                    total_sent_in_run += len(group)
+                    self.total_sent += len(group)
+                elif self.record_failure(group[0].id, group[-1].id, result) == FLOOD:
+                    await submit(group) # חוזרת לסוף התור; החשבון הפנוי הבא ייקח אותה
+                    continue
+                # נשלחה, או עברה לתור הניסיונות החוזרים / לקובץ ההודעות שנכשלו - לא מעכבת את נקודת ההמשך
+                del outstanding[group[0].id]
+                advance()
+        finally:
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
 
+        advance()
         logger.info(f"\n✅ העברת הודעות הסתיימה. סה\"כ נשלחו {total_sent_in_run} הודעות בהרצה זו.")
 
-    async def run(self):
-        """הפעלת הסקריפט הראשי."""
-        logger.info("=== 📱 מעביר הודעות טלגרם (גרסה מתקדמת) ===\n")
-
-        self.clients = await self.load_clients(SESSIONS_FILE)
-        if not self.clients:
-            logger.error("❌ לא נטענו חשבונות, יוצא.")
-            return
-
-        self.load_progress()
-
-        source_entity = await self.choose_source_channel(self.clients[0])
-        if not source_entity:
-            logger.error("❌ לא נבחר ערוץ מקור, יוצא.")
-            return
-
-        # בחירת ערוץ יעד ושמירת ה-ID שלו
-        target_entity = await self.choose_target_channel(self.clients[0])
-        if not target_entity:
-            logger.error("❌ לא נבחר ערוץ יעד, יוצא.")
-            return
-        
+    async def prepare_target(self, source_entity, target_entity) -> bool:
+        """
+        מגדיר את צמד המקור/יעד: טוען את ההתקדמות, בודק slow mode ומשאיר רק חשבונות
+        שעברו את בדיקת השליחה ליעד. מחזיר False אם אי אפשר להמשיך.
+        """
         self.target_channel_id = target_entity.id
+        self.target_peer_id = utils.get_peer_id(target_entity)
+        self.source_peer_id = utils.get_peer_id(source_entity)
         self.target_channel_is_forum = getattr(target_entity, 'forum', False)
 
+        if self.load_progress(utils.get_peer_id(source_entity), utils.get_peer_id(target_entity)) is None:
+            return False
+
+        await self.detect_slow_mode(self._pool_clients()[0], target_entity)
+
         # --- בדיקת יכולת שליחה לערוץ היעד עבור כל החשבונות ---
         logger.info("\n--- בדיקת יכולת שליחה לערוץ היעד עבור כל החשבונות ---")
-        for client in self.clients:
-            client_name = getattr(client, '_account_info', 'לא ידוע')
-            try:
-                # נסה לשלוח הודעת בדיקה קצרה
-                test_message_text = f"בדיקה: חשבון [{client_name}] יכול לשלוח לערוץ (ID: {self.target_channel_id})."
-                
-                test_thread_id = None
-                # אם היעד הוא Chat (קבוצה) ומוגדר כפורום
-                if self.target_channel_is_forum:
-                    test_thread_id = 1
-                
-                test_kwargs = {}
-                if test_thread_id is not None:
-                    test_kwargs['message_thread_id'] = test_thread_id
-
-                # שולח באמצעות ה-ID של ערוץ היעד
-                await client.send_message(self.target_channel_id, message=test_message_text, **test_kwargs)
-                logger.info(f"✅ חשבון [{client_name}] עבר את בדיקת השליחה לערוץ היעד.")
-                await asyncio.sleep(self.smart_delay()) # השהיה קצרה בין בדיקות
-            except errors.ChannelInvalidError as e:
-                logger.critical(f"❌ חשבון [{client_name}] נכשל בבדיקת השליחה לערוץ היעד (ID: {self.target_channel_id}). שגיאה: {e}. יש לבדוק הרשאות או סוג ערוץ/קבוצה.")
-                if client.session.auth_key.key_id not in self.client_flood_wait_until:
-                    self.client_flood_wait_until[client.session.auth_key.key_id] = datetime.now() + timedelta(days=999) # סמן כחסום לתמיד לצורך הבדיקה
-            except Exception as e:
-                logger.critical(f"❌ חשבון [{client_name}] נכשל בבדיקת השליחה לערוץ היעד (ID: {self.target_channel_id}) עם שגיאה לא צפויה: {e}", exc_info=True)
-                if client.session.auth_key.key_id not in self.client_flood_wait_until:
-                    self.client_flood_wait_until[client.session.auth_key.key_id] = datetime.now() + timedelta(days=999) # סמן כחסום לתמיד
-
-        # נותרנו רק עם הלקוחות שעברו את הבדיקה או שהם לא תחת חסימה קבועה
-        self.clients = [client for client in self.clients if client.session.auth_key.key_id not in self.client_flood_wait_until or datetime.now() < self.client_flood_wait_until[client.session.auth_key.key_id]]
+        # עוברים על עותק: חשבון שמצטרף באמצע הבדיקה נבדק ע"י _add_late_client.
+        # self.clients מכאן והלאה מכיל רק חשבונות שעברו את הבדיקה
+        for client in list(self._pool_clients()):
+            await self.check_send_permission(client)
         if not self.clients:
             logger.critical("❌ אף חשבון לא עבר את בדיקת השליחה לערוץ היעד. לא ניתן להמשיך.")
-            return
+            return False
 
         logger.info("\n--- סיום בדיקת יכולת שליחה ---")
         # --- סוף בדיקת שליחה מוקדמת ---
+        return True
 
+    async def run(self):
+        """הפעלת הסקריפט הראשי."""
+        logger.info("=== 📱 מעביר הודעות טלגרם (גרסה מתקדמת) ===\n")
+        metrics_server = None
+        # גם ביציאה מוקדמת (אין חשבונות, לא נבחר ערוץ) החשבונות, היומן, המאגר ושרת המדדים נסגרים ב-finally
+        try:
+            metrics_server = await metrics.start_server() # רק אם METRICS_PORT מוגדר
+
+            self.clients = await self.load_clients(SESSIONS_FILE)
+            if not self.clients:
+                logger.error("❌ לא נטענו חשבונות, יוצא.")
+                return
+
+            source_entity = await self.choose_source_channel(self.clients[0])
+            if not source_entity:
+                logger.error("❌ לא נבחר ערוץ מקור, יוצא.")
+                return
+
+            # בחירת ערוץ יעד ושמירת ה-ID שלו
+            target_entity = await self.choose_target_channel(self.clients[0])
+            if not target_entity:
+                logger.error("❌ לא נבחר ערוץ יעד, יוצא.")
+                return
+
+            if not await self.prepare_target(source_entity, target_entity):
+                return
+
+            file_types = self.choose_file_types()
+            if 'text_only' in file_types:
+                logger.info("✅ נבחרו הודעות טקסט בלבד. קבצי מדיה ידלגו.")
+            elif 'all_media' in file_types and 'all_text' in file_types:
+                logger.info("✅ נבחרו כל סוגי התוכן (טקסט ומדיה).")
+            elif 'all_media' in file_types:
+                logger.info("✅ נבחרו כל סוגי המדיה בלבד. הודעות טקסט פשוטות ידלגו.")
+            else:
+                logger.info(f"✅ סוגי קבצים נבחרים: {', '.join(file_types)}. הודעות טקסט פשוטות ידלגו.")
+            if file_types != ['text_only']:
+                self.media_limits = self.choose_media_limits()
 
-        file_types = self.choose_file_types()
-        if 'text_only' in file_types:
-            logger.info("✅ נבחרו הודעות טקסט בלבד. קבצי מדיה ידלגו.")
-        elif 'all_media' in file_types and 'all_text' in file_types:
-            logger.info("✅ נבחרו כל סוגי התוכן (טקסט ומדיה).")
-        elif 'all_media' in file_types:
-            logger.info("✅ נבחרו כל סוגי המדיה בלבד. הודעות טקסט פשוטות ידלגו.")
-        else:
-            logger.info(f"✅ סוגי קבצים נבחרים: {', '.join(file_types)}. הודעות טקסט פשוטות ידלגו.")
+            reset_progress = False
+            if self.sent_message_ids or self.last_processed_message_id > 0:
+                reset_progress = self.choose_reset_progress()
 
-        reset_progress = False
-        if self.sent_message_ids or self.last_processed_message_id > 0:
-            reset_progress = self.choose_reset_progress()
+            # ForwardMessages לא שולח לנושא מסוים בפורום - ביעד פורום נשארים בהעתקה הודעה אחר הודעה
+            if not self.target_channel_is_forum:
+                self.bulk_copy = self.choose_bulk_copy()
 
-        try:
-            await self.send_messages_round(source_entity, file_types, reset_progress)
-            logger.info("\n🎉 העברת ההודעות הושלמה בהצלחה!")
+            self.follow = self.choose_follow_mode()
 
-        except KeyboardInterrupt:
-            logger.info("\n⏹️ העברת ההודעות הופסקה על ידי המשתמש.")
-            self.save_progress()
+            try:
+                await self.send_messages_round(source_entity, file_types, reset_progress)
+                logger.info("\n🎉 העברת ההודעות הושלמה בהצלחה!")
 
-        except Exception as e:
-            logger.critical(f"\n❌ שגיאה כללית במהלך ההעברה: {e}", exc_info=True)
-            self.save_progress()
+            except KeyboardInterrupt:
+                logger.info("\n⏹️ העברת ההודעות הופסקה על ידי המשתמש.")
+                self.save_progress()
+
+            except Exception as e:
+                logger.critical(f"\n❌ שגיאה כללית במהלך ההעברה: {e}", exc_info=True)
+                self.save_progress()
 
         finally:
-            for client in self.clients:
+            for task in self._login_tasks:
+                task.cancel()
+            for client in self._clients: # גם חשבונות שלא עברו את בדיקת השליחה
                 try:
                     if client.is_connected():
                         await client.disconnect()
                 except Exception as e:
                     logger.error(f"שגיאה בניתוק חשבון: {e}")
             logger.info("✅ כל החשבונות נותקו.")
+            self.journal.close()
+            self.state_store.close()
+            if metrics_server:
+                metrics_server.close()
 
 async def main():
     sender = TelegramSender()
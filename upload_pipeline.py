@@ -0,0 +1,95 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Generic, Optional, Set, Tuple, TypeVar, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class UploadPipeline(Generic[T, R]):
+    """
+    מריץ את prepare (הורדה והעלאה מחדש של מדיה) על הפריטים הבאים במשימות רקע, בזמן שהקורא
+    שולח את הפריט הנוכחי - ומחזיר את התוצאות בסדר המקורי. לכל היותר workers פריטים מוכנים
+    או בהכנה לפני הפריט שנשלח, וסך הגדלים (size) של הפריטים שבהכנה לא עולה על max_bytes
+    (פריט גדול מהתקציב עצמו מתחיל רק כשאין אחר בהכנה).
+    """
+
+    def __init__(self, prepare: Callable[[T], Awaitable[R]], size: Callable[[T], int], *,
+                 workers: int = 3, max_bytes: int = 300 * 1024 * 1024):
+        self.prepare = prepare
+        self.size = size
+        self.workers = workers
+        self.max_bytes = max_bytes
+
+        self.bytes_in_flight = 0
+        self._slots = asyncio.Semaphore(workers)
+        self._budget = asyncio.Condition()
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: Set[asyncio.Task] = set()
+        self._feeder: Optional[asyncio.Task] = None
+
+    async def close(self):
+        tasks = [task for task in [self._feeder, *self._tasks] if task and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _prepare(self, item: T, size: int) -> R:
+        try:
+            return await self.prepare(item)
+        finally:
+            async with self._budget:
+                self.bytes_in_flight -= size
+                self._budget.notify_all()
+
+    async def _feed(self, items: AsyncIterator[T]):
+        try:
+            async for item in items:
+                size = self.size(item)
+                await self._slots.acquire()
+                async with self._budget:
+                    await self._budget.wait_for(
+                        lambda: not self.bytes_in_flight or self.bytes_in_flight + size <= self.max_bytes
+                    )
+                    self.bytes_in_flight += size
+                task = asyncio.create_task(self._prepare(item, size))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                self._ready.put_nowait((item, task))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._ready.put_nowait((None, e))
+            return
+        self._ready.put_nowait(None)
+
+    async def map(self, items: AsyncIterator[T]) -> AsyncIterator[Tuple[T, Union[R, Exception]]]:
+        """
+        מחזיר (פריט, תוצאה) לפי סדר items. אם prepare נכשל, התוצאה היא החריגה עצמה -
+        כדי שהקורא יחליט אם לנסות שוב בדרך אחרת. שגיאה באיטרציה על items עולה לקורא.
+        """
+        self._feeder = asyncio.create_task(self._feed(items))
+        while True:
+            entry = await self._ready.get()
+            if entry is None:
+                return
+            item, task = entry
+            if isinstance(task, Exception):
+                raise task
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = e
+            finally:
+                self._slots.release()
+            yield item, result